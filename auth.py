@@ -1,20 +1,31 @@
 from passlib.context import CryptContext
-from database import SessionLocal, User
+from sqlalchemy.exc import IntegrityError
+from database import SessionLocal, WriteSessionLocal, User
 from config import settings
-from jose import jwt
+from jose import JWTError, jwt
+from dataclasses import dataclass
 from datetime import datetime, timedelta
+from typing import Optional
 import logging
+import threading
+import time
 
 logging.basicConfig(level=logging.INFO)
 logger = logging.getLogger(__name__)
 
 pwd_context = CryptContext(schemes=["argon2", "bcrypt"], deprecated="auto")
 
+# argon2 на каждый хэш берёт десятки мегабайт памяти и целое ядро, поэтому
+# одновременно считаем не больше PASSWORD_HASH_CONCURRENCY хэшей — остальные
+# логины ждут в своём потоке, не занимая процессор
+_hash_slots = threading.BoundedSemaphore(settings.PASSWORD_HASH_CONCURRENCY)
+
 def verify_password(plain_password, hashed_password):
     if not plain_password or not hashed_password:
         return False
     try:
-        return pwd_context.verify(plain_password, hashed_password)
+        with _hash_slots:
+            return pwd_context.verify(plain_password, hashed_password)
     except Exception as e:
         logger.error(f"Ошибка проверки пароля: {e}")
         return False
@@ -23,7 +34,8 @@ def get_password_hash(password):
     if not password:
         return None
     try:
-        return pwd_context.hash(password)
+        with _hash_slots:
+            return pwd_context.hash(password)
     except Exception as e:
         logger.error(f"Ошибка хэширования пароля: {e}")
         raise
@@ -43,8 +55,121 @@ def create_access_token(data: dict, expires_delta: timedelta = None):
     encoded_jwt = jwt.encode(to_encode, settings.SECRET_KEY, algorithm="HS256")
     return encoded_jwt
 
+
+# === Сессии пользователей ===
+# В токене лежат id, права и версия токенов пользователя. Запрос сверяет их
+# с записью пользователя из кэша процесса, так что в базу ходит только промах
+# кэша. Смена имени, пароля или прав увеличивает token_version — выданные
+# раньше токены перестают подходить. Другой процесс увидит это, когда у него
+# истечёт запись кэша (USER_CACHE_TTL)
+
+@dataclass(frozen=True)
+class SessionUser:
+    """Снимок записи пользователя, не привязанный к сессии базы"""
+    id: int
+    username: str
+    email: Optional[str]
+    is_admin: int
+    token_version: int
+
+
+class UserCache:
+    """Записи пользователей по id на ttl секунд; None — пользователя нет"""
+
+    _MISSING = object()
+
+    def __init__(self, ttl: float, max_entries: int):
+        self.ttl = ttl
+        self.max_entries = max_entries
+        self._entries = {}  # id -> (снимок или None, когда загружен)
+        self._lock = threading.Lock()
+        # Загрузка, начатая до инвалидации, не должна положить в кэш старую запись
+        self.generation = 0
+        # Для /metrics; чтение идёт без блокировки, так что счёт приблизительный
+        self.hits = 0
+        self.misses = 0
+
+    def get(self, user_id: int):
+        """Снимок, None для удалённого пользователя или UserCache._MISSING"""
+        entry = self._entries.get(user_id)
+        if entry is None or time.monotonic() - entry[1] > self.ttl:
+            self.misses += 1
+            return self._MISSING
+        self.hits += 1
+        return entry[0]
+
+    def put(self, user_id: int, user: Optional[SessionUser], generation: int):
+        with self._lock:
+            if generation != self.generation:
+                return
+            if user_id not in self._entries and len(self._entries) >= self.max_entries:
+                # Вытесняем самую старую по вставке запись
+                self._entries.pop(next(iter(self._entries)))
+            self._entries[user_id] = (user, time.monotonic())
+
+    def invalidate(self, user_id: int):
+        with self._lock:
+            self.generation += 1
+            self._entries.pop(user_id, None)
+
+
+user_cache = UserCache(settings.USER_CACHE_TTL, settings.USER_CACHE_MAX_ENTRIES)
+
+
+def create_session_token(user) -> str:
+    return create_access_token(data={
+        "sub": user.username,
+        "uid": user.id,
+        "adm": int(bool(user.is_admin)),
+        "ver": user.token_version or 0,
+    })
+
+
+def revoke_tokens(user: User):
+    """Отзывает выданные пользователю токены; из кэша запись убирает forget_user после commit"""
+    user.token_version = (user.token_version or 0) + 1
+
+
+def forget_user(user_id: int):
+    """Вызывается после commit изменений пользователя, иначе кэш может успеть взять старую запись"""
+    user_cache.invalidate(user_id)
+
+
+def load_session_user(user_id: int) -> Optional[SessionUser]:
+    user = user_cache.get(user_id)
+    if user is not UserCache._MISSING:
+        return user
+    generation = user_cache.generation
+    with SessionLocal() as db:
+        row = db.get(User, user_id)
+        user = row and SessionUser(
+            id=row.id, username=row.username, email=row.email,
+            is_admin=row.is_admin or 0, token_version=row.token_version or 0,
+        )
+    user_cache.put(user_id, user, generation)
+    return user
+
+
+def user_from_token(token: Optional[str]) -> Optional[SessionUser]:
+    """Пользователь по токену из cookie или None, если токен неверный, истёк или отозван"""
+    if not token:
+        return None
+    try:
+        payload = jwt.decode(token, settings.SECRET_KEY, algorithms=["HS256"])
+    except JWTError:
+        return None
+    user_id = payload.get("uid")
+    if not isinstance(user_id, int):
+        # Токен выдан до появления claims — нужен повторный вход
+        return None
+    user = load_session_user(user_id)
+    if (user is None or user.token_version != payload.get("ver")
+            or int(bool(user.is_admin)) != payload.get("adm")):
+        return None
+    return user
+
 def init_admin_user():
-    db = SessionLocal()
+    db = WriteSessionLocal()
     try:
         user = db.query(User).filter(User.username == settings.ADMIN_USERNAME).first()
         if not user:
@@ -60,6 +185,9 @@ def init_admin_user():
             db.add(admin_user)
             db.commit()
             logger.info(f"Администратор {settings.ADMIN_USERNAME} успешно создан")
+    except IntegrityError:
+        # Несколько процессов стартуют разом — администратора уже создал соседний
+        db.rollback()
     except Exception as e:
         logger.error(f"Ошибка при инициализации администратора: {e}")
         raise
@@ -0,0 +1,112 @@
+"""
+Цена авторизации одного запроса: прежний get_current_user (разбор токена и
+запрос пользователя по имени при каждом вызове, на страницах — дважды:
+зависимостью и ещё раз в обработчике) против нынешнего, который сверяет
+claims токена с записью из кэша процесса и разбирает токен один раз за запрос.
+
+Печатает запросов в секунду к лёгкому обработчику, которому нужен только
+пользователь, и сколько запросов к таблице users ушло в базу на один запрос.
+Строка "кэш выключен" — USER_CACHE_TTL=0: каждый запрос читает запись по id.
+
+Приложение вызывается в процессе через ASGI, без сети, на временной базе.
+Запуск из корня проекта:
+    python -m benchmarks.bench_auth [--requests 2000]
+"""
+import argparse
+import asyncio
+import logging
+import os
+import tempfile
+import time
+
+import httpx
+from fastapi import Depends, Request
+from jose import jwt
+from sqlalchemy import create_engine, event
+from sqlalchemy.orm import Session, sessionmaker
+
+import auth
+from config import settings
+from database import Base, SessionLocal, User, get_db
+from main import app, get_current_user
+
+
+def legacy_current_user(request: Request, db: Session = Depends(get_db)):
+    token = request.cookies.get("access_token")
+    if not token:
+        return None
+    try:
+        payload = jwt.decode(token, settings.SECRET_KEY, algorithms=["HS256"])
+        return db.query(User).filter(User.username == payload.get("sub")).first()
+    except Exception:
+        return None
+
+
+def legacy_page(request: Request, db: Session = Depends(get_db), user: User = Depends(legacy_current_user)):
+    # Как index и toggle_admin_status: пользователь ещё раз разбирается в обработчике
+    user = legacy_current_user(request, db)
+    return {"id": user.id, "is_admin": user.is_admin}
+
+
+def current_page(request: Request, user=Depends(get_current_user)):
+    user = get_current_user(request)
+    return {"id": user.id, "is_admin": user.is_admin}
+
+
+class UserQueries:
+    """Сколько запросов к таблице users ушло в базу"""
+
+    def __init__(self, engine):
+        self.count = 0
+        event.listen(engine, "before_cursor_execute", self.seen)
+
+    def seen(self, conn, cursor, statement, parameters, context, executemany):
+        if "FROM users" in statement:
+            self.count += 1
+
+
+async def run(args):
+    tmp_dir = tempfile.mkdtemp()
+    engine = create_engine(f"sqlite:///{os.path.join(tmp_dir, 'bench.db')}", connect_args={"check_same_thread": False})
+    Base.metadata.create_all(bind=engine)
+    with sessionmaker(bind=engine)() as db:
+        user = User(username="bench", password="-", is_admin=1)
+        db.add(user)
+        db.commit()
+        token = auth.create_session_token(user)
+    SessionLocal.configure(bind=engine)
+    queries = UserQueries(engine)
+
+    app.add_api_route("/legacy/whoami", legacy_page)
+    app.add_api_route("/current/whoami", current_page)
+    scenarios = [
+        ("прежний, два разбора", "/legacy/whoami", None),
+        ("кэш выключен", "/current/whoami", 0),
+        ("кэш пользователей", "/current/whoami", settings.USER_CACHE_TTL),
+    ]
+    transport = httpx.ASGITransport(app=app)
+    async with httpx.AsyncClient(transport=transport, base_url="http://bench", cookies={"access_token": token}) as client:
+        print(f"запросов: {args.requests}")
+        print(f"{'сценарий':<24} {'запросов/с':>11} {'к users на запрос':>18}")
+        for label, url, ttl in scenarios:
+            if ttl is not None:
+                auth.user_cache.ttl = ttl
+            assert (await client.get(url)).status_code == 200
+            queries.count = 0
+            started = time.perf_counter()
+            for _ in range(args.requests):
+                await client.get(url)
+            elapsed = time.perf_counter() - started
+            print(f"{label:<24} {args.requests / elapsed:>11.0f} {queries.count / args.requests:>18.2f}")
+    engine.dispose()
+
+
+def main():
+    logging.getLogger("httpx").setLevel(logging.WARNING)
+    arg_parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    arg_parser.add_argument("--requests", type=int, default=2000)
+    asyncio.run(run(arg_parser.parse_args()))
+
+
+if __name__ == "__main__":
+    main()
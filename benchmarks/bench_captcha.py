@@ -0,0 +1,87 @@
+"""
+Хранение ответов на капчу под потоком показов /register (как от бота,
+который не отправляет форму): прежний словарь в памяти процесса, который
+только растёт, против ephemeral.MemoryStore и ephemeral.DatabaseStore с
+ограничением числа записей.
+
+Печатает, сколько записей и памяти осталось после показов, и сколько пар
+"показать капчу — проверить ответ" в секунду выдерживает каждое хранилище.
+Запуск из корня проекта:
+    python -m benchmarks.bench_captcha [--shows 100000] [--max-entries 10000]
+"""
+import argparse
+import os
+import tempfile
+import time
+import tracemalloc
+import uuid
+
+from database import Base, SessionLocal, WriteSessionLocal, create_db_engine
+from ephemeral import DatabaseStore, MemoryStore
+
+
+class LegacyStore:
+    """Как captcha_store раньше: словарь без срока жизни и предела"""
+
+    def __init__(self):
+        self.entries = {}
+
+    def put(self, namespace, key, value, ttl):
+        self.entries[key] = value
+
+    def pop(self, namespace, key):
+        return self.entries.get(key)
+
+    def __len__(self):
+        return len(self.entries)
+
+
+def flood(store, shows: int) -> int:
+    """Показы капчи без ответа; возвращает прирост памяти в байтах"""
+    tracemalloc.start()
+    for _ in range(shows):
+        store.put("captcha", str(uuid.uuid4()), "7", 600)
+    grown = tracemalloc.get_traced_memory()[0]
+    tracemalloc.stop()
+    return grown
+
+
+def round_trips(store, count: int) -> float:
+    """Показ и проверка ответа, пар в секунду"""
+    started = time.perf_counter()
+    for _ in range(count):
+        key = str(uuid.uuid4())
+        store.put("captcha", key, "7", 600)
+        assert store.pop("captcha", key) == "7"
+    return count / (time.perf_counter() - started)
+
+
+def main():
+    arg_parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    arg_parser.add_argument("--shows", type=int, default=100000)
+    arg_parser.add_argument("--max-entries", type=int, default=10000)
+    arg_parser.add_argument("--round-trips", type=int, default=2000)
+    args = arg_parser.parse_args()
+
+    tmp_dir = tempfile.mkdtemp()
+    # Движок с теми же настройками SQLite, что и у приложения (WAL, synchronous)
+    engine = create_db_engine(f"sqlite:///{os.path.join(tmp_dir, 'bench.db')}")
+    Base.metadata.create_all(bind=engine)
+    SessionLocal.configure(bind=engine)
+    WriteSessionLocal.configure(bind=engine.execution_options(sqlite_write=True))
+
+    stores = (
+        ("словарь без предела", LegacyStore()),
+        ("MemoryStore", MemoryStore(args.max_entries)),
+        ("DatabaseStore (SQLite)", DatabaseStore(args.max_entries)),
+    )
+    print(f"показов: {args.shows}, предел: {args.max_entries}")
+    print(f"{'хранилище':<24} {'записей':>9} {'память, МБ':>11} {'пар/с':>8}")
+    for label, store in stores:
+        grown = flood(store, args.shows)
+        print(f"{label:<24} {len(store):>9} {grown / 1024 / 1024:>11.1f} {round_trips(store, args.round_trips):>8.0f}")
+    engine.dispose()
+
+
+if __name__ == "__main__":
+    main()
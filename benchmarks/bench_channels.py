@@ -0,0 +1,88 @@
+"""
+Каналы в ChannelTable против списка словарей (как их держал парсер раньше):
+память, которую занимают разобранные каналы, и скорость разбора, генерации
+M3U и кодирования в JSON.
+
+Запуск из корня проекта:
+    python -m benchmarks.bench_channels [--channels 100000,500000] [--repeat 3]
+"""
+import argparse
+import gc
+import json
+import tracemalloc
+
+from benchmarks.common import best_of, synthetic_m3u
+from utils.generator import generate_m3u
+from utils.parser import parse_attributes, parse_extinf, parse_m3u
+
+
+def dict_parse_m3u(content: str) -> list:
+    """Тот же разбор, но каждый канал — словарь со своей копией tvg_url"""
+    channels = []
+    tvg_url = None
+    pending = None
+    for line in content.splitlines():
+        line = line.strip()
+        if not line:
+            continue
+        if line.startswith("#EXTM3U"):
+            tvg_url = parse_attributes(line).get("url-tvg")
+        elif line.startswith("#EXTINF:"):
+            pending = parse_extinf(line)
+        elif line[0] != "#" and pending is not None:
+            attrs, name = pending
+            pop = attrs.pop
+            channels.append({
+                "name": name, "tvg_id": pop("tvg-id", None), "tvg_name": pop("tvg-name", None),
+                "tvg_logo": pop("tvg-logo", None), "group_title": pop("group-title", None),
+                "url": line, "tvg_url": tvg_url, "attrs": attrs,
+            })
+            pending = None
+    return channels
+
+
+def retained(build) -> int:
+    """Сколько памяти остаётся занято результатом build()"""
+    gc.collect()
+    tracemalloc.start()
+    result = build()
+    size, _ = tracemalloc.get_traced_memory()
+    tracemalloc.stop()
+    del result
+    return size
+
+
+def main():
+    arg_parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    arg_parser.add_argument("--channels", default="100000,500000")
+    arg_parser.add_argument("--repeat", type=int, default=3)
+    args = arg_parser.parse_args()
+
+    mb = 1024 * 1024
+    for count in (int(c) for c in args.channels.split(",")):
+        content = synthetic_m3u(count * 2)
+        dicts = dict_parse_m3u(content)
+        table = parse_m3u(content)["channels"]
+        assert len(dicts) == len(table) == count
+        assert generate_m3u(dicts, table.tvg_url) == generate_m3u(table, table.tvg_url)
+        assert [json.loads(item) for item in table.json_items()] == dicts
+
+        print(f"каналов: {count}, файл: {len(content.encode('utf-8')) / mb:.1f} МБ")
+        print(f"{'':<18} {'словари':>12} {'ChannelTable':>14}")
+        print(f"{'память, МБ':<18} {retained(lambda: dict_parse_m3u(content)) / mb:>12.1f} "
+              f"{retained(lambda: parse_m3u(content)) / mb:>14.1f}")
+        scenarios = (
+            ("разбор", lambda: dict_parse_m3u(content), lambda: parse_m3u(content)),
+            ("генерация M3U", lambda: generate_m3u(dicts), lambda: generate_m3u(table)),
+            ("JSON", lambda: ",".join(json.dumps(ch, ensure_ascii=False) for ch in dicts),
+             lambda: ",".join(table.json_items())),
+        )
+        for title, legacy, current in scenarios:
+            legacy_rate = count / best_of(legacy, args.repeat)
+            current_rate = count / best_of(current, args.repeat)
+            print(f"{title + ', кан/с':<18} {legacy_rate:>12.0f} {current_rate:>14.0f}")
+        print()
+
+
+if __name__ == "__main__":
+    main()
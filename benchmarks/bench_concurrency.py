@@ -0,0 +1,162 @@
+"""
+Хвостовые задержки /{playlist_id}.m3u, пока параллельно идут загрузки
+больших плейлистов через /upload и логины (проверка пароля argon2).
+
+Сервер запускается отдельным процессом uvicorn на копии проекта с пустой
+базой: сначала замер только чтения, затем чтение под фоновой нагрузкой.
+--app-dir позволяет сравнить с другой версией кода, например:
+    git worktree add /tmp/iptv-old <коммит>
+    python -m benchmarks.bench_concurrency --app-dir /tmp/iptv-old
+
+Запуск из корня проекта:
+    python -m benchmarks.bench_concurrency [--channels 200000] [--seconds 10]
+"""
+import argparse
+import asyncio
+import os
+import shutil
+import socket
+import subprocess
+import sys
+import tempfile
+import time
+
+import httpx
+
+from benchmarks.common import synthetic_channels, synthetic_m3u
+
+BENCH_USER = "bench"
+BENCH_PASSWORD = "bench-password"
+
+
+def free_port() -> int:
+    with socket.socket() as sock:
+        sock.bind(("127.0.0.1", 0))
+        return sock.getsockname()[1]
+
+
+def start_server(app_dir: str, work_dir: str, port: int) -> subprocess.Popen:
+    shutil.copytree(app_dir, work_dir, ignore=shutil.ignore_patterns(".git", "data", "__pycache__", "uploads"))
+    # Нагрузка идёт с одного адреса — ограничение запросов её бы отсекло
+    env = dict(os.environ, ADMIN_USERNAME="admin", ADMIN_PASSWORD="admin", LOG_LEVEL="WARNING",
+               RATE_LIMIT_ENABLED="False")
+    return subprocess.Popen(
+        [sys.executable, "-m", "uvicorn", "main:app", "--port", str(port), "--log-level", "warning"],
+        cwd=work_dir, env=env, stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL
+    )
+
+
+async def wait_ready(client: httpx.AsyncClient, timeout: float = 60):
+    deadline = time.perf_counter() + timeout
+    while time.perf_counter() < deadline:
+        try:
+            await client.get("/login")
+            return
+        except httpx.TransportError:
+            await asyncio.sleep(0.2)
+    raise RuntimeError("Сервер не запустился")
+
+
+async def prepare(client: httpx.AsyncClient, serve_channels: int) -> str:
+    """Логинится админом, заводит пользователя для логинов и плейлист для чтения"""
+    await client.post("/login", data={"username": "admin", "password": "admin"})
+    await client.post("/users", data={"username": BENCH_USER, "password": BENCH_PASSWORD, "email": "b@example.com"})
+    response = await client.post("/save", json={"name": "bench", "channels": synthetic_channels(serve_channels)})
+    return response.json()["url"].rsplit("/", 1)[-1]
+
+
+def percentiles(latencies: list) -> str:
+    if not latencies:
+        return "нет ответов"
+    latencies = sorted(latencies)
+
+    def at(p):
+        return latencies[min(int(len(latencies) * p), len(latencies) - 1)] * 1000
+
+    return (f"{len(latencies):>7} {at(0.5):>8.1f} {at(0.95):>8.1f} {at(0.99):>8.1f} "
+            f"{latencies[-1] * 1000:>8.1f}")
+
+
+async def run_phase(base_url: str, path: str, args, upload_body: bytes = None) -> dict:
+    deadline = time.perf_counter() + args.seconds
+    latencies, counts = [], {"uploads": 0, "logins": 0}
+    limits = httpx.Limits(max_connections=None, max_keepalive_connections=None)
+
+    async def reader(client):
+        while time.perf_counter() < deadline:
+            start = time.perf_counter()
+            response = await client.get(path, headers={"accept-encoding": "gzip"})
+            assert response.status_code == 200, response.status_code
+            latencies.append(time.perf_counter() - start)
+
+    async def uploader(client):
+        while time.perf_counter() < deadline:
+            files = {"file": ("bench.m3u", upload_body, "audio/mpegurl")}
+            response = await client.post("/upload", files=files)
+            if response.status_code == 202:
+                # Разбор идёт фоновой задачей: ждём её, как это делает страница
+                status_url = response.json()["status_url"]
+                while (await client.get(status_url)).json().get("status") == "running":
+                    await asyncio.sleep(0.2)
+            else:
+                assert response.status_code == 200, response.status_code
+            counts["uploads"] += 1
+
+    async def login(client):
+        while time.perf_counter() < deadline:
+            await client.post("/login", data={"username": BENCH_USER, "password": BENCH_PASSWORD})
+            counts["logins"] += 1
+
+    async with httpx.AsyncClient(base_url=base_url, timeout=None, limits=limits) as client:
+        await client.post("/login", data={"username": "admin", "password": "admin"})
+        tasks = [reader(client) for _ in range(args.readers)]
+        if upload_body is not None:
+            tasks += [uploader(client) for _ in range(args.uploaders)]
+            tasks += [login(client) for _ in range(args.logins)]
+        await asyncio.gather(*tasks)
+    return {"latencies": latencies, **counts}
+
+
+async def run(args):
+    port = free_port()
+    base_url = f"http://127.0.0.1:{port}"
+    work_dir = os.path.join(tempfile.mkdtemp(), "app")
+    server = start_server(os.path.abspath(args.app_dir), work_dir, port)
+    try:
+        async with httpx.AsyncClient(base_url=base_url, timeout=None) as client:
+            await wait_ready(client)
+            playlist_path = "/" + await prepare(client, args.serve_channels)
+            await client.get(playlist_path)  # Прогрев кэша отдачи
+
+        upload_body = synthetic_m3u(args.channels * 2).encode("utf-8")
+        print(f"код: {os.path.abspath(args.app_dir)}")
+        print(f"читателей: {args.readers}, плейлист на {args.serve_channels} каналов; "
+              f"фон: {args.uploaders} загрузки по {len(upload_body) / 1024 / 1024:.0f} МБ "
+              f"({args.channels} каналов) и {args.logins} логина; по {args.seconds} с")
+        print(f"{'фаза':<22} {'ответов':>7} {'p50, мс':>8} {'p95, мс':>8} {'p99, мс':>8} {'max, мс':>8}")
+
+        idle = await run_phase(base_url, playlist_path, args)
+        print(f"{'только чтение':<22} {percentiles(idle['latencies'])}")
+        busy = await run_phase(base_url, playlist_path, args, upload_body)
+        print(f"{'чтение под нагрузкой':<22} {percentiles(busy['latencies'])}")
+        print(f"за фазу под нагрузкой: загрузок {busy['uploads']}, логинов {busy['logins']}")
+    finally:
+        server.terminate()
+        server.wait()
+        shutil.rmtree(os.path.dirname(work_dir), ignore_errors=True)
+
+
+def main():
+    arg_parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    arg_parser.add_argument("--app-dir", default=".")
+    arg_parser.add_argument("--channels", type=int, default=200000, help="каналов в загружаемом файле")
+    arg_parser.add_argument("--serve-channels", type=int, default=2000, help="каналов в читаемом плейлисте")
+    arg_parser.add_argument("--seconds", type=float, default=10)
+    arg_parser.add_argument("--readers", type=int, default=8)
+    arg_parser.add_argument("--uploaders", type=int, default=2)
+    arg_parser.add_argument("--logins", type=int, default=4)
+    asyncio.run(run(arg_parser.parse_args()))
+
+
+if __name__ == "__main__":
+    main()
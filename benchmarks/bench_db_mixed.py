@@ -0,0 +1,146 @@
+"""
+Смешанная нагрузка на базу: писатели правят свои плейлисты через PATCH,
+PUT и создают новые через /save, читатели листают каналы и скачивают
+плейлисты, чей кэш отдачи постоянно сбрасывается правками.
+
+Считаются успешные запросы в секунду, отказы (5xx и обрывы соединения) и строки
+"database is locked" в логе сервера. Сравнение с версией кода до настройки
+SQLite (как и в bench_concurrency, через --app-dir):
+    git worktree add /tmp/iptv-old <коммит>
+    python -m benchmarks.bench_db_mixed --app-dir /tmp/iptv-old
+
+Запуск из корня проекта:
+    python -m benchmarks.bench_db_mixed [--writers 8] [--readers 16] [--seconds 10] [--workers 1]
+"""
+import argparse
+import asyncio
+import os
+import random
+import shutil
+import subprocess
+import sys
+import tempfile
+import time
+
+import httpx
+
+from benchmarks.bench_concurrency import free_port, percentiles, wait_ready
+from benchmarks.common import synthetic_channels
+
+
+def start_server(app_dir: str, work_dir: str, port: int, workers: int, log_path: str) -> subprocess.Popen:
+    shutil.copytree(app_dir, work_dir, ignore=shutil.ignore_patterns(".git", "data", "__pycache__", "uploads"))
+    # Нагрузка идёт с одного адреса — ограничение запросов её бы отсекло
+    env = dict(os.environ, ADMIN_USERNAME="admin", ADMIN_PASSWORD="admin", LOG_LEVEL="WARNING",
+               RATE_LIMIT_ENABLED="False")
+    with open(log_path, "wb") as log:
+        return subprocess.Popen(
+            [sys.executable, "-m", "uvicorn", "main:app", "--port", str(port), "--log-level", "warning",
+             "--workers", str(workers)],
+            cwd=work_dir, env=env, stdout=log, stderr=subprocess.STDOUT
+        )
+
+
+async def run_load(base_url: str, playlist_ids: list, args) -> dict:
+    deadline = time.perf_counter() + args.seconds
+    stats = {"reads": [], "writes": [], "errors": 0}
+    limits = httpx.Limits(max_connections=None, max_keepalive_connections=None)
+
+    async def timed(kind: str, request):
+        start = time.perf_counter()
+        try:
+            response = await request
+        except httpx.TransportError:
+            # Сервер оборвал соединение — тоже отказ
+            stats["errors"] += 1
+            return None
+        if response.status_code >= 500:
+            stats["errors"] += 1
+        else:
+            stats[kind].append(time.perf_counter() - start)
+        return response
+
+    async def writer(client, playlist_id: str):
+        channels = synthetic_channels(args.channels)
+        step = 0
+        while time.perf_counter() < deadline:
+            step += 1
+            if step % 10 == 0:
+                await timed("writes", client.post("/save", json={"name": "new", "channels": channels[:50]}))
+            elif step % 3 == 0:
+                channels[random.randrange(len(channels))]["name"] = f"PUT {step}"
+                await timed("writes", client.put(f"/playlists/{playlist_id}", json={"name": "bench", "channels": channels}))
+            else:
+                page = await timed("reads", client.get(f"/playlists/{playlist_id}/channels", params={"limit": 1}))
+                if page is None or page.status_code != 200:
+                    continue
+                op = {"op": "update", "id": page.json()["channels"][0]["id"], "fields": {"name": f"PATCH {step}"}}
+                await timed("writes", client.patch(f"/playlists/{playlist_id}", json={"ops": [op]}))
+
+    async def reader(client):
+        step = 0
+        while time.perf_counter() < deadline:
+            step += 1
+            playlist_id = random.choice(playlist_ids)
+            if step % 2:
+                await timed("reads", client.get(f"/{playlist_id}.m3u", headers={"accept-encoding": "gzip"}))
+            else:
+                await timed("reads", client.get(f"/playlists/{playlist_id}/channels", params={"limit": 200}))
+
+    async with httpx.AsyncClient(base_url=base_url, timeout=None, limits=limits) as client:
+        await client.post("/login", data={"username": "admin", "password": "admin"})
+        tasks = [writer(client, playlist_ids[i % len(playlist_ids)]) for i in range(args.writers)]
+        tasks += [reader(client) for _ in range(args.readers)]
+        await asyncio.gather(*tasks)
+    return stats
+
+
+async def run(args):
+    port = free_port()
+    base_url = f"http://127.0.0.1:{port}"
+    tmp_dir = tempfile.mkdtemp()
+    work_dir = os.path.join(tmp_dir, "app")
+    log_path = os.path.join(tmp_dir, "server.log")
+    server = start_server(os.path.abspath(args.app_dir), work_dir, port, args.workers, log_path)
+    try:
+        async with httpx.AsyncClient(base_url=base_url, timeout=None) as client:
+            await wait_ready(client)
+            await client.post("/login", data={"username": "admin", "password": "admin"})
+            playlist_ids = []
+            for _ in range(args.writers):
+                response = await client.post("/save", json={"name": "bench", "channels": synthetic_channels(args.channels)})
+                playlist_ids.append(response.json()["url"].rsplit("/", 1)[-1].split(".")[0])
+
+        stats = await run_load(base_url, playlist_ids, args)
+        with open(log_path, encoding="utf-8", errors="replace") as log:
+            locked = log.read().count("database is locked")
+
+        print(f"код: {os.path.abspath(args.app_dir)}")
+        print(f"писателей: {args.writers}, читателей: {args.readers}, плейлисты по {args.channels} каналов, "
+              f"процессов uvicorn: {args.workers}, {args.seconds} с")
+        print(f"{'запросы':<8} {'ответов':>7} {'p50, мс':>8} {'p95, мс':>8} {'p99, мс':>8} {'max, мс':>8} {'в секунду':>10}")
+        for kind, title in (("writes", "запись"), ("reads", "чтение")):
+            print(f"{title:<8} {percentiles(stats[kind])} {len(stats[kind]) / args.seconds:>10.1f}")
+        print(f"отказов (5xx и обрывы): {stats['errors']}, \"database is locked\" в логе: {locked}")
+    finally:
+        server.terminate()
+        server.wait()
+        if args.keep_log:
+            shutil.copy(log_path, args.keep_log)
+        shutil.rmtree(tmp_dir, ignore_errors=True)
+
+
+def main():
+    arg_parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    arg_parser.add_argument("--app-dir", default=".")
+    arg_parser.add_argument("--channels", type=int, default=500, help="каналов в каждом плейлисте")
+    arg_parser.add_argument("--seconds", type=float, default=10)
+    arg_parser.add_argument("--writers", type=int, default=8)
+    arg_parser.add_argument("--readers", type=int, default=16)
+    arg_parser.add_argument("--workers", type=int, default=1, help="процессов uvicorn")
+    arg_parser.add_argument("--keep-log", help="куда сохранить лог сервера")
+    asyncio.run(run(arg_parser.parse_args()))
+
+
+if __name__ == "__main__":
+    main()
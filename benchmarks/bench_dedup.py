@@ -0,0 +1,72 @@
+"""
+Общие тексты плейлистов: N пользователей сохраняют один и тот же список
+каналов. Сравнивается, сколько места заняли бы тексты со сжатыми версиями
+в каждой строке playlists (как было раньше) и сколько они занимают в
+playlist_blobs, а также память кэша отдачи с общими байтами и без них.
+
+Запуск из корня проекта:
+    python -m benchmarks.bench_dedup [--channels 20000] [--copies 20]
+"""
+import argparse
+import os
+import tempfile
+import time
+
+from sqlalchemy import create_engine, func
+from sqlalchemy.orm import sessionmaker
+
+import storage
+from benchmarks.common import synthetic_channels
+from database import Base, Playlist, PlaylistBlob
+from utils.cache import PlaylistCache
+
+
+def main():
+    arg_parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    arg_parser.add_argument("--channels", type=int, default=20000)
+    arg_parser.add_argument("--copies", type=int, default=20)
+    args = arg_parser.parse_args()
+
+    tmp_dir = tempfile.mkdtemp()
+    path = os.path.join(tmp_dir, "bench.db")
+    engine = create_engine(f"sqlite:///{path}")
+    Base.metadata.create_all(bind=engine)
+    Session = sessionmaker(bind=engine)
+
+    channels = synthetic_channels(args.channels)
+    start = time.perf_counter()
+    for i in range(args.copies):
+        with Session() as db:
+            storage.save_channels(db, Playlist(id=f"p{i}", name=f"копия {i}"), channels)
+            db.commit()
+    elapsed = time.perf_counter() - start
+
+    with Session() as db:
+        blobs, blob_bytes = db.query(
+            func.count(PlaylistBlob.hash),
+            func.sum(PlaylistBlob.size + func.length(PlaylistBlob.content_gz) +
+                     func.coalesce(func.length(PlaylistBlob.content_br), 0))
+        ).one()
+        # Без общих байтов каждая запись кэша держала бы свою копию текста
+        own_bytes = sum(storage.load_cached_playlist(db, f"p{i}").size for i in range(args.copies))
+        cache = PlaylistCache(args.copies, 1024 ** 4)
+        start = time.perf_counter()
+        for i in range(args.copies):
+            cache.put(f"p{i}", storage.load_cached_playlist(db, f"p{i}", cache.find_body))
+        load_elapsed = time.perf_counter() - start
+
+    mb = 1024 * 1024
+    print(f"каналов: {args.channels}, копий: {args.copies}, сохранение: {elapsed / args.copies * 1000:.0f} мс на копию")
+    print(f"блобов: {blobs}, текст со сжатыми версиями: {blob_bytes / mb:.1f} МБ")
+    print(f"{'':<28} {'МБ':>8}")
+    print(f"{'тексты в каждой строке':<28} {blob_bytes * args.copies / mb:>8.1f}")
+    print(f"{'тексты в playlist_blobs':<28} {blob_bytes / mb:>8.1f}")
+    print(f"{'файл базы целиком':<28} {os.path.getsize(path) / mb:>8.1f}")
+    print(f"{'кэш отдачи, свои байты':<28} {own_bytes / mb:>8.1f}")
+    print(f"{'кэш отдачи, общие байты':<28} {cache.stats()['bytes'] / mb:>8.1f}")
+    print(f"прогрев кэша: {load_elapsed / args.copies * 1000:.1f} мс на плейлист")
+    engine.dispose()
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,96 @@
+"""
+Задержка правки одного канала в большом плейлисте: прежнее хранение текстом
+(разбор content при открытии редактора, generate_m3u и перезапись всего
+текста при сохранении) против хранения каналов строками таблицы channels —
+как полным списком (PUT), так и точечным обновлением одной строки.
+
+Запуск из корня проекта:
+    python -m benchmarks.bench_edit_latency [--channels 100000]
+"""
+import argparse
+import os
+import tempfile
+import time
+
+from sqlalchemy import create_engine
+from sqlalchemy.orm import sessionmaker
+
+import storage
+from benchmarks.common import synthetic_channels
+from database import Base, Playlist
+from utils.generator import generate_m3u
+from utils.parser import parse_m3u
+
+
+def timed(func) -> float:
+    start = time.perf_counter()
+    func()
+    return time.perf_counter() - start
+
+
+def main():
+    arg_parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    arg_parser.add_argument("--channels", type=int, default=100000)
+    arg_parser.add_argument("--edits", type=int, default=5)
+    args = arg_parser.parse_args()
+
+    tmp_dir = tempfile.mkdtemp()
+    engine = create_engine(f"sqlite:///{os.path.join(tmp_dir, 'bench.db')}")
+    Base.metadata.create_all(bind=engine)
+    Session = sessionmaker(bind=engine)
+
+    channels = synthetic_channels(args.channels)
+    with Session() as db:
+        legacy = Playlist(id="legacy", name="legacy", content=generate_m3u(channels))
+        db.add(legacy)
+        rows = Playlist(id="rows", name="rows")
+        storage.save_channels(db, rows, channels)
+        db.commit()
+
+    def legacy_edit(i):
+        with Session() as db:
+            playlist = db.get(Playlist, "legacy")
+            edited = parse_m3u(playlist.content)["channels"].to_dicts()
+            edited[i]["name"] = f"Переименован {i}"
+            playlist.content = generate_m3u(edited)
+            db.commit()
+
+    def rows_edit(i):
+        with Session() as db:
+            playlist = db.get(Playlist, "rows")
+            edited = storage.load_channels(db, playlist).to_dicts()
+            edited[i]["name"] = f"Переименован {i}"
+            storage.save_channels(db, playlist, edited)
+            db.commit()
+
+    def row_update(i):
+        with Session() as db:
+            playlist = db.get(Playlist, "rows")
+            storage.update_channel(db, playlist, channel_ids[i], {"name": f"Точечно {i}"})
+            db.commit()
+
+    def render():
+        with Session() as db:
+            storage.get_content(db, db.get(Playlist, "rows"))
+
+    with Session() as db:
+        channel_ids = [ch["id"] for ch in storage.load_channels(db, db.get(Playlist, "rows"))]
+
+    step = max(args.channels // args.edits, 1)
+    indexes = range(0, args.channels, step)
+    results = [
+        ("текст (legacy)", [timed(lambda: legacy_edit(i)) for i in indexes]),
+        ("строки, полный PUT", [timed(lambda: rows_edit(i)) for i in indexes]),
+        ("строки, одна строка", [timed(lambda: row_update(i)) for i in indexes]),
+        ("одна строка + отдача", [timed(lambda: (row_update(i), render())) for i in indexes]),
+    ]
+
+    print(f"каналов: {args.channels}, правок: {len(indexes)}")
+    print(f"{'сценарий':<22} {'среднее, мс':>12} {'максимум, мс':>13}")
+    for label, times in results:
+        print(f"{label:<22} {sum(times) / len(times) * 1000:>12.1f} {max(times) * 1000:>13.1f}")
+    engine.dispose()
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,110 @@
+"""
+Генерация M3U: прежний generate_m3u (список строк + join) против кусочного
+iter_m3u — собранного в одно тело, отданного потоком из готового списка и
+потоком из ленивого источника (как iter_channels читает строки из базы).
+
+Каждый вариант запускается в отдельном процессе; пик RSS считается
+как прирост ru_maxrss во время генерации (входные каналы уже в памяти).
+
+Запуск из корня проекта:
+    python -m benchmarks.bench_generator [--channels 1000000]
+"""
+import argparse
+import json
+import os
+import resource
+import subprocess
+import sys
+import time
+
+from benchmarks.common import synthetic_channels, GROUPS
+from utils.generator import iter_m3u
+
+CASES = ("legacy", "join", "stream", "stream-lazy")
+
+
+def legacy_generate_m3u(channels, tvg_url: str = None) -> str:
+    """generate_m3u до перехода на iter_m3u"""
+    lines = ["#EXTM3U"]
+    if tvg_url:
+        lines[0] += f' url-tvg="{tvg_url}"'
+    for ch in channels:
+        extinf = f'#EXTINF:-1'
+        if ch.get("tvg_id"):
+            extinf += f' tvg-id="{ch["tvg_id"]}"'
+        if ch.get("tvg_name"):
+            extinf += f' tvg-name="{ch["tvg_name"]}"'
+        if ch.get("tvg_logo"):
+            extinf += f' tvg-logo="{ch["tvg_logo"]}"'
+        if ch.get("group_title"):
+            extinf += f' group-title="{ch["group_title"]}"'
+        extinf += f', {ch["name"]}'
+        lines.append(extinf)
+        lines.append(ch["url"])
+    return "\n".join(lines)
+
+
+def lazy_channels(count: int):
+    """Те же каналы, что synthetic_channels, но по одному, без списка в памяти"""
+    for i in range(count):
+        yield {
+            "name": f"Канал {i}",
+            "tvg_id": f"ch{i}.ru",
+            "tvg_name": f"Channel_{i}",
+            "tvg_logo": f"http://logos.example.com/{i % 500}.png",
+            "group_title": GROUPS[i % len(GROUPS)],
+            "url": f"http://stream.example.com/live/{i}/index.m3u8",
+        }
+
+
+def max_rss() -> int:
+    return resource.getrusage(resource.RUSAGE_SELF).ru_maxrss * 1024  # Linux отдаёт КБ
+
+
+def run_case(case: str, count: int) -> dict:
+    tvg_url = "http://epg.example.com/epg.xml.gz"
+    channels = lazy_channels(count) if case == "stream-lazy" else synthetic_channels(count)
+    rss_before = max_rss()
+    start = time.perf_counter()
+
+    if case == "legacy":
+        size = len(legacy_generate_m3u(channels, tvg_url).encode("utf-8"))
+    elif case == "join":
+        size = len(b"".join(iter_m3u(channels, tvg_url)))
+    else:
+        # Куски уходят в «сокет» сразу, как StreamingResponse
+        size = 0
+        with open(os.devnull, "wb") as sink:
+            for chunk in iter_m3u(channels, tvg_url):
+                sink.write(chunk)
+                size += len(chunk)
+
+    elapsed = time.perf_counter() - start
+    return {"case": case, "size": size, "seconds": elapsed, "rss": max_rss() - rss_before}
+
+
+def main():
+    arg_parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    arg_parser.add_argument("--channels", type=int, default=1_000_000)
+    arg_parser.add_argument("--case", choices=CASES, help=argparse.SUPPRESS)
+    args = arg_parser.parse_args()
+
+    if args.case:
+        print(json.dumps(run_case(args.case, args.channels)))
+        return
+
+    mb = 1024 * 1024
+    print(f"каналов: {args.channels}")
+    print(f"{'вариант':>12} {'вывод, МБ':>10} {'время, с':>9} {'МБ/с':>7} {'прирост RSS, МБ':>16}")
+    for case in CASES:
+        out = subprocess.run(
+            [sys.executable, "-m", "benchmarks.bench_generator", "--case", case, "--channels", str(args.channels)],
+            check=True, capture_output=True, text=True
+        ).stdout
+        result = json.loads(out)
+        print(f"{case:>12} {result['size'] / mb:>10.1f} {result['seconds']:>9.2f} "
+              f"{result['size'] / mb / result['seconds']:>7.1f} {result['rss'] / mb:>16.1f}")
+
+
+if __name__ == "__main__":
+    main()
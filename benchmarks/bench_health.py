@@ -0,0 +1,155 @@
+"""
+Проверка потоков (health.check_urls) против локального сервера, который
+изображает разные потоки: рабочие, медленные, зависшие, 404, не
+принимающие HEAD (и отдающие бесконечное тело на GET), редиректы, петли
+редиректов и закрытый порт. Сервер слушает 127.0.0.1-127.0.0.3 — три
+"хоста", на каждом считается наибольшее число одновременных запросов.
+
+Печатает время проверки при разной параллельности и сверяет статусы с
+ожидаемыми. Запуск из корня проекта:
+    python -m benchmarks.bench_health [--urls 500] [--concurrency 1,10,50] [--per-host 4] [--timeout 1]
+"""
+import argparse
+import asyncio
+import socket
+import time
+from collections import Counter
+
+import health
+from config import settings
+
+HOSTS = ("127.0.0.1", "127.0.0.2", "127.0.0.3")
+
+# Вид потока, доля среди URL и ожидаемый статус
+KINDS = (
+    ("ok", 0.70, "ok"),
+    ("slow", 0.08, "ok"),
+    ("nohead", 0.06, "ok"),
+    ("redirect", 0.06, "ok"),
+    ("gone", 0.04, "dead"),
+    ("loop", 0.02, "dead"),
+    ("refused", 0.02, "dead"),
+    ("hang", 0.02, "timeout"),
+)
+
+
+class StandInServer:
+    """HTTP/1.1 с keep-alive ровно в том объёме, который нужен проверке"""
+
+    def __init__(self, slow_delay: float):
+        self.slow_delay = slow_delay
+        self.active = Counter()
+        self.peak = Counter()
+
+    async def handle(self, reader: asyncio.StreamReader, writer: asyncio.StreamWriter):
+        try:
+            while True:
+                head = await reader.readuntil(b"\r\n\r\n")
+                method, path, _ = head.split(b"\r\n", 1)[0].decode().split(" ", 2)
+                host = writer.get_extra_info("sockname")[0]
+                self.active[host] += 1
+                self.peak[host] = max(self.peak[host], self.active[host])
+                try:
+                    if not await self.respond(reader, writer, method, path):
+                        return
+                finally:
+                    self.active[host] -= 1
+        except (asyncio.IncompleteReadError, ConnectionError):
+            pass
+        finally:
+            writer.close()
+
+    async def respond(self, reader, writer, method: str, path: str) -> bool:
+        """Отвечает на запрос; False — соединение дальше не используется"""
+        kind = path.split("/")[1]
+        if kind == "hang":
+            # Молчит, пока клиент не закроет соединение
+            await reader.read()
+            return False
+        if kind == "slow":
+            await asyncio.sleep(self.slow_delay)
+        if kind == "redirect":
+            return await self.send(writer, "302 Found", f"Location: /ok{path[len('/redirect'):]}\r\n")
+        if kind == "loop":
+            return await self.send(writer, "302 Found", f"Location: {path}\r\n")
+        if kind == "gone":
+            return await self.send(writer, "404 Not Found")
+        if kind == "nohead":
+            if method == "HEAD":
+                return await self.send(writer, "405 Method Not Allowed")
+            # Живой поток не обращает внимания на Range: тело без длины не кончается,
+            # пока клиент не закроет соединение
+            writer.write(b"HTTP/1.1 200 OK\r\nContent-Type: video/mp2t\r\n\r\n" + b"\x47" * 188 * 7)
+            await writer.drain()
+            await reader.read()
+            return False
+        return await self.send(writer, "200 OK")
+
+    @staticmethod
+    async def send(writer, status: str, headers: str = "") -> bool:
+        writer.write(f"HTTP/1.1 {status}\r\n{headers}Content-Length: 0\r\n\r\n".encode())
+        await writer.drain()
+        return True
+
+
+def free_port() -> int:
+    with socket.socket() as sock:
+        sock.bind(("127.0.0.1", 0))
+        return sock.getsockname()[1]
+
+
+def build_urls(count: int, port: int, closed_port: int) -> dict:
+    """{url: ожидаемый статус}"""
+    expected = {}
+    for kind, share, status in KINDS:
+        for i in range(max(1, round(count * share))):
+            host = HOSTS[i % len(HOSTS)]
+            if kind == "refused":
+                expected[f"http://{host}:{closed_port}/{kind}/{i}"] = status
+            else:
+                expected[f"http://{host}:{port}/{kind}/{i}"] = status
+    return expected
+
+
+async def run(args):
+    # Стенд слушает локальные адреса, которые проверка иначе не запрашивает
+    settings.HEALTH_CHECK_ALLOW_PRIVATE = True
+    port, closed_port = free_port(), free_port()
+    stand_in = StandInServer(args.slow_delay)
+    servers = [await asyncio.start_server(stand_in.handle, host, port) for host in HOSTS]
+    expected = build_urls(args.urls, port, closed_port)
+    print(f"URL: {len(expected)}, к одному хосту: {args.per_host}, таймаут: {args.timeout} с, "
+          f"медленные: {args.slow_delay} с")
+    print(f"{'параллельно':>11} {'с':>8} {'URL/с':>8} {'пик на хост':>12} {'ошибок':>7}")
+    for concurrency in (int(c) for c in args.concurrency.split(",")):
+        stand_in.peak.clear()
+        started = time.perf_counter()
+        results = {}
+        async for url, result in health.check_urls(
+            expected, concurrency=concurrency, per_host=args.per_host, timeout=args.timeout
+        ):
+            results[url] = result
+        elapsed = time.perf_counter() - started
+        wrong = {url: (status, results[url]) for url, status in expected.items() if results[url]["status"] != status}
+        print(f"{concurrency:>11} {elapsed:>8.2f} {len(expected) / elapsed:>8.0f} "
+              f"{max(stand_in.peak.values(), default=0):>12} {len(wrong):>7}")
+        for url, (status, result) in list(wrong.items())[:5]:
+            print(f"    {url}: ожидался {status}, получено {result}")
+    statuses = Counter(result["status"] for result in results.values())
+    print("статусы:", ", ".join(f"{status} {count}" for status, count in sorted(statuses.items())))
+    for server in servers:
+        server.close()
+
+
+def main():
+    arg_parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    arg_parser.add_argument("--urls", type=int, default=500)
+    arg_parser.add_argument("--concurrency", default="1,10,50")
+    arg_parser.add_argument("--per-host", type=int, default=4)
+    arg_parser.add_argument("--timeout", type=float, default=1.0)
+    arg_parser.add_argument("--slow-delay", type=float, default=0.2)
+    asyncio.run(run(arg_parser.parse_args()))
+
+
+if __name__ == "__main__":
+    main()
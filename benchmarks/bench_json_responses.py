@@ -0,0 +1,108 @@
+"""
+Время ответа на запросы с большим списком каналов: прежние обработчики,
+которые возвращали словари или модели Channel через jsonable_encoder
+FastAPI, против нынешних /playlists/{id}/edit и /playlists/{id}/channels,
+которые кодируют каналы в JSON кусками прямо из ChannelTable.
+
+Приложение вызывается в процессе через ASGI, без сети, на временной базе.
+Запуск из корня проекта:
+    python -m benchmarks.bench_json_responses [--channels 100000] [--repeat 3]
+"""
+import argparse
+import asyncio
+import logging
+import os
+import tempfile
+import time
+
+import httpx
+from fastapi import Depends
+from sqlalchemy import create_engine
+from sqlalchemy.orm import Session, sessionmaker
+
+import storage
+from benchmarks.common import synthetic_channels
+from database import Base, Playlist, SessionLocal, User, WriteSessionLocal, get_db
+from main import app, get_current_user
+from models import Channel
+
+
+def legacy_edit(playlist_id: str, db: Session = Depends(get_db)):
+    playlist = db.get(Playlist, playlist_id)
+    return {"id": playlist.id, "name": playlist.name, "channels": storage.load_channels(db, playlist).to_dicts()}
+
+
+def legacy_edit_models(playlist_id: str, db: Session = Depends(get_db)):
+    playlist = db.get(Playlist, playlist_id)
+    channels = [Channel(**ch) for ch in storage.load_channels(db, playlist).to_dicts()]
+    return {"id": playlist.id, "name": playlist.name, "channels": channels}
+
+
+def legacy_page(playlist_id: str, db: Session = Depends(get_db)):
+    page = storage.load_channel_page(db, db.get(Playlist, playlist_id), limit=1000)
+    page["channels"] = page["channels"].to_dicts()
+    return page
+
+
+async def timed(client: httpx.AsyncClient, url: str, repeat: int):
+    best = float("inf")
+    for _ in range(repeat):
+        start = time.perf_counter()
+        response = await client.get(url)
+        best = min(best, time.perf_counter() - start)
+        assert response.status_code == 200, response.status_code
+    return best, len(response.content)
+
+
+async def run(args):
+    tmp_dir = tempfile.mkdtemp()
+    engine = create_engine(f"sqlite:///{os.path.join(tmp_dir, 'bench.db')}", connect_args={"check_same_thread": False})
+    Base.metadata.create_all(bind=engine)
+    Session = sessionmaker(bind=engine)
+    with Session() as db:
+        user = User(username="bench", password="-")
+        db.add(user)
+        db.flush()
+        playlist = Playlist(id="bench", name="bench", owner_id=user.id)
+        channels = synthetic_channels(args.channels)
+        for ch in channels[::3]:
+            ch["attrs"] = {"catchup": "default"}
+        storage.save_channels(db, playlist, channels, tvg_url="http://epg.example.com/epg.xml")
+        db.commit()
+        db.refresh(user)
+        db.expunge(user)
+
+    SessionLocal.configure(bind=engine)
+    WriteSessionLocal.configure(bind=engine)
+    app.dependency_overrides[get_current_user] = lambda: user
+    app.add_api_route("/legacy/edit/{playlist_id}", legacy_edit)
+    app.add_api_route("/legacy/edit-models/{playlist_id}", legacy_edit_models)
+    app.add_api_route("/legacy/page/{playlist_id}", legacy_page)
+
+    scenarios = [
+        ("edit, модели Channel", "/legacy/edit-models/bench"),
+        ("edit, словари", "/legacy/edit/bench"),
+        ("edit, ChannelTable", "/playlists/bench/edit"),
+        ("страница 1000, словари", "/legacy/page/bench"),
+        ("страница 1000, ChannelTable", "/playlists/bench/channels?limit=1000"),
+    ]
+    transport = httpx.ASGITransport(app=app)
+    async with httpx.AsyncClient(transport=transport, base_url="http://bench", timeout=None) as client:
+        print(f"каналов: {args.channels}, лучшее из {args.repeat}")
+        print(f"{'сценарий':<28} {'мс':>10} {'МБ':>8}")
+        for label, url in scenarios:
+            elapsed, size = await timed(client, url, args.repeat)
+            print(f"{label:<28} {elapsed * 1000:>10.1f} {size / 1024 / 1024:>8.1f}")
+    engine.dispose()
+
+
+def main():
+    logging.getLogger("httpx").setLevel(logging.WARNING)
+    arg_parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    arg_parser.add_argument("--channels", type=int, default=100000)
+    arg_parser.add_argument("--repeat", type=int, default=3)
+    asyncio.run(run(arg_parser.parse_args()))
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,104 @@
+"""
+Метрики (metrics.py): во что обходится сбор и выдача /metrics.
+
+1. Запросов в секунду без сбора метрик и с ним (METRICS_ENABLED) на двух
+   маршрутах: /{playlist_id}.m3u с ответом 304 — самый дешёвый запрос, на
+   нём заметнее цена обёртки; страница каналов — несколько SQL-запросов, на
+   ней заметнее цена событий SQLAlchemy.
+2. Время выдачи /metrics, когда отдавались тысячи разных плейлистов: у
+   каждого свой ряд playlist_bytes_served_total.
+
+Приложение вызывается в процессе через ASGI, без сети, на временной базе.
+Запуск из корня проекта:
+    python -m benchmarks.bench_metrics [--seconds 3] [--clients 16] [--playlists 10000]
+"""
+import argparse
+import asyncio
+import logging
+import os
+import tempfile
+import time
+
+import httpx
+
+import auth
+import metrics
+import storage
+from benchmarks.common import synthetic_channels
+from config import settings
+from database import Base, Playlist, SessionLocal, User, WriteSessionLocal, create_db_engine
+from main import app
+
+
+async def poll(url: str, headers: dict, seconds: float, clients: int) -> float:
+    """Клиенты опрашивают url без пауз; запросов в секунду"""
+    done = 0
+    deadline = time.perf_counter() + seconds
+
+    async def worker():
+        nonlocal done
+        async with httpx.AsyncClient(transport=httpx.ASGITransport(app=app), base_url="http://bench") as client:
+            while time.perf_counter() < deadline:
+                response = await client.get(url, headers=headers)
+                assert response.status_code in (200, 304), response.status_code
+                done += 1
+
+    started = time.perf_counter()
+    await asyncio.gather(*(worker() for _ in range(clients)))
+    return done / (time.perf_counter() - started)
+
+
+async def run(args):
+    tmp_dir = tempfile.mkdtemp()
+    engine = create_db_engine(f"sqlite:///{os.path.join(tmp_dir, 'bench.db')}")
+    Base.metadata.create_all(bind=engine)
+    SessionLocal.configure(bind=engine)
+    WriteSessionLocal.configure(bind=engine.execution_options(sqlite_write=True))
+    with SessionLocal() as db:
+        user = User(username="bench", password="", is_admin=1)
+        db.add(user)
+        db.flush()
+        playlist = Playlist(id="bench", name="bench", owner_id=user.id)
+        storage.save_channels(db, playlist, synthetic_channels(1000))
+        db.commit()
+        etag = f'"{playlist.content_hash[:32]}"'
+        token = auth.create_session_token(user)
+    # Нагрузка идёт с одного адреса — ограничение запросов её бы отсекло
+    settings.RATE_LIMIT_ENABLED = False
+
+    routes = (
+        ("/bench.m3u, 304", "/bench.m3u", {"if-none-match": etag}),
+        ("каналы, 200 шт.", "/playlists/bench/channels?limit=200", {"cookie": f"access_token={token}"}),
+    )
+    print(f"1. {args.clients} клиентов, {args.seconds} с на замер")
+    for label, url, headers in routes:
+        # Замеры чередуются, берётся лучший: иначе второй выигрывает от прогрева
+        results = [0.0, 0.0]
+        for enabled in (False, True, False, True):
+            settings.METRICS_ENABLED = enabled
+            results[enabled] = max(results[enabled], await poll(url, headers, args.seconds, args.clients))
+        print(f"   {label:<18} без метрик {results[0]:>8,.0f} запросов/с, с метриками {results[1]:>8,.0f} "
+              f"({results[1] / results[0] - 1:+.1%})")
+
+    # Ряды байтов по плейлистам копятся так же, как при настоящей отдаче
+    for i in range(args.playlists):
+        metrics.playlist_bytes.inc(f"p{i:07d}", amount=1000)
+    started = time.perf_counter()
+    text = metrics.render()
+    elapsed = time.perf_counter() - started
+    print(f"2. /metrics при {args.playlists} плейлистах: {elapsed * 1000:.1f} мс, "
+          f"{len(text.encode('utf-8')) / 1024:,.0f} КБ, {text.count(chr(10)):,} строк")
+    engine.dispose()
+
+
+def main():
+    logging.getLogger("httpx").setLevel(logging.WARNING)
+    arg_parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    arg_parser.add_argument("--seconds", type=float, default=3)
+    arg_parser.add_argument("--clients", type=int, default=16)
+    arg_parser.add_argument("--playlists", type=int, default=10000)
+    asyncio.run(run(arg_parser.parse_args()))
+
+
+if __name__ == "__main__":
+    main()
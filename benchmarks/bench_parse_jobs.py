@@ -0,0 +1,76 @@
+"""
+Разбор большого файла: parse_m3u в одном процессе против фоновой задачи
+jobs.start_parse_job, которая делит файл на куски и разбирает их в пуле
+процессов. Для задачи время считается от запуска до готового JSON ответа.
+
+Ускорение ограничено числом ядер: при одном ядре пул только добавляет
+накладные расходы на процессы и передачу результата.
+
+Запуск из корня проекта:
+    python -m benchmarks.bench_parse_jobs [--channels 500000] [--workers 1 2 4]
+"""
+import argparse
+import os
+import tempfile
+import time
+
+from benchmarks.common import synthetic_m3u
+from config import settings
+import jobs
+import migrations
+from utils.parser import parse_m3u
+
+
+def run_job(path: str) -> tuple:
+    job_id = jobs.start_parse_job(path)
+    while (job := jobs.get_job(job_id)).status == "running":
+        time.sleep(0.01)
+    if job.status != "done":
+        raise RuntimeError(job.error)
+    size = sum(len(part) for part in jobs.iter_result_json(job))
+    return job, size
+
+
+def main():
+    arg_parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    arg_parser.add_argument("--channels", type=int, default=500000)
+    arg_parser.add_argument("--workers", type=int, nargs="+", default=[1, 2, 4])
+    arg_parser.add_argument("--shard-mb", type=float, default=settings.PARSE_SHARD_MB)
+    args = arg_parser.parse_args()
+    migrations.migrate()  # Состояние задач хранится в таблице parse_jobs
+
+    text = synthetic_m3u(args.channels * 2)
+    with tempfile.NamedTemporaryFile("w", suffix=".m3u", encoding="utf-8", delete=False) as f:
+        f.write(text)
+        source = f.name
+    mb = os.path.getsize(source) / 1024 / 1024
+    settings.PARSE_SHARD_SIZE = int(args.shard_mb * 1024 * 1024)
+    print(f"каналов: {args.channels}, файл {mb:.0f} МБ, кусок {args.shard_mb} МБ, ядер: {os.cpu_count()}")
+    print(f"{'вариант':>16} {'кусков':>7} {'время, с':>9} {'МБ/с':>7}")
+
+    start = time.perf_counter()
+    parse_m3u(text)
+    elapsed = time.perf_counter() - start
+    print(f"{'parse_m3u':>16} {1:>7} {elapsed:>9.2f} {mb / elapsed:>7.1f}")
+    del text
+
+    try:
+        for workers in args.workers:
+            settings.PARSE_WORKERS = workers
+            jobs.shutdown()
+            # Первая задача поднимает процессы пула, её время не учитываем
+            with open(source, "rb") as f:
+                run_job(jobs.save_upload(f))
+            with open(source, "rb") as f:
+                path = jobs.save_upload(f)
+            start = time.perf_counter()
+            job, _ = run_job(path)
+            elapsed = time.perf_counter() - start
+            print(f"{f'пул x{workers}':>16} {job.shards:>7} {elapsed:>9.2f} {mb / elapsed:>7.1f}")
+    finally:
+        jobs.shutdown()
+        os.remove(source)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,71 @@
+"""
+Сравнение скорости разбора M3U: прежний построчный каскад регулярок и текущий parse_m3u.
+
+Запуск из корня проекта:
+    python -m benchmarks.bench_parser [--sizes 10000,100000,1000000]
+"""
+import argparse
+import re
+
+from benchmarks.common import best_of, synthetic_m3u
+from models import Channel
+from utils.parser import parse_m3u
+
+
+def legacy_parse_m3u(content: str) -> dict:
+    """Реализация parse_m3u до перехода на однопроходный разбор (для сравнения)"""
+    channels = []
+    tvg_url = None
+    lines = [line.strip() for line in content.splitlines() if line.strip()]
+    if lines and lines[0].startswith('#EXTM3U'):
+        match = re.search(r'url-tvg="([^"]+)"', lines[0])
+        if match:
+            tvg_url = match.group(1)
+
+    i = 0
+    while i < len(lines):
+        line = lines[i]
+        if line.startswith("#EXTINF:"):
+            extinf = line
+            match = re.search(r'tvg-id=["\']?([^"\']*)["\']?', extinf)
+            tvg_id = match.group(1) if match else None
+            match = re.search(r'tvg-name=["\']?([^"\']*)["\']?', extinf)
+            tvg_name = match.group(1) if match else None
+            match = re.search(r'tvg-logo=["\']?([^"\']*)["\']?', extinf)
+            tvg_logo = match.group(1) if match else None
+            match = re.search(r'group-title=["\']?([^"\']*)["\']?', extinf)
+            group_title = match.group(1) if match else None
+            name_match = re.search(r",(.*)$", extinf)
+            name = name_match.group(1).strip() if name_match else "Unknown"
+            i += 1
+            if i < len(lines) and not lines[i].startswith("#"):
+                url = lines[i]
+            else:
+                url = ""
+            channels.append(Channel(
+                name=name, tvg_id=tvg_id, tvg_name=tvg_name, tvg_logo=tvg_logo,
+                group_title=group_title, url=url, tvg_url=tvg_url
+            ))
+        i += 1
+    return {"channels": channels, "tvg_url": tvg_url}
+
+
+def main():
+    arg_parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    arg_parser.add_argument("--sizes", default="10000,100000,1000000", help="размеры плейлистов в строках")
+    arg_parser.add_argument("--repeat", type=int, default=3)
+    args = arg_parser.parse_args()
+
+    print(f"{'строк':>10} {'каналов':>10} {'legacy, кан/с':>16} {'parse_m3u, кан/с':>18} {'ускорение':>10}")
+    for size in (int(s) for s in args.sizes.split(",")):
+        content = synthetic_m3u(size)
+        count = len(parse_m3u(content)["channels"])
+        assert count == len(legacy_parse_m3u(content)["channels"])
+
+        legacy = best_of(lambda: legacy_parse_m3u(content), args.repeat)
+        current = best_of(lambda: parse_m3u(content), args.repeat)
+        print(f"{size:>10} {count:>10} {count / legacy:>16,.0f} {count / current:>18,.0f} {legacy / current:>9.1f}x")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,117 @@
+"""
+Профилирование по запросу (profiling.py): во что оно обходится.
+
+1. Пока запись не включена: запросов в секунду к одному и тому же простому
+   обработчику (def и async def) с обычным маршрутом FastAPI и с ProfiledRoute.
+2. Когда включена: время ответа страницы каналов (1000 каналов) без
+   профилирования, с выборкой стеков (sample) и с cProfile.
+
+Приложение вызывается в процессе через ASGI, без сети, на временной базе.
+Запуск из корня проекта:
+    python -m benchmarks.bench_profiling [--seconds 3] [--requests 50]
+"""
+import argparse
+import asyncio
+import logging
+import os
+import statistics
+import tempfile
+import time
+
+import httpx
+from fastapi import FastAPI
+from fastapi.routing import APIRoute
+
+import auth
+import profiling
+import storage
+from benchmarks.common import synthetic_channels
+from config import settings
+from database import Base, Playlist, SessionLocal, User, WriteSessionLocal, create_db_engine
+from main import app
+
+
+def build_app(route_class) -> FastAPI:
+    bench_app = FastAPI()
+    bench_app.router.route_class = route_class
+
+    @bench_app.get("/sync")
+    def sync_endpoint():
+        return {"ok": True}
+
+    @bench_app.get("/async")
+    async def async_endpoint():
+        return {"ok": True}
+
+    return bench_app
+
+
+async def requests_per_second(target, url: str, seconds: float) -> float:
+    done = 0
+    async with httpx.AsyncClient(transport=httpx.ASGITransport(app=target), base_url="http://bench") as client:
+        deadline = time.perf_counter() + seconds
+        while time.perf_counter() < deadline:
+            await client.get(url)
+            done += 1
+    return done / seconds
+
+
+async def latencies(url: str, headers: dict, count: int) -> list:
+    async with httpx.AsyncClient(transport=httpx.ASGITransport(app=app), base_url="http://bench") as client:
+        result = []
+        for _ in range(count):
+            started = time.perf_counter()
+            response = await client.get(url, headers=headers)
+            assert response.status_code == 200, response.status_code
+            result.append((time.perf_counter() - started) * 1000)
+    return result
+
+
+async def run(args):
+    print(f"1. запись не включена, {args.seconds} с на замер")
+    apps = (("APIRoute", build_app(APIRoute)), ("ProfiledRoute", build_app(profiling.ProfiledRoute)))
+    for url in ("/sync", "/async"):
+        # Замеры чередуются, берётся лучший: иначе второй выигрывает от прогрева
+        results = {label: 0.0 for label, _ in apps}
+        for _ in range(2):
+            for label, target in apps:
+                results[label] = max(results[label], await requests_per_second(target, url, args.seconds))
+        print("   " + f"{url:<7}" + ", ".join(f"{label} {rps:,.0f} запросов/с" for label, rps in results.items()))
+
+    tmp_dir = tempfile.mkdtemp()
+    engine = create_db_engine(f"sqlite:///{os.path.join(tmp_dir, 'bench.db')}")
+    Base.metadata.create_all(bind=engine)
+    SessionLocal.configure(bind=engine)
+    WriteSessionLocal.configure(bind=engine.execution_options(sqlite_write=True))
+    with SessionLocal() as db:
+        user = User(username="bench", password="", is_admin=1)
+        db.add(user)
+        db.flush()
+        storage.save_channels(db, Playlist(id="bench", name="bench", owner_id=user.id), synthetic_channels(1000))
+        db.commit()
+        token = auth.create_session_token(user)
+    settings.RATE_LIMIT_ENABLED = False
+
+    url, headers = "/playlists/bench/channels?limit=1000", {"cookie": f"access_token={token}"}
+    routes = {route.path for route in app.routes if isinstance(route, profiling.ProfiledRoute)}
+    await latencies(url, headers, 5)  # Прогрев
+    print(f"2. страница каналов, 1000 шт., {args.requests} запросов")
+    for mode in (None, "sample", "cprofile"):
+        if mode:
+            profiling.arm("/playlists/{playlist_id}/channels", mode, args.requests, None, routes)
+        times = await latencies(url, headers, args.requests)
+        print(f"   {mode or 'без профилирования':<20} медиана {statistics.median(times):>7.2f} мс, "
+              f"максимум {max(times):>7.2f} мс")
+    engine.dispose()
+
+
+def main():
+    logging.getLogger("httpx").setLevel(logging.WARNING)
+    arg_parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    arg_parser.add_argument("--seconds", type=float, default=3)
+    arg_parser.add_argument("--requests", type=int, default=50)
+    asyncio.run(run(arg_parser.parse_args()))
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,125 @@
+"""
+Ограничение запросов (ratelimit.py): во что оно обходится и от чего спасает.
+
+1. Отдача /{playlist_id}.m3u с ответом 304 — самый дешёвый запрос, на нём
+   цена проверки ведра заметнее всего: запросов в секунду без ограничения и
+   с ним (ведро достаточно большое, отказов нет), клиенты с разных адресов.
+2. Перебор пароля одного пользователя с разных адресов: сколько раз за
+   попытки считался argon2 и сколько заняла вся серия, без ограничения и с ним.
+3. Плеер, который опрашивает плейлист без пауз: сколько его запросов дошло
+   до обработчика.
+
+Приложение вызывается в процессе через ASGI, без сети, на временной базе.
+Запуск из корня проекта:
+    python -m benchmarks.bench_ratelimit [--seconds 3] [--attempts 50]
+"""
+import argparse
+import asyncio
+import logging
+import os
+import tempfile
+import time
+
+import httpx
+from sqlalchemy import create_engine
+from sqlalchemy.orm import sessionmaker
+
+import auth
+import main as app_main
+import ratelimit
+import storage
+from benchmarks.common import synthetic_channels
+from config import settings
+from database import Base, Playlist, SessionLocal, User, WriteSessionLocal
+from main import app
+
+
+async def poll(transport, url: str, headers: dict, seconds: float, clients: int) -> tuple:
+    """Клиенты с разных адресов опрашивают url; запросов в секунду и доля 429"""
+    done = rejected = 0
+    deadline = time.perf_counter() + seconds
+
+    async def worker(number: int):
+        nonlocal done, rejected
+        client_transport = httpx.ASGITransport(app=transport.app, client=(f"10.0.{number // 250}.{number % 250}", 1))
+        async with httpx.AsyncClient(transport=client_transport, base_url="http://bench") as client:
+            while time.perf_counter() < deadline:
+                response = await client.get(url, headers=headers)
+                done += 1
+                rejected += response.status_code == 429
+
+    started = time.perf_counter()
+    await asyncio.gather(*(worker(i) for i in range(clients)))
+    return done / (time.perf_counter() - started), rejected / max(done, 1)
+
+
+async def brute_force(attempts: int) -> tuple:
+    """Неверные пароли к одному имени с разных адресов; вызовов argon2 и секунд на серию"""
+    verified = 0
+    verify = app_main.verify_password
+
+    def counting_verify(plain, hashed):
+        nonlocal verified
+        verified += 1
+        return verify(plain, hashed)
+
+    app_main.verify_password = counting_verify
+    started = time.perf_counter()
+    try:
+        for i in range(attempts):
+            transport = httpx.ASGITransport(app=app, client=(f"10.9.{i // 250}.{i % 250}", 1))
+            async with httpx.AsyncClient(transport=transport, base_url="http://bench") as client:
+                await client.post("/login", data={"username": "victim", "password": f"guess{i}"})
+    finally:
+        app_main.verify_password = verify
+    return verified, time.perf_counter() - started
+
+
+async def run(args):
+    tmp_dir = tempfile.mkdtemp()
+    engine = create_engine(f"sqlite:///{os.path.join(tmp_dir, 'bench.db')}", connect_args={"check_same_thread": False})
+    Base.metadata.create_all(bind=engine)
+    with sessionmaker(bind=engine)() as db:
+        db.add(User(username="victim", password=auth.get_password_hash("correct horse"), is_admin=0))
+        playlist = Playlist(id="bench", name="bench")
+        storage.save_channels(db, playlist, synthetic_channels(1000))
+        db.commit()
+        etag = f'"{playlist.content_hash[:32]}"'
+    SessionLocal.configure(bind=engine)
+    WriteSessionLocal.configure(bind=engine)
+    transport = httpx.ASGITransport(app=app)
+    not_modified = {"if-none-match": etag}
+
+    print(f"1. /bench.m3u, 304, {args.clients} клиентов, {args.seconds} с")
+    for label, enabled in (("без ограничения", False), ("с ограничением", True)):
+        settings.RATE_LIMIT_ENABLED = enabled
+        ratelimit.playlist_requests.burst = 10 ** 9  # Только цена проверки, без отказов
+        rps, _ = await poll(transport, "/bench.m3u", not_modified, args.seconds, args.clients)
+        print(f"   {label:<18} {rps:>10,.0f} запросов/с")
+
+    print(f"2. перебор пароля, {args.attempts} попыток с разных адресов")
+    for label, enabled in (("без ограничения", False), ("с ограничением", True)):
+        settings.RATE_LIMIT_ENABLED = enabled
+        verified, elapsed = await brute_force(args.attempts)
+        print(f"   {label:<18} argon2: {verified:>4}, {elapsed:>6.2f} с")
+
+    settings.RATE_LIMIT_ENABLED = True
+    ratelimit.playlist_requests.burst = settings.RATE_LIMIT_PLAYLIST_BURST
+    rps, share = await poll(transport, "/bench.m3u", not_modified, args.seconds, 1)
+    print(f"3. плеер без пауз, {args.seconds} с: {rps * args.seconds:,.0f} запросов, "
+          f"до обработчика дошло {(1 - share) * rps * args.seconds:,.0f}")
+    print(f"отказы: {ratelimit.stats()}")
+    engine.dispose()
+
+
+def main():
+    logging.getLogger("httpx").setLevel(logging.WARNING)
+    arg_parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    arg_parser.add_argument("--seconds", type=float, default=3)
+    arg_parser.add_argument("--clients", type=int, default=16)
+    arg_parser.add_argument("--attempts", type=int, default=50)
+    asyncio.run(run(arg_parser.parse_args()))
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,85 @@
+"""
+Поиск каналов по общим плейлистам на большой базе: запрос через
+полнотекстовый индекс (search.search_shared_channels) против сканирования
+channels через LIKE '%...%'. Половина плейлистов общие.
+
+Запуск из корня проекта:
+    python -m benchmarks.bench_search [--channels 1000000] [--playlists 200] [--repeat 5]
+"""
+import argparse
+import os
+import tempfile
+import time
+
+from sqlalchemy import create_engine, insert
+from sqlalchemy.orm import sessionmaker
+
+import migrations
+import search
+from benchmarks.common import synthetic_channels
+from database import Base, Playlist, PlaylistChannel, User
+
+
+def legacy_search(db, query: str, limit: int = 50) -> list:
+    return (
+        db.query(PlaylistChannel.id, PlaylistChannel.name, Playlist.name)
+        .join(Playlist, Playlist.id == PlaylistChannel.playlist_id)
+        .filter(Playlist.is_shared == True, PlaylistChannel.name.icontains(query))  # noqa: E712
+        .limit(limit)
+        .all()
+    )
+
+
+def main():
+    arg_parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    arg_parser.add_argument("--channels", type=int, default=1000000)
+    arg_parser.add_argument("--playlists", type=int, default=200)
+    arg_parser.add_argument("--repeat", type=int, default=5)
+    args = arg_parser.parse_args()
+
+    tmp_dir = tempfile.mkdtemp()
+    engine = create_engine(f"sqlite:///{os.path.join(tmp_dir, 'bench.db')}")
+    Base.metadata.create_all(bind=engine)
+    with engine.begin() as conn:
+        migrations.channel_search(conn)
+    Session = sessionmaker(bind=engine)
+
+    per_playlist = args.channels // args.playlists
+    channels = synthetic_channels(per_playlist)
+    start = time.perf_counter()
+    with Session() as db:
+        db.add(User(id=1, username="bench", password="-"))
+        for i in range(args.playlists):
+            db.add(Playlist(id=f"p{i}", name=f"плейлист {i}", owner_id=1, is_shared=i % 2 == 0))
+            db.execute(insert(PlaylistChannel), [
+                dict(ch, name=f"{ch['name']} {i}", playlist_id=f"p{i}", position=position)
+                for position, ch in enumerate(channels)
+            ])
+        db.commit()
+    elapsed = time.perf_counter() - start
+    print(f"каналов: {per_playlist * args.playlists}, плейлистов: {args.playlists}, "
+          f"запись с индексом: {elapsed:.1f} с")
+
+    queries = (
+        ("редкое слово", "4242", "4242"),
+        ("два слова", "Канал 4242", "Канал 4242"),
+        ("частое слово", "Канал", "Канал"),
+        ("нет совпадений", "несуществующий", "несуществующий"),
+    )
+    print(f"{'запрос':<18} {'индекс, мс':>12} {'LIKE, мс':>10} {'найдено':>9}")
+    with Session() as db:
+        for title, query, like in queries:
+            best = best_like = float("inf")
+            for _ in range(args.repeat):
+                started = time.perf_counter()
+                found = search.search_shared_channels(db, query)
+                best = min(best, time.perf_counter() - started)
+                started = time.perf_counter()
+                legacy_search(db, like)
+                best_like = min(best_like, time.perf_counter() - started)
+            print(f"{title:<18} {best * 1000:>12.1f} {best_like * 1000:>10.1f} {len(found):>9}")
+    engine.dispose()
+
+
+if __name__ == "__main__":
+    main()
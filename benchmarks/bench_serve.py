@@ -0,0 +1,112 @@
+"""
+Нагрузочный тест отдачи /{playlist_id}.m3u: прежний обработчик (вся строка
+Playlist из базы и несжатый текст через HTMLResponse) против нынешнего
+(ETag/304, заранее сжатые версии и LRU-кэш в памяти).
+
+Приложение вызывается в процессе через ASGI, без сети, на временной базе.
+--storage files — тексты хранятся файлами во временном PLAYLISTS_DIR и
+отдаются через FileResponse; память кэша отдачи тогда почти не растёт.
+Запуск из корня проекта:
+    python -m benchmarks.bench_serve [--channels 20000] [--seconds 3] [--concurrency 16] [--storage db|files]
+"""
+import argparse
+import asyncio
+import logging
+import os
+import tempfile
+import time
+
+import httpx
+from fastapi import Depends, HTTPException
+from fastapi.responses import HTMLResponse
+from sqlalchemy import create_engine
+from sqlalchemy.orm import Session, sessionmaker
+
+import storage
+from benchmarks.common import synthetic_channels
+from config import settings
+from database import Base, Playlist, SessionLocal, WriteSessionLocal, get_db
+from main import app, playlist_cache
+
+
+def legacy_serve(playlist_id: str, db: Session = Depends(get_db)):
+    playlist = db.query(Playlist).filter(Playlist.id == playlist_id).first()
+    if not playlist:
+        raise HTTPException(status_code=404, detail="Плейлист не найден")
+    return HTMLResponse(content=storage.get_content(db, playlist), media_type="audio/mpegurl")
+
+
+async def load(client: httpx.AsyncClient, url: str, headers: dict, seconds: float, concurrency: int):
+    done = 0
+    received = 0
+    deadline = time.perf_counter() + seconds
+
+    async def worker():
+        nonlocal done, received
+        while time.perf_counter() < deadline:
+            response = await client.get(url, headers=headers)
+            assert response.status_code in (200, 206, 304), response.status_code
+            done += 1
+            received += int(response.headers.get("content-length", 0))
+
+    start = time.perf_counter()
+    await asyncio.gather(*(worker() for _ in range(concurrency)))
+    elapsed = time.perf_counter() - start
+    return done / elapsed, received / max(done, 1)
+
+
+async def run(args):
+    tmp_dir = tempfile.mkdtemp()
+    settings.PLAYLIST_STORAGE = args.storage
+    settings.RATE_LIMIT_ENABLED = False  # Все запросы с одного адреса к одному плейлисту
+    settings.PLAYLISTS_DIR = os.path.join(tmp_dir, "playlists")
+    engine = create_engine(
+        f"sqlite:///{os.path.join(tmp_dir, 'bench.db')}",
+        connect_args={"check_same_thread": False},
+        pool_size=args.concurrency
+    )
+    Base.metadata.create_all(bind=engine)
+    Session = sessionmaker(bind=engine)
+    with Session() as db:
+        playlist = Playlist(id="bench", name="bench")
+        storage.save_channels(db, playlist, synthetic_channels(args.channels), tvg_url="http://epg.example.com/epg.xml")
+        db.commit()
+        etag = f'"{playlist.content_hash[:32]}"'
+
+    # Приложение берёт сессии из SessionLocal и WriteSessionLocal — направляем его во временную базу
+    SessionLocal.configure(bind=engine)
+    WriteSessionLocal.configure(bind=engine)
+    app.add_api_route("/legacy/{playlist_id}.m3u", legacy_serve)
+
+    scenarios = [
+        ("legacy, без сжатия", "/legacy/bench.m3u", {"accept-encoding": "gzip"}),
+        ("новый, без сжатия", "/bench.m3u", {"accept-encoding": "identity"}),
+        ("новый, gzip", "/bench.m3u", {"accept-encoding": "gzip"}),
+        ("новый, br", "/bench.m3u", {"accept-encoding": "br, gzip"}),
+        ("новый, 304", "/bench.m3u", {"accept-encoding": "gzip", "if-none-match": etag}),
+        ("новый, Range 64 КБ", "/bench.m3u", {"accept-encoding": "identity", "range": "bytes=0-65535"}),
+    ]
+    transport = httpx.ASGITransport(app=app)
+    async with httpx.AsyncClient(transport=transport, base_url="http://bench") as client:
+        print(f"каналов: {args.channels}, хранение: {args.storage}, параллельно: {args.concurrency}, "
+              f"по {args.seconds} с на сценарий")
+        print(f"{'сценарий':<22} {'запросов/с':>12} {'байт на ответ':>15}")
+        for label, url, headers in scenarios:
+            rps, size = await load(client, url, headers, args.seconds, args.concurrency)
+            print(f"{label:<22} {rps:>12,.0f} {size:>15,.0f}")
+    print(f"кэш: {playlist_cache.stats()}")
+    engine.dispose()
+
+
+def main():
+    logging.getLogger("httpx").setLevel(logging.WARNING)
+    arg_parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    arg_parser.add_argument("--channels", type=int, default=20000)
+    arg_parser.add_argument("--seconds", type=float, default=3)
+    arg_parser.add_argument("--concurrency", type=int, default=16)
+    arg_parser.add_argument("--storage", choices=("db", "files"), default="db")
+    asyncio.run(run(arg_parser.parse_args()))
+
+
+if __name__ == "__main__":
+    main()
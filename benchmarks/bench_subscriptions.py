@@ -0,0 +1,162 @@
+"""
+Обновление плейлиста из источника: повторный импорт целиком (скачать,
+разобрать, сохранить все каналы заново — как при ручной загрузке) против
+subscriptions.refresh, который спрашивает источник условно и переписывает
+только изменившиеся каналы. Импорт сразу генерирует и сжимает текст
+плейлиста, подписка — при следующей отдаче; это время печатается отдельно.
+
+Источник — локальный HTTP-сервер с ETag. Сценарии: источник не изменился
+(304), тот же текст без ETag, изменилась часть каналов. Для каждого
+печатается время и сколько строк channels записано (INSERT/UPDATE/DELETE).
+
+Запуск из корня проекта:
+    python -m benchmarks.bench_subscriptions [--channels 100000] [--changed 1]
+"""
+import argparse
+import os
+import tempfile
+import threading
+import time
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+from sqlalchemy import create_engine, event
+from sqlalchemy.orm import sessionmaker
+
+import storage
+import subscriptions
+from benchmarks.common import synthetic_m3u
+from database import Base, Playlist, SessionLocal, User, WriteSessionLocal
+from utils.parser import parse_m3u
+
+
+class Source:
+    """Текст источника и его ETag; etag None — сервер не шлёт валидаторов"""
+    body = b""
+    etag = None
+
+
+class SourceHandler(BaseHTTPRequestHandler):
+    def log_message(self, *args):
+        pass
+
+    def do_GET(self):
+        if Source.etag and self.headers.get("If-None-Match") == Source.etag:
+            self.send_response(304)
+            self.end_headers()
+            return
+        body = Source.body
+        if self.path == "/copy.m3u":
+            # Свой url-tvg, чтобы тексты плейлистов различались и не делили один блоб
+            body = body.replace(b"epg.xml.gz", b"epg-copy.xml.gz", 1)
+        self.send_response(200)
+        if Source.etag:
+            self.send_header("ETag", Source.etag)
+        self.send_header("Content-Length", str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+
+class RowCounter:
+    """Сколько строк channels затронули INSERT/UPDATE/DELETE"""
+
+    def __init__(self, engine):
+        self.rows = 0
+        event.listen(engine, "after_cursor_execute", self.count)
+
+    def count(self, conn, cursor, statement, parameters, context, executemany):
+        words = statement.split(None, 3)
+        if words[0] in ("INSERT", "UPDATE", "DELETE") and "channels" in words[1:3] and cursor.rowcount > 0:
+            self.rows += cursor.rowcount
+
+
+def reimport(url: str, playlist_id: str):
+    """Как до подписок: скачать текст целиком и сохранить все каналы заново"""
+    import httpx
+    content = httpx.get(url).text
+    parsed = parse_m3u(content)
+    with WriteSessionLocal() as db:
+        playlist = db.get(Playlist, playlist_id)
+        storage.save_channels(db, playlist, parsed["channels"].to_dicts(), tvg_url=parsed["tvg_url"])
+        db.commit()
+
+
+def render(playlist_id: str):
+    """Перегенерация текста, которую подписка откладывает до следующей отдачи"""
+    with WriteSessionLocal() as db:
+        storage.ensure_rendered(db, db.get(Playlist, playlist_id))
+
+
+def changed_source(content: str, percent: float) -> bytes:
+    """Меняет URL у percent% каналов, как при смене адресов у провайдера"""
+    lines = content.split("\n")
+    step = max(int(100 / percent), 1) if percent else 0
+    channel = 0
+    for i, line in enumerate(lines):
+        if line.startswith("http://stream."):
+            if step and channel % step == 0:
+                lines[i] = line + "?v=2"
+            channel += 1
+    return "\n".join(lines).encode("utf-8")
+
+
+def main():
+    arg_parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    arg_parser.add_argument("--channels", type=int, default=100000)
+    arg_parser.add_argument("--changed", type=float, default=1.0, help="процент изменившихся каналов")
+    args = arg_parser.parse_args()
+
+    server = ThreadingHTTPServer(("127.0.0.1", 0), SourceHandler)
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    url = f"http://127.0.0.1:{server.server_address[1]}/playlist.m3u"
+    copy_url = f"http://127.0.0.1:{server.server_address[1]}/copy.m3u"
+
+    tmp_dir = tempfile.mkdtemp()
+    engine = create_engine(f"sqlite:///{os.path.join(tmp_dir, 'bench.db')}", connect_args={"check_same_thread": False})
+    Base.metadata.create_all(bind=engine)
+    SessionLocal.configure(bind=engine)
+    WriteSessionLocal.configure(bind=engine)
+    counter = RowCounter(engine)
+
+    content = synthetic_m3u(args.channels * 2)
+    Source.body, Source.etag = content.encode("utf-8"), '"v1"'
+    with sessionmaker(bind=engine)() as db:
+        db.add(User(id=1, username="bench", password="-"))
+        for playlist_id in ("copy", "sub"):
+            storage.save_channels(db, Playlist(id=playlist_id, name=playlist_id, owner_id=1), [])
+        subscriptions.subscribe(db, db.get(Playlist, "sub"), url, 3600)
+        db.commit()
+    reimport(copy_url, "copy")
+    subscriptions.refresh("sub")
+    render("sub")
+
+    updated = changed_source(content, args.changed)
+    scenarios = (
+        ("не изменился, ETag", Source.body, '"v1"'),
+        ("тот же текст без ETag", Source.body, None),
+        (f"изменилось {args.changed:g}% каналов", updated, '"v2"'),
+    )
+    print(f"каналов: {args.channels}")
+    print(f"{'сценарий':<28} {'импорт, с':>10} {'строк':>8} {'подписка, с':>12} {'строк':>8} "
+          f"{'текст, с':>9}  результат")
+    for title, body, etag in scenarios:
+        Source.body, Source.etag = body, etag
+        counter.rows = 0
+        started = time.perf_counter()
+        reimport(copy_url, "copy")
+        legacy_time, legacy_rows = time.perf_counter() - started, counter.rows
+        counter.rows = 0
+        started = time.perf_counter()
+        result = subscriptions.refresh("sub")
+        elapsed = time.perf_counter() - started
+        rows = counter.rows
+        started = time.perf_counter()
+        render("sub")
+        render_time = time.perf_counter() - started
+        print(f"{title:<28} {legacy_time:>10.2f} {legacy_rows:>8} {elapsed:>12.2f} {rows:>8} {render_time:>9.2f}  "
+              f"{result['status']}: +{result['added']} ~{result['updated']} -{result['removed']}")
+    server.shutdown()
+    engine.dispose()
+
+
+if __name__ == "__main__":
+    main()
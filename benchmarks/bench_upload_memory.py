@@ -0,0 +1,70 @@
+"""
+Пиковое потребление памяти при загрузке плейлиста: прежний путь /upload
+(file.read() + decode + parse_m3u + JSON всего ответа) против разбора кусками
+по PARSE_SHARD_SIZE, как его делают процессы пула фоновой задачи (jobs.py):
+куски здесь разбираются по очереди, пик — как у одного процесса пула.
+
+Запуск из корня проекта:
+    python -m benchmarks.bench_upload_memory [--channels 50000,200000,500000]
+"""
+import argparse
+import asyncio
+import json
+import os
+import tempfile
+import tracemalloc
+
+from starlette.datastructures import UploadFile
+
+from benchmarks.common import synthetic_m3u
+from config import settings
+from utils.parser import parse_m3u, parse_m3u_shard, split_m3u_file
+
+
+async def legacy_upload(path: str) -> int:
+    with open(path, "rb") as f:
+        content = await UploadFile(file=f, filename="bench.m3u").read()
+    # Прежний парсер отдавал список словарей
+    channels = parse_m3u(content.decode("utf-8", errors="ignore"))["channels"].to_dicts()
+    body = json.dumps({"channels": channels}, ensure_ascii=False)
+    return len(body)
+
+
+async def shard_upload(path: str) -> int:
+    sent = 0
+    for start, end in split_m3u_file(path, settings.PARSE_SHARD_SIZE):
+        _, items = parse_m3u_shard(path, start, end)
+        sent += len(items)
+    return sent
+
+
+def measure(path: str, handler) -> int:
+    tracemalloc.start()
+    asyncio.run(handler(path))
+    _, peak = tracemalloc.get_traced_memory()
+    tracemalloc.stop()
+    return peak
+
+
+def main():
+    arg_parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    arg_parser.add_argument("--channels", default="50000,200000,500000")
+    args = arg_parser.parse_args()
+
+    mb = 1024 * 1024
+    print(f"{'каналов':>10} {'файл, МБ':>10} {'legacy пик, МБ':>16} {'куски пик, МБ':>15}")
+    for count in (int(c) for c in args.channels.split(",")):
+        with tempfile.NamedTemporaryFile("w", suffix=".m3u", delete=False, encoding="utf-8") as f:
+            f.write(synthetic_m3u(count * 2))
+            path = f.name
+        try:
+            size = os.path.getsize(path)
+            legacy = measure(path, legacy_upload)
+            streaming = measure(path, shard_upload)
+            print(f"{count:>10} {size / mb:>10.1f} {legacy / mb:>16.1f} {streaming / mb:>15.1f}")
+        finally:
+            os.remove(path)
+
+
+if __name__ == "__main__":
+    main()
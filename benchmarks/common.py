@@ -0,0 +1,41 @@
+"""Общие помощники для бенчмарков: синтетические плейлисты и замер времени"""
+import time
+
+GROUPS = ["Новости", "Спорт", "Кино", "Детские", "Музыка", "Познавательные", "Развлекательные", "HD"]
+
+
+def synthetic_channels(count: int) -> list:
+    """Каналы в виде словарей, как их присылает редактор"""
+    return [
+        {
+            "name": f"Канал {i}",
+            "tvg_id": f"ch{i}.ru",
+            "tvg_name": f"Channel_{i}",
+            "tvg_logo": f"http://logos.example.com/{i % 500}.png",
+            "group_title": GROUPS[i % len(GROUPS)],
+            "url": f"http://stream.example.com/live/{i}/index.m3u8",
+        }
+        for i in range(count)
+    ]
+
+
+def synthetic_m3u(lines: int) -> str:
+    """M3U примерно из `lines` строк (по две строки на канал)"""
+    out = ['#EXTM3U url-tvg="http://epg.example.com/epg.xml.gz"']
+    for ch in synthetic_channels(max(lines // 2, 1)):
+        out.append(
+            f'#EXTINF:-1 tvg-id="{ch["tvg_id"]}" tvg-name="{ch["tvg_name"]}" '
+            f'tvg-logo="{ch["tvg_logo"]}" group-title="{ch["group_title"]}" catchup="default",{ch["name"]}'
+        )
+        out.append(ch["url"])
+    return "\n".join(out) + "\n"
+
+
+def best_of(func, repeat: int = 3) -> float:
+    """Минимальное время выполнения func() из нескольких запусков, в секундах"""
+    best = float("inf")
+    for _ in range(repeat):
+        start = time.perf_counter()
+        func()
+        best = min(best, time.perf_counter() - start)
+    return best
@@ -8,8 +8,14 @@ class Settings:
     DEBUG: bool = os.getenv("DEBUG", "False").lower() == "true"
     APP_HOST: str = os.getenv("APP_HOST", "0.0.0.0")
     APP_PORT: int = int(os.getenv("APP_PORT", 8000))
+    APP_WORKERS: int = int(os.getenv("APP_WORKERS", "1"))
     SECRET_KEY: str = os.getenv("SECRET_KEY", "your-super-secret-jwt-key-change-in-production")
     PLAYLISTS_DIR: str = os.getenv("PLAYLISTS_DIR", "uploads")
+    # Где хранить тексты плейлистов: db — в базе, files — файлами в PLAYLISTS_DIR
+    PLAYLIST_STORAGE: str = os.getenv("PLAYLIST_STORAGE", "db").lower()
+    # Уровень brotli для заранее сжатых текстов: сжатие идёт при каждом сохранении под
+    # блокировкой записи; 11 (по умолчанию в brotli) на 20k каналов — секунды, 5 — сотые
+    BROTLI_QUALITY: int = int(os.getenv("BROTLI_QUALITY", "5"))
     ADMIN_USERNAME: str = os.getenv("ADMIN_USERNAME", "admin")
     ADMIN_PASSWORD: str = os.getenv("ADMIN_PASSWORD", "admin")
     LOG_DIR: str = os.getenv("LOG_DIR", "data/logs")
@@ -17,5 +23,70 @@ class Settings:
     LOG_FILE_MAX_SIZE_MB: int = int(os.getenv("LOG_FILE_MAX_SIZE_MB", "10"))
     LOG_FILE_MAX_SIZE: int = LOG_FILE_MAX_SIZE_MB * 1024 * 1024  # Конвертация MB в байты
     LOG_FILE_BACKUP_COUNT: int = int(os.getenv("LOG_FILE_BACKUP_COUNT", "5"))
+    PLAYLIST_CACHE_MAX_ENTRIES: int = int(os.getenv("PLAYLIST_CACHE_MAX_ENTRIES", "256"))
+    PLAYLIST_CACHE_MAX_MB: int = int(os.getenv("PLAYLIST_CACHE_MAX_MB", "256"))
+    PLAYLIST_CACHE_MAX_BYTES: int = PLAYLIST_CACHE_MAX_MB * 1024 * 1024
+    PLAYLIST_CACHE_TTL: int = int(os.getenv("PLAYLIST_CACHE_TTL", "5"))
+    THREADPOOL_SIZE: int = int(os.getenv("THREADPOOL_SIZE", "40"))
+    PARSE_WORKERS: int = int(os.getenv("PARSE_WORKERS", str(os.cpu_count() or 1)))
+    PARSE_SHARD_MB: int = int(os.getenv("PARSE_SHARD_MB", "8"))
+    PARSE_SHARD_SIZE: int = PARSE_SHARD_MB * 1024 * 1024
+    PARSE_JOB_TTL: int = int(os.getenv("PARSE_JOB_TTL", "600"))
+    DATABASE_URL: str = os.getenv("DATABASE_URL", "sqlite:///data/users.db")
+    # Реплики для публичного чтения через запятую; пусто — всё читается с основной базы
+    DATABASE_REPLICA_URLS: list = [url.strip() for url in os.getenv("DATABASE_REPLICA_URLS", "").split(",") if url.strip()]
+    AUTO_MIGRATE: bool = os.getenv("AUTO_MIGRATE", "True").lower() == "true"
+    DB_POOL_SIZE: int = int(os.getenv("DB_POOL_SIZE", str(THREADPOOL_SIZE)))
+    DB_MAX_OVERFLOW: int = int(os.getenv("DB_MAX_OVERFLOW", "10"))
+    DB_POOL_TIMEOUT: int = int(os.getenv("DB_POOL_TIMEOUT", "30"))
+    DB_POOL_RECYCLE: int = int(os.getenv("DB_POOL_RECYCLE", "1800"))
+    SQLITE_BUSY_TIMEOUT: int = int(os.getenv("SQLITE_BUSY_TIMEOUT", "30"))
+    SQLITE_SYNCHRONOUS: str = os.getenv("SQLITE_SYNCHRONOUS", "NORMAL")
+    SQLITE_CACHE_MB: int = int(os.getenv("SQLITE_CACHE_MB", "64"))
+    SQLITE_MMAP_MB: int = int(os.getenv("SQLITE_MMAP_MB", "256"))
+    # Проверка потоков: запросов одновременно, из них к одному хосту, и таймаут запроса в секундах
+    HEALTH_CHECK_CONCURRENCY: int = int(os.getenv("HEALTH_CHECK_CONCURRENCY", "50"))
+    HEALTH_CHECK_PER_HOST: int = int(os.getenv("HEALTH_CHECK_PER_HOST", "4"))
+    HEALTH_CHECK_TIMEOUT: float = float(os.getenv("HEALTH_CHECK_TIMEOUT", "10"))
+    # Разрешить проверку потоков во внутренней сети и на localhost
+    HEALTH_CHECK_ALLOW_PRIVATE: bool = os.getenv("HEALTH_CHECK_ALLOW_PRIVATE", "False").lower() == "true"
+    # Подписки на источники: обновлять раз в столько часов, проверять расписание раз в столько секунд,
+    # обновлять одновременно, ждать ответа источника (с) и принимать не больше стольких МБ
+    SUBSCRIPTION_INTERVAL_HOURS: int = int(os.getenv("SUBSCRIPTION_INTERVAL_HOURS", "6"))
+    SUBSCRIPTION_POLL_INTERVAL: int = int(os.getenv("SUBSCRIPTION_POLL_INTERVAL", "60"))
+    SUBSCRIPTION_CONCURRENCY: int = int(os.getenv("SUBSCRIPTION_CONCURRENCY", "2"))
+    SUBSCRIPTION_TIMEOUT: float = float(os.getenv("SUBSCRIPTION_TIMEOUT", "30"))
+    SUBSCRIPTION_MAX_MB: int = int(os.getenv("SUBSCRIPTION_MAX_MB", "100"))
+    # Разрешить источники во внутренней сети и на localhost
+    SUBSCRIPTION_ALLOW_PRIVATE: bool = os.getenv("SUBSCRIPTION_ALLOW_PRIVATE", "False").lower() == "true"
+    PASSWORD_HASH_CONCURRENCY: int = int(os.getenv("PASSWORD_HASH_CONCURRENCY", str(os.cpu_count() or 2)))
+    # Кэш пользователей для проверки токенов: сколько секунд верить записи и сколько записей держать.
+    # Изменения пользователя из другого процесса станут видны не позже чем через USER_CACHE_TTL
+    USER_CACHE_TTL: float = float(os.getenv("USER_CACHE_TTL", "30"))
+    USER_CACHE_MAX_ENTRIES: int = int(os.getenv("USER_CACHE_MAX_ENTRIES", "10000"))
+    # Где держать краткоживущее состояние (ответы на капчу): memory — в памяти процесса,
+    # database — в базе, общей для всех процессов и узлов. Не больше стольких записей
+    STATE_STORE: str = os.getenv("STATE_STORE", "database" if APP_WORKERS > 1 else "memory").lower()
+    STATE_STORE_MAX_ENTRIES: int = int(os.getenv("STATE_STORE_MAX_ENTRIES", "10000"))
+    CAPTCHA_TTL: int = int(os.getenv("CAPTCHA_TTL", "600"))
+    # Ограничение запросов (ratelimit.py): запросов в минуту и запас подряд. Плейлист — на пару
+    # IP и плейлист, вход и регистрация — на IP и на имя пользователя
+    RATE_LIMIT_ENABLED: bool = os.getenv("RATE_LIMIT_ENABLED", "True").lower() == "true"
+    RATE_LIMIT_PLAYLIST_PER_MINUTE: float = float(os.getenv("RATE_LIMIT_PLAYLIST_PER_MINUTE", "60"))
+    RATE_LIMIT_PLAYLIST_BURST: int = int(os.getenv("RATE_LIMIT_PLAYLIST_BURST", "30"))
+    RATE_LIMIT_LOGIN_PER_MINUTE: float = float(os.getenv("RATE_LIMIT_LOGIN_PER_MINUTE", "10"))
+    RATE_LIMIT_LOGIN_BURST: int = int(os.getenv("RATE_LIMIT_LOGIN_BURST", "10"))
+    # Где считать вход и регистрацию: memory или database (общий счёт для всех процессов и узлов)
+    RATE_LIMIT_STORE: str = os.getenv("RATE_LIMIT_STORE", STATE_STORE).lower()
+    RATE_LIMIT_MAX_KEYS: int = int(os.getenv("RATE_LIMIT_MAX_KEYS", "100000"))  # На каждое ограничение
+    # Адреса или подсети обратных прокси, которым верить в X-Forwarded-For и X-Forwarded-Proto
+    # (через запятую, "*" — любым). Без них адрес клиента — адрес соединения
+    TRUSTED_PROXIES: list = [host.strip() for host in os.getenv("TRUSTED_PROXIES", "").split(",") if host.strip()]
+    # Сколько разборов /upload и /parse-text процесс ведёт одновременно; сверх — 429
+    PARSE_MAX_JOBS: int = int(os.getenv("PARSE_MAX_JOBS", str(2 * PARSE_WORKERS)))
+    # Метрики /metrics: сбор можно выключить; без METRICS_TOKEN их видят только администраторы,
+    # с ним — ещё и по заголовку Authorization: Bearer <METRICS_TOKEN> (для Prometheus)
+    METRICS_ENABLED: bool = os.getenv("METRICS_ENABLED", "True").lower() == "true"
+    METRICS_TOKEN: str = os.getenv("METRICS_TOKEN", "")
 
 settings = Settings()
\ No newline at end of file
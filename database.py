@@ -1,14 +1,77 @@
-from sqlalchemy import create_engine, Column, Integer, String, Text, DateTime, ForeignKey, Boolean
+from sqlalchemy import create_engine, event, make_url, Column, Integer, String, Text, DateTime, ForeignKey, Boolean, Index, LargeBinary
 from sqlalchemy.ext.declarative import declarative_base
 from sqlalchemy.orm import sessionmaker, relationship
+from contextlib import contextmanager, nullcontext
 from datetime import datetime
 import os
+import random
+import threading
 
-# Создаем директорию для базы данных
-os.makedirs("data", exist_ok=True)
+from config import settings
 
-# Создаем движок базы данных
-engine = create_engine("sqlite:///data/users.db", connect_args={"check_same_thread": False})
+def configure_sqlite(dbapi_connection, connection_record):
+    """
+    WAL: читатели не ждут писателя и не мешают ему. synchronous=NORMAL в WAL
+    не портит базу при сбое, лишь может потерять последние транзакции.
+    """
+    # Транзакции начинает SQLAlchemy (см. begin_transaction), а не модуль sqlite3
+    dbapi_connection.isolation_level = None
+    cursor = dbapi_connection.cursor()
+    cursor.execute("PRAGMA journal_mode=WAL")
+    cursor.execute(f"PRAGMA synchronous={settings.SQLITE_SYNCHRONOUS}")
+    cursor.execute(f"PRAGMA cache_size=-{settings.SQLITE_CACHE_MB * 1024}")  # Отрицательное — в КБ
+    cursor.execute(f"PRAGMA mmap_size={settings.SQLITE_MMAP_MB * 1024 * 1024}")
+    cursor.execute("PRAGMA temp_store=MEMORY")
+    cursor.close()
+
+def begin_transaction(conn):
+    # Пишущая транзакция сразу берёт блокировку записи: иначе она начинается
+    # чтением и при переходе к записи получает "database is locked", если
+    # кто-то успел записать между её чтением и записью
+    if conn.get_execution_options().get("sqlite_write"):
+        conn.exec_driver_sql("BEGIN IMMEDIATE")
+    else:
+        conn.exec_driver_sql("BEGIN")
+
+def create_db_engine(url: str):
+    """Движок с пулом на все потоки обработчиков сразу"""
+    if make_url(url).get_backend_name() == "sqlite":
+        path = make_url(url).database
+        if path and path != ":memory:":
+            os.makedirs(os.path.dirname(path) or ".", exist_ok=True)
+        db_engine = create_engine(
+            url,
+            connect_args={"check_same_thread": False, "timeout": settings.SQLITE_BUSY_TIMEOUT},
+            pool_size=settings.DB_POOL_SIZE,
+            max_overflow=settings.DB_MAX_OVERFLOW,
+            pool_timeout=settings.DB_POOL_TIMEOUT
+        )
+        event.listen(db_engine, "connect", configure_sqlite)
+        event.listen(db_engine, "begin", begin_transaction)
+        return db_engine
+
+    # Серверная СУБД (PostgreSQL): соединение проверяется перед выдачей из пула
+    # и переоткрывается раз в DB_POOL_RECYCLE, чтобы не получить закрытое сервером
+    return create_engine(
+        url,
+        pool_size=settings.DB_POOL_SIZE,
+        max_overflow=settings.DB_MAX_OVERFLOW,
+        pool_timeout=settings.DB_POOL_TIMEOUT,
+        pool_pre_ping=True,
+        pool_recycle=settings.DB_POOL_RECYCLE
+    )
+
+# Основная база: все записи и чтения, которым важна свежесть
+engine = create_db_engine(settings.DATABASE_URL)
+is_sqlite = engine.dialect.name == "sqlite"
+
+# Реплики только для чтения: отдача плейлистов и /shared
+replica_engines = [create_db_engine(url) for url in settings.DATABASE_REPLICA_URLS]
+
+# SQLite пишет только одним соединением за раз, поэтому пишущие сессии этого
+# процесса выстраиваются в очередь здесь, а не крутятся в busy_timeout.
+# PostgreSQL сам разводит параллельные записи по строкам
+_write_lock = threading.Lock() if is_sqlite else nullcontext()
 
 # Создаем базовый класс для моделей
 Base = declarative_base()
@@ -23,6 +86,8 @@ class User(Base):
     email = Column(String, nullable=True)  # Новое поле: email
     is_admin = Column(Integer, default=0, server_default="0")
     created_at = Column(DateTime, default=datetime.utcnow)
+    # Входит в токен; увеличивается, когда выданные токены надо отозвать
+    token_version = Column(Integer, nullable=False, default=0, server_default="0")
 
     # Связь с плейлистами
     playlists = relationship("Playlist", back_populates="owner", foreign_keys="[Playlist.owner_id]")
@@ -34,17 +99,166 @@ class Playlist(Base):
     id = Column(String, primary_key=True, index=True)
     name = Column(String, index=True)
     filename = Column(String)
-    content = Column(Text)
+    content = Column(Text)  # Только у плейлистов, сохранённых до playlist_blobs
     owner_id = Column(Integer, ForeignKey("users.id"), index=True)
     created_at = Column(DateTime, default=datetime.utcnow)
-    is_shared = Column(Boolean, default=False)  # Поле: общий доступ
+    is_shared = Column(Boolean, default=False, index=True)  # Поле: общий доступ
     tvg_url = Column(String, nullable=True, default="")  # Новое поле: URL TV-гид
 
+    # Сводка по содержимому, считается при сохранении (NULL — ещё не посчитана)
+    channel_count = Column(Integer, nullable=True)
+    group_count = Column(Integer, nullable=True)
+    content_size = Column(Integer, nullable=True)  # Размер текста в байтах
+
+    # Текст плейлиста — блоб PlaylistBlob с этим хэшем (он же ETag); NULL — текст
+    # устарел и будет перегенерирован из каналов при следующей отдаче
+    content_hash = Column(String(64), nullable=True)
+    updated_at = Column(DateTime, nullable=True)
+
+    # Растёт при каждом изменении каналов; PATCH проверяет его против гонок правок
+    version = Column(Integer, nullable=False, default=0, server_default="0")
+
     # Связь с пользователем
     owner = relationship("User", back_populates="playlists")
 
-# Создаем фабрику сессий
+    # Каналы плейлиста по порядку; текст в блобе — отрендеренный из них M3U
+    channels = relationship(
+        "PlaylistChannel",
+        back_populates="playlist",
+        order_by="PlaylistChannel.position",
+        passive_deletes=True
+    )
+
+# Модель канала плейлиста
+class PlaylistChannel(Base):
+    __tablename__ = "channels"
+
+    id = Column(Integer, primary_key=True)
+    playlist_id = Column(String, ForeignKey("playlists.id", ondelete="CASCADE"), nullable=False)
+    position = Column(Integer, nullable=False)  # Порядок в плейлисте, с 0
+    name = Column(String, nullable=False, default="")
+    tvg_id = Column(String, nullable=True)
+    tvg_name = Column(String, nullable=True)
+    tvg_logo = Column(String, nullable=True)
+    group_title = Column(String, nullable=True)
+    url = Column(String, nullable=False, default="")
+    attrs = Column(Text, nullable=True)  # Прочие атрибуты #EXTINF в JSON
+
+    playlist = relationship("Playlist", back_populates="channels")
+
+    __table_args__ = (
+        Index("ix_channels_playlist_position", "playlist_id", "position"),
+        Index("ix_channels_playlist_group", "playlist_id", "group_title"),
+        Index("ix_channels_name", "name"),
+    )
+
+# Текст плейлиста и его сжатые версии. Одинаковые тексты (один и тот же список
+# провайдера у разных пользователей, копии общих плейлистов) хранятся один раз;
+# ref_count — сколько плейлистов ссылаются на блоб, при нуле он удаляется.
+# При PLAYLIST_STORAGE=files текст и сжатые версии лежат файлами (utils/blob_files.py)
+class PlaylistBlob(Base):
+    __tablename__ = "playlist_blobs"
+
+    hash = Column(String(64), primary_key=True)  # sha256 текста
+    content = Column(Text, nullable=True)  # NULL — текст в файлах PLAYLISTS_DIR
+    content_gz = Column(LargeBinary, nullable=True)
+    content_br = Column(LargeBinary, nullable=True)  # Только если установлен brotli
+    size = Column(Integer, nullable=False)  # Размер текста в байтах
+    ref_count = Column(Integer, nullable=False, default=0)
+    created_at = Column(DateTime, default=datetime.utcnow)
+
+# Задача фонового разбора загрузки (см. jobs.py). Хранится в базе, чтобы её
+# статус видели все процессы приложения, а не только принявший файл
+class ParseJob(Base):
+    __tablename__ = "parse_jobs"
+
+    id = Column(String(32), primary_key=True)
+    owner_id = Column(Integer, nullable=True, index=True)
+    status = Column(String(16), nullable=False, default="running")  # running -> done | error
+    shards = Column(Integer, nullable=False, default=0)
+    shards_done = Column(Integer, nullable=False, default=0)
+    channel_count = Column(Integer, nullable=False, default=0)
+    tvg_url = Column(String, nullable=True)
+    error = Column(String, nullable=True)
+    result = Column(Text, nullable=True)  # Не пишется с миграции 10: каналы лежат в parse_job_shards
+    updated_at = Column(DateTime, nullable=False, default=datetime.utcnow, index=True)
+
+# Готовые каналы задачи разбора, по строке на кусок файла: результат большого
+# файла не собирается в памяти целиком и отдаётся кусок за куском
+class ParseJobShard(Base):
+    __tablename__ = "parse_job_shards"
+
+    job_id = Column(String(32), primary_key=True)
+    shard = Column(Integer, primary_key=True, autoincrement=False)  # Номер куска в порядке файла
+    result = Column(Text, nullable=False)  # Элементы JSON-массива через запятую
+
+# Проверка потоков плейлиста (см. health.py): состояние последней проверки
+# и результат по каждому каналу. URL запоминается вместе с результатом, чтобы
+# не приписать его каналу, ссылку которого с тех пор поменяли
+class HealthCheck(Base):
+    __tablename__ = "health_checks"
+
+    playlist_id = Column(String, primary_key=True)
+    status = Column(String(16), nullable=False, default="running")  # running -> done | error
+    total = Column(Integer, nullable=False, default=0)  # Разных URL в плейлисте
+    checked = Column(Integer, nullable=False, default=0)
+    error = Column(String, nullable=True)
+    started_at = Column(DateTime, nullable=False, default=datetime.utcnow)
+    updated_at = Column(DateTime, nullable=False, default=datetime.utcnow)
+
+class ChannelHealth(Base):
+    __tablename__ = "channel_health"
+
+    channel_id = Column(Integer, primary_key=True)
+    playlist_id = Column(String, nullable=False, index=True)
+    url = Column(String, nullable=False)
+    status = Column(String(16), nullable=False)  # ok | dead | timeout | skipped | blocked
+    http_status = Column(Integer, nullable=True)
+    latency_ms = Column(Integer, nullable=True)
+    error = Column(String, nullable=True)
+    checked_at = Column(DateTime, nullable=False)
+
+# Подписка плейлиста на источник (см. subscriptions.py): откуда и когда его
+# обновлять и чем ответил источник в прошлый раз
+class Subscription(Base):
+    __tablename__ = "subscriptions"
+
+    playlist_id = Column(String, primary_key=True)
+    url = Column(String, nullable=False)
+    interval = Column(Integer, nullable=False)  # Секунд между обновлениями
+    etag = Column(String, nullable=True)
+    last_modified = Column(String, nullable=True)
+    content_hash = Column(String(64), nullable=True)  # sha256 последнего полученного текста
+    tvg_url = Column(String, nullable=True)  # url-tvg источника при последнем обновлении
+    next_refresh_at = Column(DateTime, nullable=False, index=True)
+    checked_at = Column(DateTime, nullable=True)
+    changed_at = Column(DateTime, nullable=True)
+    status = Column(String(16), nullable=True)  # updated | unchanged | not_modified | error
+    error = Column(String, nullable=True)
+
+# Канал источника -> канал плейлиста и значения его полей в источнике при
+# последнем обновлении: по ним видно, какие поля пользователь правил сам
+class SubscriptionChannel(Base):
+    __tablename__ = "subscription_channels"
+
+    playlist_id = Column(String, primary_key=True)
+    key = Column(String, primary_key=True)
+    channel_id = Column(Integer, nullable=True)  # None — пользователь удалил канал
+    base = Column(Text, nullable=False)  # JSON: поля FIELDS и attrs
+
+# Краткоживущее состояние, общее для всех процессов (ephemeral.py)
+class EphemeralState(Base):
+    __tablename__ = "ephemeral_state"
+
+    namespace = Column(String(32), primary_key=True)
+    key = Column(String(64), primary_key=True)
+    value = Column(Text, nullable=False)
+    expires_at = Column(DateTime, nullable=False, index=True)
+
+# Создаем фабрики сессий: для чтения и для записи
 SessionLocal = sessionmaker(autocommit=False, autoflush=False, bind=engine)
+write_engine = engine.execution_options(sqlite_write=True)
+WriteSessionLocal = sessionmaker(autocommit=False, autoflush=False, bind=write_engine)
 
 # Функция для получения сессии базы данных
 def get_db():
@@ -54,5 +268,27 @@ def get_db():
     finally:
         db.close()
 
-# Создаем таблицы при запуске
-Base.metadata.create_all(bind=engine)
\ No newline at end of file
+@contextmanager
+def write_session():
+    """
+    Сессия для записи: ждёт своей очереди, пока пишет предыдущая.
+    Обработчики берут её в своём теле, а не зависимостью с yield: зависимость
+    и тело FastAPI выполняет разными вызовами пула потоков, и запросы, ждущие
+    очереди, заняли бы все потоки, не оставив ни одного тому, кто её держит
+    """
+    with _write_lock:
+        db = WriteSessionLocal()
+        try:
+            yield db
+        finally:
+            db.close()
+
+def replica_session():
+    """Сессия для публичного чтения: на случайной реплике, а без реплик — на основной базе"""
+    if replica_engines:
+        return SessionLocal(bind=random.choice(replica_engines))
+    return SessionLocal()
+
+def get_replica_db():
+    with replica_session() as db:
+        yield db
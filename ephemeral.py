@@ -0,0 +1,182 @@
+"""
+Краткоживущее состояние: значения с временем жизни и ограничением числа
+записей, которые можно забрать ровно один раз (ответы на капчу) или
+атомарно изменить (счётчики ограничения запросов, ratelimit.py).
+
+Два хранилища с одним интерфейсом: MemoryStore — в памяти процесса, годится
+для одного процесса приложения; DatabaseStore — таблица ephemeral_state в
+основной базе, общая для всех процессов и узлов. Какое из них используется,
+задаёт STATE_STORE. Предел числа записей у обоих считается отдельно для
+каждого namespace: поток записей одного вида (например, ведра отдачи
+плейлистов) не вытесняет другие. Просроченные записи не отдаются; из базы
+они удаляются при очередных записях, вместе с самыми старыми сверх предела.
+"""
+import threading
+import time
+from collections import OrderedDict
+from datetime import datetime, timedelta
+from typing import Callable, Optional
+
+from sqlalchemy import delete, func
+from sqlalchemy.exc import IntegrityError
+
+from config import settings
+from database import EphemeralState, SessionLocal, write_session
+
+# DatabaseStore убирает просроченное и лишнее раз на столько записей процесса
+_PRUNE_EVERY = 50
+
+
+class MemoryStore:
+    """Потокобезопасное хранилище в памяти: при переполнении namespace вытесняются его самые старые записи"""
+
+    def __init__(self, max_entries: int):
+        self.max_entries = max_entries  # На каждый namespace
+        self._namespaces = {}  # namespace -> OrderedDict: ключ -> (значение, срок по time.monotonic)
+        self._lock = threading.Lock()
+
+    def _entries(self, namespace: str) -> OrderedDict:
+        entries = self._namespaces.get(namespace)
+        if entries is None:
+            entries = self._namespaces[namespace] = OrderedDict()
+        return entries
+
+    def put(self, namespace: str, key: str, value: str, ttl: float):
+        now = time.monotonic()
+        with self._lock:
+            entries = self._entries(namespace)
+            entries.pop(key, None)
+            entries[key] = (value, now + ttl)
+            self._evict(entries, now)
+
+    def update(self, namespace: str, key: str, change: Callable, ttl: float):
+        """change(прежнее значение или None) -> (новое значение, результат); возвращает результат"""
+        now = time.monotonic()
+        with self._lock:
+            entries = self._entries(namespace)
+            entry = entries.pop(key, None)
+            value, result = change(entry[0] if entry is not None and entry[1] > now else None)
+            entries[key] = (value, now + ttl)
+            self._evict(entries, now)
+        return result
+
+    def _evict(self, entries: OrderedDict, now: float):
+        # Записи идут по времени последней записи: просроченные и лишние — в начале
+        while entries:
+            oldest = next(iter(entries.values()))
+            if len(entries) <= self.max_entries and oldest[1] > now:
+                break
+            entries.popitem(last=False)
+
+    def get(self, namespace: str, key: str) -> Optional[str]:
+        entry = self._namespaces.get(namespace, {}).get(key)
+        if entry is None or entry[1] <= time.monotonic():
+            return None
+        return entry[0]
+
+    def pop(self, namespace: str, key: str) -> Optional[str]:
+        """Забирает значение: второй вызов с тем же ключом вернёт None"""
+        with self._lock:
+            entry = self._entries(namespace).pop(key, None)
+        if entry is None or entry[1] <= time.monotonic():
+            return None
+        return entry[0]
+
+    def __len__(self):
+        with self._lock:
+            return sum(len(entries) for entries in self._namespaces.values())
+
+
+class DatabaseStore:
+    """Хранилище в таблице ephemeral_state: одно на все процессы и узлы"""
+
+    def __init__(self, max_entries: int):
+        self.max_entries = max_entries
+        self._puts = 0
+
+    def put(self, namespace: str, key: str, value: str, ttl: float):
+        expires_at = datetime.utcnow() + timedelta(seconds=ttl)
+        with write_session() as db:
+            db.query(EphemeralState).filter(
+                EphemeralState.namespace == namespace, EphemeralState.key == key
+            ).delete(synchronize_session=False)
+            db.add(EphemeralState(namespace=namespace, key=key, value=value, expires_at=expires_at))
+            self._maybe_prune(db, namespace)
+            db.commit()
+
+    def update(self, namespace: str, key: str, change: Callable, ttl: float):
+        """change(прежнее значение или None) -> (новое значение, результат); строка меняется под блокировкой"""
+        for attempt in range(2):
+            try:
+                with write_session() as db:
+                    row = db.query(EphemeralState).filter(
+                        EphemeralState.namespace == namespace, EphemeralState.key == key
+                    ).with_for_update().first()
+                    now = datetime.utcnow()
+                    value, result = change(row.value if row is not None and row.expires_at > now else None)
+                    expires_at = now + timedelta(seconds=ttl)
+                    if row is None:
+                        db.add(EphemeralState(namespace=namespace, key=key, value=value, expires_at=expires_at))
+                    else:
+                        row.value, row.expires_at = value, expires_at
+                    self._maybe_prune(db, namespace)
+                    db.commit()
+                    return result
+            except IntegrityError:
+                # Ту же запись одновременно создал другой процесс — второй раз её уже найдём
+                if attempt:
+                    raise
+
+    def get(self, namespace: str, key: str) -> Optional[str]:
+        with SessionLocal() as db:
+            return db.query(EphemeralState.value).filter(
+                EphemeralState.namespace == namespace,
+                EphemeralState.key == key,
+                EphemeralState.expires_at > datetime.utcnow(),
+            ).scalar()
+
+    def pop(self, namespace: str, key: str) -> Optional[str]:
+        """Забирает значение: из одновременных вызовов с одним ключом значение получит только один"""
+        with write_session() as db:
+            value = db.execute(
+                delete(EphemeralState)
+                .where(EphemeralState.namespace == namespace, EphemeralState.key == key)
+                .returning(EphemeralState.value, EphemeralState.expires_at)
+            ).first()
+            db.commit()
+        if value is None or value.expires_at <= datetime.utcnow():
+            return None
+        return value.value
+
+    def _maybe_prune(self, db, namespace: str):
+        """Раз в _PRUNE_EVERY записей удаляет просроченное и самые старые записи namespace сверх max_entries"""
+        self._puts += 1
+        if self._puts % _PRUNE_EVERY != 1:
+            return
+        # Изменённая, но не записанная строка иначе может удалиться как просроченная
+        db.flush()
+        db.query(EphemeralState).filter(EphemeralState.expires_at <= datetime.utcnow()).delete(
+            synchronize_session=False
+        )
+        entries = db.query(EphemeralState).filter(EphemeralState.namespace == namespace)
+        excess = entries.with_entities(func.count()).scalar() - self.max_entries
+        if excess > 0:
+            cutoff = entries.with_entities(EphemeralState.expires_at).order_by(EphemeralState.expires_at).offset(
+                excess - 1
+            ).limit(1).scalar()
+            entries.filter(EphemeralState.expires_at <= cutoff).delete(synchronize_session=False)
+
+    def __len__(self):
+        with SessionLocal() as db:
+            return db.query(func.count()).select_from(EphemeralState).scalar()
+
+
+def create_store(kind: str, max_entries: int):
+    if kind == "memory":
+        return MemoryStore(max_entries)
+    if kind == "database":
+        return DatabaseStore(max_entries)
+    raise ValueError(f"Неизвестное хранилище состояния: {kind}")
+
+
+store = create_store(settings.STATE_STORE, settings.STATE_STORE_MAX_ENTRIES)
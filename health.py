@@ -0,0 +1,297 @@
+"""
+Проверка потоков плейлиста: на URL каждого канала идёт HEAD-запрос, а если
+сервер его не принимает — GET первого байта (Range: bytes=0-0). Тело ответа
+не читается, редиректы проходятся. URL задают пользователи, поэтому запрос и
+каждый редирект идут только на публичные адреса (utils/url_guard.py); URL во
+внутренней сети получает статус blocked и не запрашивается.
+
+Запросы асинхронные, через один httpx.AsyncClient с пулом соединений: всего
+одновременно не больше HEALTH_CHECK_CONCURRENCY, к одному хосту — не больше
+HEALTH_CHECK_PER_HOST, каждый — не дольше HEALTH_CHECK_TIMEOUT секунд.
+Одинаковые URL проверяются один раз.
+
+Состояние проверки и результаты по каналам хранятся в таблицах health_checks
+и channel_health, поэтому их отдаёт любой процесс приложения; сами запросы
+идут в процессе, который запустил проверку. Результат канала действует, пока
+его URL не поменяли.
+"""
+import asyncio
+import time
+from collections import defaultdict, deque
+from datetime import datetime, timedelta
+from functools import partial
+from itertools import chain, zip_longest
+from typing import Optional
+from urllib.parse import urlsplit
+
+import httpx
+from sqlalchemy import and_, func, insert
+from sqlalchemy.exc import IntegrityError
+from sqlalchemy.orm import Session
+from starlette.concurrency import run_in_threadpool
+
+from config import settings
+from database import ChannelHealth, HealthCheck, PlaylistChannel, write_session
+from logging_conf import get_logger
+from utils import url_guard
+
+logger = get_logger(__name__)
+
+# Результаты пишутся в базу пачками: по _SAVE_BATCH URL или раз в _SAVE_INTERVAL секунд
+_SAVE_BATCH = 200
+_SAVE_INTERVAL = 2.0
+
+# Статусы каналов, поток которых не ответил. Таймаут бывает и у живого, но
+# медленного или перегруженного сервера, поэтому удаляются такие каналы только по запросу
+PROBLEM_STATUSES = ("dead", "timeout")
+
+_tasks = {}  # id плейлиста -> asyncio.Task, только для проверок этого процесса
+
+
+class CheckRunning(Exception):
+    """Проверка плейлиста уже идёт"""
+
+
+class _Superseded(Exception):
+    """Проверку перезапустили, пока эта считалась брошенной"""
+
+
+async def _request(client: httpx.AsyncClient, method: str, url: str, timeout: float, **kwargs) -> int:
+    # stream() отдаёт ответ после заголовков: тело живого потока не кончается, его не читаем
+    async def send():
+        async with client.stream(method, url, **kwargs) as response:
+            return response.status_code
+    return await asyncio.wait_for(send(), timeout)
+
+
+async def probe(client: httpx.AsyncClient, url: str, timeout: float = None) -> dict:
+    """
+    Проверяет один URL: {"status", "http_status", "latency_ms", "error"}.
+    status: ok — ответ меньше 400; dead — ошибка HTTP или соединения;
+    timeout — сервер не ответил вовремя; skipped — не HTTP(S), не проверяется;
+    blocked — URL или его редирект ведёт во внутреннюю сеть, запрос не отправлен
+    """
+    timeout = timeout or settings.HEALTH_CHECK_TIMEOUT
+    if urlsplit(url).scheme.lower() not in ("http", "https"):
+        return {"status": "skipped", "http_status": None, "latency_ms": None, "error": "Не HTTP-поток"}
+
+    started = time.perf_counter()
+    result = {"status": "dead", "http_status": None, "latency_ms": None, "error": None}
+    try:
+        try:
+            http_status = await _request(client, "HEAD", url, timeout)
+        except httpx.RemoteProtocolError:
+            # Некоторые серверы потоков рвут соединение на HEAD
+            http_status = None
+        if http_status is None or http_status >= 400:
+            http_status = await _request(client, "GET", url, timeout, headers={"Range": "bytes=0-0"})
+    except url_guard.BlockedURL as e:
+        result.update(status="blocked", error=str(e))
+    except (asyncio.TimeoutError, httpx.TimeoutException):
+        result.update(status="timeout", error="Нет ответа")
+    except httpx.TooManyRedirects:
+        result["error"] = "Слишком много редиректов"
+    except Exception as e:
+        result["error"] = str(e) or type(e).__name__
+    else:
+        result.update(status="ok" if http_status < 400 else "dead", http_status=http_status)
+    result["latency_ms"] = round((time.perf_counter() - started) * 1000)
+    return result
+
+
+def _interleave_hosts(urls) -> list:
+    """URL по очереди с разных хостов: иначе все запросы упрутся в лимит одного хоста"""
+    by_host = defaultdict(list)
+    for url in urls:
+        by_host[urlsplit(url).hostname].append(url)
+    return [url for url in chain.from_iterable(zip_longest(*by_host.values())) if url is not None]
+
+
+async def check_urls(urls, concurrency: int = None, per_host: int = None, timeout: float = None):
+    """Проверяет разные URL и отдаёт (url, результат probe) по мере готовности"""
+    concurrency = concurrency or settings.HEALTH_CHECK_CONCURRENCY
+    per_host = per_host or settings.HEALTH_CHECK_PER_HOST
+    timeout = timeout or settings.HEALTH_CHECK_TIMEOUT
+    pending = deque(_interleave_hosts(urls))
+    total = len(pending)
+    if not total:
+        return
+
+    results = asyncio.Queue()
+    hosts = defaultdict(lambda: asyncio.Semaphore(per_host))
+    limits = httpx.Limits(max_connections=concurrency, max_keepalive_connections=concurrency)
+
+    hooks = {"request": [partial(url_guard.check_request_async, allow_private=settings.HEALTH_CHECK_ALLOW_PRIVATE)]}
+    async with httpx.AsyncClient(
+            limits=limits, timeout=timeout, follow_redirects=True, max_redirects=5, event_hooks=hooks
+    ) as client:
+        async def worker():
+            while pending:
+                url = pending.popleft()
+                async with hosts[urlsplit(url).hostname]:
+                    result = await probe(client, url, timeout)
+                await results.put((url, result))
+
+        workers = [asyncio.create_task(worker()) for _ in range(min(concurrency, total))]
+        try:
+            for _ in range(total):
+                yield await results.get()
+        finally:
+            for task in workers:
+                task.cancel()
+            await asyncio.gather(*workers, return_exceptions=True)
+
+
+def _stale_after() -> timedelta:
+    # Проверка пишет прогресс хотя бы раз за два запроса к URL; дольше — процесс её бросил
+    return timedelta(seconds=max(120, 3 * settings.HEALTH_CHECK_TIMEOUT))
+
+
+def _prepare(playlist_id: str):
+    """Помечает проверку начатой и забирает URL каналов: {url: [id каналов]}, время начала"""
+    started = datetime.utcnow()
+    with write_session() as db:
+        check = db.get(HealthCheck, playlist_id, with_for_update=True)
+        if check is not None and check.status == "running" and check.updated_at > started - _stale_after():
+            raise CheckRunning()
+        by_url = defaultdict(list)
+        for channel_id, url in db.query(PlaylistChannel.id, PlaylistChannel.url).filter(
+            PlaylistChannel.playlist_id == playlist_id
+        ):
+            if url:
+                by_url[url].append(channel_id)
+
+        values = dict(status="running", total=len(by_url), checked=0, error=None,
+                      started_at=started, updated_at=started)
+        if check is None:
+            db.add(HealthCheck(playlist_id=playlist_id, **values))
+        else:
+            for key, value in values.items():
+                setattr(check, key, value)
+        db.query(ChannelHealth).filter(ChannelHealth.playlist_id == playlist_id).delete(synchronize_session=False)
+        try:
+            db.commit()
+        except IntegrityError:
+            # Другой процесс успел начать ту же проверку
+            db.rollback()
+            raise CheckRunning()
+    return dict(by_url), started
+
+
+def _save(playlist_id: str, started: datetime, by_url: dict, results: list, **state):
+    """Дописывает результаты пачки и прогресс, если проверку не перезапустили"""
+    now = datetime.utcnow()
+    with write_session() as db:
+        values = dict(state, updated_at=now)
+        if results:
+            values["checked"] = HealthCheck.checked + len(results)
+        updated = db.query(HealthCheck).filter(
+            HealthCheck.playlist_id == playlist_id, HealthCheck.started_at == started
+        ).update(values, synchronize_session=False)
+        if not updated:
+            raise _Superseded()
+        rows = [
+            dict(result, channel_id=channel_id, playlist_id=playlist_id, url=url, checked_at=now)
+            for url, result in results
+            for channel_id in by_url[url]
+        ]
+        if rows:
+            db.execute(insert(ChannelHealth), rows)
+        db.commit()
+
+
+async def _run(playlist_id: str, started: datetime, by_url: dict):
+    batch = []
+    saved_at = time.monotonic()
+    try:
+        async for url, result in check_urls(by_url):
+            batch.append((url, result))
+            if len(batch) >= _SAVE_BATCH or time.monotonic() - saved_at >= _SAVE_INTERVAL:
+                await run_in_threadpool(_save, playlist_id, started, by_url, batch)
+                batch = []
+                saved_at = time.monotonic()
+        await run_in_threadpool(_save, playlist_id, started, by_url, batch, status="done")
+        logger.info(f"Проверка потоков {playlist_id}: {len(by_url)} URL")
+    except _Superseded:
+        logger.info(f"Проверка потоков {playlist_id} перезапущена другим процессом")
+    except asyncio.CancelledError:
+        await _save_error(playlist_id, started, "Проверка прервана перезапуском сервера")
+        raise
+    except Exception as e:
+        logger.error(f"Проверка потоков {playlist_id}: {e}")
+        await _save_error(playlist_id, started, f"Ошибка проверки: {e}")
+    finally:
+        if _tasks.get(playlist_id) is asyncio.current_task():
+            del _tasks[playlist_id]
+
+
+async def _save_error(playlist_id: str, started: datetime, error: str):
+    try:
+        await run_in_threadpool(_save, playlist_id, started, {}, [], status="error", error=error)
+    except Exception as e:
+        logger.error(f"Проверка потоков {playlist_id}: не удалось сохранить состояние: {e}")
+
+
+async def start_check(playlist_id: str):
+    """Запускает проверку потоков плейлиста в фоне; CheckRunning — она уже идёт"""
+    if playlist_id in _tasks:
+        raise CheckRunning()
+    by_url, started = await run_in_threadpool(_prepare, playlist_id)
+    _tasks[playlist_id] = asyncio.create_task(_run(playlist_id, started, by_url))
+
+
+async def shutdown():
+    """Прерывает проверки этого процесса; они помечаются ошибкой"""
+    tasks = list(_tasks.values())
+    for task in tasks:
+        task.cancel()
+    await asyncio.gather(*tasks, return_exceptions=True)
+
+
+def _current(db: Session, playlist_id: str):
+    """Результаты каналов плейлиста, полученные для их нынешних URL"""
+    return db.query(ChannelHealth).join(PlaylistChannel, and_(
+        PlaylistChannel.id == ChannelHealth.channel_id,
+        PlaylistChannel.playlist_id == playlist_id,
+        PlaylistChannel.url == ChannelHealth.url
+    )).filter(ChannelHealth.playlist_id == playlist_id)
+
+
+def report(db: Session, playlist_id: str) -> Optional[dict]:
+    """Состояние последней проверки и каналы, поток которых не ответил; None — проверок не было"""
+    check = db.get(HealthCheck, playlist_id)
+    if check is None:
+        return None
+    counts = dict(
+        _current(db, playlist_id).with_entities(ChannelHealth.status, func.count()).group_by(ChannelHealth.status)
+    )
+    problems = _current(db, playlist_id).filter(ChannelHealth.status.in_(PROBLEM_STATUSES)).order_by(
+        ChannelHealth.channel_id
+    ).with_entities(
+        ChannelHealth.channel_id, ChannelHealth.status, ChannelHealth.http_status,
+        ChannelHealth.latency_ms, ChannelHealth.error
+    )
+    return {
+        "status": check.status,
+        "progress": round(check.checked / check.total, 3) if check.total else 1.0,
+        "total": check.total,
+        "checked": check.checked,
+        "error": check.error,
+        "started_at": check.started_at.isoformat(),
+        "counts": counts,
+        "problems": [
+            {"id": channel_id, "status": status, "http_status": http_status, "latency_ms": latency_ms, "error": error}
+            for channel_id, status, http_status, latency_ms, error in problems
+        ],
+    }
+
+
+def dead_channel_ids(db: Session, playlist_id: str, include_timeouts: bool = False) -> list:
+    """id мёртвых каналов последней проверки; include_timeouts — и тех, что не ответили вовремя"""
+    statuses = PROBLEM_STATUSES if include_timeouts else ("dead",)
+    return [
+        channel_id for channel_id, in _current(db, playlist_id).filter(
+            ChannelHealth.status.in_(statuses)
+        ).with_entities(ChannelHealth.channel_id)
+    ]
+
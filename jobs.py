@@ -0,0 +1,275 @@
+"""
+Фоновый разбор больших плейлистов: файл делится на куски по границам записей,
+куски разбираются параллельно в пуле процессов и склеиваются в порядке файла.
+
+Состояние задачи хранится в таблице parse_jobs, а каналы каждого куска — по
+мере готовности отдельной строкой parse_job_shards: статус и результат отдаёт
+любой процесс приложения, и результат большого файла нигде не собирается в
+памяти целиком. Временный файл и пул есть только у процесса, принявшего
+загрузку. Задачи удаляются через PARSE_JOB_TTL секунд без изменений.
+"""
+import json
+import multiprocessing
+import os
+import shutil
+import tempfile
+import threading
+import time
+import uuid
+from concurrent.futures import ProcessPoolExecutor
+from concurrent.futures.process import BrokenProcessPool
+from dataclasses import dataclass, field
+from datetime import datetime, timedelta
+from functools import partial
+from typing import Callable, Optional
+
+from sqlalchemy import select
+from sqlalchemy.orm import defer
+
+import metrics
+from config import settings
+from database import ParseJob, ParseJobShard, SessionLocal, write_session
+from logging_conf import get_logger
+from utils.parser import parse_m3u_shard, read_m3u_tvg_url, split_m3u_file
+
+logger = get_logger(__name__)
+
+_running = {}  # id задачи -> _Shards, только для задач этого процесса
+_lock = threading.Lock()
+_executor = None
+
+
+@dataclass
+class _Shards:
+    """Куски задачи, которые разбирает этот процесс"""
+    path: str
+    shards: int
+    futures: list = field(default_factory=list)
+    done: int = 0
+    channel_count: int = 0
+    on_finish: Optional[Callable] = None  # Вызывается один раз, когда задача этого процесса завершилась
+    started: float = field(default_factory=time.perf_counter)
+
+
+def _finished(state: _Shards):
+    if state.on_finish is not None:
+        state.on_finish()
+
+
+def get_executor() -> ProcessPoolExecutor:
+    """Пул процессов создаётся при первой задаче; spawn — чтобы не копировать потоки и соединения приложения"""
+    global _executor
+    with _lock:
+        if _executor is None:
+            _executor = ProcessPoolExecutor(
+                max_workers=settings.PARSE_WORKERS,
+                mp_context=multiprocessing.get_context("spawn")
+            )
+        return _executor
+
+
+def _drop_executor():
+    """Сломанный пул (упал процесс) больше не принимает задачи — следующая создаст новый"""
+    global _executor
+    _executor = None
+
+
+def shutdown():
+    """Останавливает пул; незаконченные задачи этого процесса помечаются ошибкой"""
+    global _executor
+    with _lock:
+        executor, _executor = _executor, None
+        interrupted = dict(_running)
+        _running.clear()
+    if executor is not None:
+        executor.shutdown(wait=True, cancel_futures=True)
+    for job_id, state in interrupted.items():
+        _save_state(job_id, status="error", error="Разбор прерван перезапуском сервера")
+        _delete_shards(job_id)
+        _finished(state)
+
+
+def save_upload(fileobj) -> str:
+    """Копирует загруженный файл во временный: процессы пула читают его по путям"""
+    with tempfile.NamedTemporaryFile("wb", suffix=".m3u", delete=False) as f:
+        shutil.copyfileobj(fileobj, f, 1024 * 1024)
+        return f.name
+
+
+def save_text(content: str) -> str:
+    with tempfile.NamedTemporaryFile("wb", suffix=".m3u", delete=False) as f:
+        f.write(content.encode("utf-8"))
+        return f.name
+
+
+def start_parse_job(path: str, owner_id: Optional[int] = None, on_finish: Optional[Callable] = None) -> str:
+    """
+    Запускает разбор файла и сразу возвращает id задачи; файл удаляется по её
+    завершении. on_finish вызывается, когда задача завершится, если она запустилась
+    """
+    try:
+        size = os.path.getsize(path)
+        tvg_url = read_m3u_tvg_url(path)
+        ranges = split_m3u_file(path, settings.PARSE_SHARD_SIZE)
+    except OSError as e:
+        _remove(path)
+        raise ValueError(f"Не удалось прочитать файл: {e}")
+
+    job_id = uuid.uuid4().hex
+    with write_session() as db:
+        _purge(db)
+        db.add(ParseJob(
+            id=job_id, owner_id=owner_id, status="running", shards=len(ranges),
+            shards_done=0, channel_count=0, tvg_url=tvg_url, updated_at=datetime.utcnow()
+        ))
+        db.commit()
+
+    state = _Shards(path=path, shards=len(ranges), on_finish=on_finish)
+    with _lock:
+        _running[job_id] = state
+
+    # Файл удаляет последний завершившийся кусок, поэтому после отправки кусков его не трогаем
+    logger.info(f"Задача разбора {job_id}: {len(ranges)} кусков, {size} байт")
+    executor = get_executor()
+    for index, (start, end) in enumerate(ranges):
+        future = executor.submit(parse_m3u_shard, path, start, end, tvg_url)
+        state.futures.append(future)
+        future.add_done_callback(partial(_shard_done, job_id, index))
+    return job_id
+
+
+def _shard_done(job_id: str, index: int, future):
+    # Под _lock — только счётчики в памяти. В базу пишем вне неё: запись ждёт
+    # очереди писателей, и колбэки других кусков и get_executor ждать её не должны
+    with _lock:
+        if job_id not in _running:
+            return  # Задача уже завершилась ошибкой или прервана
+    try:
+        count, text = future.result()
+        if text:
+            _save_shard(job_id, index, text)
+    except Exception as e:
+        _fail(job_id, e)
+        return
+
+    with _lock:
+        state = _running.get(job_id)
+        if state is None:
+            return
+        state.done += 1
+        state.channel_count += count
+        done, channel_count = state.done, state.channel_count
+        finished = done == state.shards
+        if finished:
+            del _running[job_id]
+
+    if finished:
+        # Строки всех кусков уже записаны: каждый кусок пишет свою до того, как засчитать себя
+        _save_state(job_id, status="done", shards_done=done, channel_count=channel_count)
+        _remove(state.path)
+        _finished(state)
+        metrics.parse_duration.observe(time.perf_counter() - state.started, "done")
+        metrics.parse_channels.observe(channel_count)
+    else:
+        # Колбэки кусков пишут без блокировки и могут прийти не по порядку
+        _save_state(job_id, ParseJob.shards_done < done, shards_done=done, channel_count=channel_count)
+
+
+def _fail(job_id: str, error: Exception):
+    with _lock:
+        state = _running.pop(job_id, None)
+        if state is None:
+            return
+        if isinstance(error, BrokenProcessPool):
+            _drop_executor()
+    logger.error(f"Задача разбора {job_id}: {error}")
+    _save_state(job_id, status="error", error=f"Ошибка разбора: {error}")
+    _delete_shards(job_id)
+    _remove(state.path)
+    _finished(state)
+    metrics.parse_duration.observe(time.perf_counter() - state.started, "error")
+    # Отмена вызывает колбэки отменённых кусков, поэтому она — вне блокировки
+    for other in state.futures:
+        other.cancel()
+
+
+def _save_shard(job_id: str, index: int, text: str):
+    with write_session() as db:
+        db.add(ParseJobShard(job_id=job_id, shard=index, result=text))
+        db.commit()
+
+
+def _delete_shards(job_id: str):
+    try:
+        with write_session() as db:
+            db.query(ParseJobShard).filter(ParseJobShard.job_id == job_id).delete(synchronize_session=False)
+            db.commit()
+    except Exception as e:
+        logger.error(f"Задача разбора {job_id}: не удалось удалить куски: {e}")
+
+
+def _save_state(job_id: str, *conditions, **values):
+    """Записывает состояние задачи; колбэки пула не должны падать из-за базы"""
+    try:
+        with write_session() as db:
+            db.query(ParseJob).filter(ParseJob.id == job_id, ParseJob.status == "running", *conditions).update(
+                dict(values, updated_at=datetime.utcnow()), synchronize_session=False
+            )
+            db.commit()
+    except Exception as e:
+        logger.error(f"Задача разбора {job_id}: не удалось сохранить состояние: {e}")
+
+
+def get_job(job_id: str) -> Optional[ParseJob]:
+    """Задача без результата — его отдаёт iter_result_json"""
+    with SessionLocal() as db:
+        return db.query(ParseJob).options(defer(ParseJob.result)).filter(ParseJob.id == job_id).first()
+
+
+def summary(job: ParseJob) -> dict:
+    return {
+        "id": job.id,
+        "status": job.status,
+        "progress": round(job.shards_done / job.shards, 3) if job.shards else 0.0,
+        "shards": job.shards,
+        "shards_done": job.shards_done,
+        "channel_count": job.channel_count,
+        "error": job.error,
+    }
+
+
+def iter_result_json(job: ParseJob):
+    """
+    Ответ готовой задачи: сводка и каналы, уже закодированные процессами пула.
+    Куски читаются из базы по одному, в памяти — не больше одного куска
+    """
+    with SessionLocal() as db:
+        shards = db.scalars(
+            select(ParseJobShard.shard).where(ParseJobShard.job_id == job.id).order_by(ParseJobShard.shard)
+        ).all()
+    head = json.dumps(dict(summary(job), tvg_url=job.tvg_url), ensure_ascii=False)
+    yield head[:-1] + ', "channels": ['
+    for number, shard in enumerate(shards):
+        with SessionLocal() as db:
+            text = db.scalar(
+                select(ParseJobShard.result).where(ParseJobShard.job_id == job.id, ParseJobShard.shard == shard)
+            )
+        if number:
+            yield ","
+        yield text
+    yield "]}"
+
+
+def _purge(db):
+    """Удаляет задачи, не менявшиеся дольше PARSE_JOB_TTL (в том числе брошенные упавшим процессом)"""
+    deadline = datetime.utcnow() - timedelta(seconds=settings.PARSE_JOB_TTL)
+    expired = select(ParseJob.id).where(ParseJob.updated_at < deadline)
+    db.query(ParseJobShard).filter(ParseJobShard.job_id.in_(expired)).delete(synchronize_session=False)
+    db.query(ParseJob).filter(ParseJob.updated_at < deadline).delete(synchronize_session=False)
+
+
+def _remove(path: str):
+    try:
+        os.remove(path)
+    except OSError:
+        pass
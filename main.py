@@ -1,75 +1,211 @@
 import uvicorn
+import asyncio
 import random
-from fastapi import FastAPI, File, UploadFile, Form, HTTPException, Request, Depends, Response
-from fastapi.responses import HTMLResponse, JSONResponse, RedirectResponse
+from fastapi import FastAPI, File, UploadFile, Form, HTTPException, Request, Depends, Response, Query
+from fastapi.responses import FileResponse, HTMLResponse, JSONResponse, RedirectResponse, StreamingResponse
 from fastapi.templating import Jinja2Templates
 from fastapi.staticfiles import StaticFiles
 from fastapi.security import OAuth2PasswordRequestForm
-from sqlalchemy.orm import Session
+from sqlalchemy.orm import Session, defer
+from anyio import to_thread
+from starlette.concurrency import run_in_threadpool
+from uvicorn.middleware.proxy_headers import ProxyHeadersMiddleware
+import math
 import os
 import uuid
 from datetime import datetime, timedelta
-from jose import jwt
-from passlib.context import CryptContext
+from typing import Optional
+import hmac
 
 # Импортируем настройки логирования
 from logging_conf import get_logger
 
 from config import settings
-from models import Channel
+from models import Channel, PlaylistOperation, PlaylistPatch
 from utils.parser import parse_m3u
-from utils.generator import generate_m3u
-from database import SessionLocal, User, Playlist, get_db
-from auth import authenticate_admin, create_access_token, init_admin_user, get_password_hash, verify_password
+from database import User, Playlist, Subscription, get_db, get_replica_db, replica_session, write_session
+from auth import (
+    SessionUser, authenticate_admin, create_session_token, forget_user, init_admin_user, get_password_hash,
+    revoke_tokens, user_cache, user_from_token, verify_password
+)
 from utils.generate_id import generate_short_id
-
-# Создаем контекст для хэширования паролей
-pwd_context = CryptContext(schemes=["argon2", "bcrypt"], deprecated="auto")
+from utils.http_cache import http_date, is_not_modified, choose_encoding, encoded_etag
+from utils.cache import PlaylistCache
+from utils.channels import iter_json_response
+from utils import blob_files
+import storage
+import ephemeral
+import ratelimit
+import jobs
+import migrations
+import search
+import health
+import subscriptions
+import metrics
+import profiling
 
 # Создаем экземпляр приложения
 app = FastAPI(title="IPTV Playlist Manager")
+app.add_middleware(metrics.MetricsMiddleware)
+# Адрес клиента из X-Forwarded-For — только от доверенных прокси; добавлен последним, чтобы работать первым
+if settings.TRUSTED_PROXIES:
+    app.add_middleware(ProxyHeadersMiddleware, trusted_hosts=settings.TRUSTED_PROXIES)
+metrics.instrument_db()
+# Запросы к любому маршруту администратор может профилировать (/admin/profiling)
+app.router.route_class = profiling.ProfiledRoute
+profiling.instrument_db()
 
 # Инициализируем логгер
 logger = get_logger(__name__)
 
-# Инициализация при старте
+# Обработчики, которые ходят в базу, разбирают плейлисты или хэшируют пароли,
+# объявлены обычными def: FastAPI выполняет их в пуле потоков, и event loop
+# остаётся свободным для остальных запросов. Размер пула ограничиваем настройкой
+@app.on_event("startup")
+async def configure_threadpool():
+    to_thread.current_default_thread_limiter().total_tokens = settings.THREADPOOL_SIZE
+
+@app.on_event("shutdown")
+def stop_parse_workers():
+    jobs.shutdown()
+
+@app.on_event("shutdown")
+async def stop_health_checks():
+    await health.shutdown()
+
+# Файлы текстов, от которых отказались все плейлисты, удаляются не сразу, а
+# периодической уборкой: так их не удалить из-под параллельной записи того же текста
+_sweeper = None
+
+@app.on_event("startup")
+async def start_blob_sweeper():
+    global _sweeper
+    if settings.PLAYLIST_STORAGE == "files":
+        _sweeper = asyncio.create_task(sweep_blob_files_forever())
+
+async def sweep_blob_files_forever():
+    while True:
+        try:
+            await run_in_threadpool(sweep_blob_files)
+        except Exception as e:
+            logger.error(f"Ошибка уборки файлов плейлистов: {e}")
+        await asyncio.sleep(blob_files.SWEEP_INTERVAL)
+
+def sweep_blob_files():
+    with replica_session() as db:
+        storage.sweep_blob_files(db)
+
+# Подписки на источники обновляются по расписанию из таблицы subscriptions;
+# каждый процесс раз в SUBSCRIPTION_POLL_INTERVAL забирает те, которым пора
+_subscription_scheduler = None
+
+@app.on_event("startup")
+async def start_subscription_scheduler():
+    global _subscription_scheduler
+    _subscription_scheduler = asyncio.create_task(refresh_subscriptions_forever())
+
+async def refresh_subscriptions_forever():
+    while True:
+        try:
+            for playlist_id in await subscriptions.refresh_due():
+                playlist_cache.invalidate(playlist_id)
+        except Exception as e:
+            logger.error(f"Ошибка обновления подписок: {e}")
+        await asyncio.sleep(settings.SUBSCRIPTION_POLL_INTERVAL)
+
+# Инициализация при старте: схема базы, администратор, перенос старых данных
+if settings.AUTO_MIGRATE:
+    migrations.migrate()
 init_admin_user()
+with migrations.locked_session() as db:
+    storage.backfill_playlist_summaries(db)
+    storage.migrate_content_to_channels(db)
 
 # Создаем необходимые директории
 os.makedirs(settings.PLAYLISTS_DIR, exist_ok=True)
 
+# Кэш отрендеренных плейлистов для serve_playlist_root
+playlist_cache = PlaylistCache(
+    settings.PLAYLIST_CACHE_MAX_ENTRIES, settings.PLAYLIST_CACHE_MAX_BYTES, settings.PLAYLIST_CACHE_TTL
+)
+
+# Счётчики кэшей и ограничений для /metrics: читаются при выдаче
+metrics.sampled("playlist_cache_requests_total", "Обращения к кэшу плейлистов", "counter",
+                lambda: {("hit",): playlist_cache.hits, ("miss",): playlist_cache.misses}, ("result",))
+metrics.sampled("playlist_cache_evictions_total", "Вытеснения из кэша плейлистов", "counter",
+                lambda: playlist_cache.evictions)
+metrics.sampled("playlist_cache_entries", "Плейлистов в кэше", "gauge", lambda: playlist_cache.stats()["entries"])
+metrics.sampled("playlist_cache_bytes", "Байт в кэше плейлистов", "gauge", lambda: playlist_cache.stats()["bytes"])
+metrics.sampled("user_cache_requests_total", "Обращения к кэшу пользователей", "counter",
+                lambda: {("hit",): user_cache.hits, ("miss",): user_cache.misses}, ("result",))
+metrics.sampled(
+    "rate_limit_requests_total", "Запросы, пропущенные и отклонённые ограничениями", "counter",
+    lambda: {
+        (bucket.name, result): getattr(bucket, result)
+        for bucket in ratelimit.LIMITS if isinstance(bucket, ratelimit.TokenBucket)
+        for result in ("allowed", "rejected")
+    },
+    ("limit", "result"),
+)
+metrics.sampled("parse_jobs_active", "Задачи разбора, выполняемые сейчас", "gauge",
+                lambda: ratelimit.parse_jobs.active)
+metrics.sampled("parse_jobs_rejected_total", "Загрузки, отклонённые из-за предела задач разбора", "counter",
+                lambda: ratelimit.parse_jobs.rejected)
+
 # Настройка шаблонов и статики
 templates = Jinja2Templates(directory="templates")
 app.mount("/static", StaticFiles(directory="static"), name="static")
 
+# === Ограничение запросов ===
+def retry_after_header(retry_after: float) -> dict:
+    return {"Retry-After": str(math.ceil(retry_after))}
+
+def too_many_requests(retry_after: float) -> HTTPException:
+    return HTTPException(
+        status_code=429, detail="Слишком много запросов, повторите позже", headers=retry_after_header(retry_after)
+    )
+
 # === JWT и авторизация ===
-def get_current_user(request: Request, db: Session = Depends(get_db)):
-    token = request.cookies.get("access_token")
-    if not token:
-        return None
+def get_current_user(request: Request) -> Optional[SessionUser]:
+    """
+    Пользователь из токена в cookie. Разбирается один раз за запрос — и для
+    зависимости, и для прямых вызовов из обработчиков; запись берётся из кэша (auth.py)
+    """
     try:
-        payload = jwt.decode(token, settings.SECRET_KEY, algorithms=["HS256"])
-        username: str = payload.get("sub")
-        user = db.query(User).filter(User.username == username).first()
-        return user
-    except Exception:
-        return None
+        return request.state.user
+    except AttributeError:
+        pass
+    user = user_from_token(request.cookies.get("access_token"))
+    request.state.user = user
+    return user
 
 # === Страницы ===
 @app.get("/login", response_class=HTMLResponse)
-async def login_page(request: Request):
+def login_page(request: Request):
     user = get_current_user(request)
     if user:
         return RedirectResponse("/")
     return templates.TemplateResponse("login.html", {"request": request})
 
 @app.post("/login")
-async def login(
-        response: Response,
+def login(
+        request: Request,
         username: str = Form(...),
         password: str = Form(...),
         db: Session = Depends(get_db)
 ):
+    # Лимит проверяется до argon2: перебор паролей не должен занимать процессор
+    retry_after = ratelimit.login_by_ip.hit(ratelimit.client_ip(request)) or ratelimit.login_by_user.hit(
+        username.casefold()
+    )
+    if retry_after:
+        return templates.TemplateResponse(
+            "login.html",
+            {"request": request, "error": f"Слишком много попыток входа, повторите через {math.ceil(retry_after)} с"},
+            status_code=429,
+            headers=retry_after_header(retry_after)
+        )
+
     # Проверяем администратора
     if authenticate_admin(username, password):
         user = db.query(User).filter(User.username == username).first()
@@ -80,13 +216,13 @@ async def login(
     else:
         # Проверяем обычного пользователя
         user = db.query(User).filter(User.username == username).first()
-        if not user or not pwd_context.verify(password, user.password):
+        if not user or not verify_password(password, user.password):
             return templates.TemplateResponse(
                 "login.html",
                 {"request": request, "error": "Неверный логин или пароль"}
             )
 
-    token = create_access_token(data={"sub": user.username})
+    token = create_session_token(user)
     resp = RedirectResponse("/", status_code=303)
     resp.set_cookie(key="access_token", value=token, httponly=True)
     return resp
@@ -97,8 +233,6 @@ async def logout():
     resp.delete_cookie("access_token")
     return resp
 
-captcha_store = {}
-
 def generate_captcha():
     num1 = random.randint(1, 10)
     num2 = random.randint(1, 10)
@@ -111,79 +245,89 @@ def generate_captcha():
     question = f"{num1} {op} {num2} = ?"
     return question, result
 
-@app.get("/register", response_class=HTMLResponse)
-async def register_page(request: Request):
+def register_form(request: Request, error: Optional[str] = None):
+    """Форма регистрации с новой капчей; ответ хранится CAPTCHA_TTL секунд (ephemeral.py)"""
     question, answer = generate_captcha()
-    # Сохраняем ответ в "сессии" (упрощённо)
-    session_id = str(uuid.uuid4())  # Уникальный ID для каждого пользователя
-    captcha_store[session_id] = answer
-    return templates.TemplateResponse("register.html", {
-        "request": request,
-        "captcha_question": question,
-        "session_id": session_id
-    })
+    session_id = str(uuid.uuid4())  # Уникальный ID для каждой показанной капчи
+    ephemeral.store.put("captcha", session_id, str(answer), settings.CAPTCHA_TTL)
+    context = {"request": request, "captcha_question": question, "session_id": session_id}
+    if error:
+        context["error"] = error
+    return templates.TemplateResponse("register.html", context)
+
+def register_rate_limited(request: Request):
+    """Показ капчи и отправка формы считаются вместе: капча пишет в хранилище, регистрация считает argon2"""
+    retry_after = ratelimit.register_by_ip.hit(ratelimit.client_ip(request))
+    if retry_after:
+        return templates.TemplateResponse(
+            "error.html",
+            {
+                "request": request,
+                "status_code": "429",
+                "title": "Слишком много запросов",
+                "message": f"Слишком много попыток регистрации. Повторите через {math.ceil(retry_after)} с.",
+                "user": None
+            },
+            status_code=429,
+            headers=retry_after_header(retry_after)
+        )
+    return None
+
+@app.get("/register", response_class=HTMLResponse)
+def register_page(request: Request):
+    return register_rate_limited(request) or register_form(request)
 
 @app.post("/register")
-async def register_user(
+def register_user(
         request: Request,
         username: str = Form(...),
         password: str = Form(...),
         email: str = Form(...),
         user_answer: str = Form(...),
-        session_id: str = Form(...),
-        db: Session = Depends(get_db)
+        session_id: str = Form(...)
 ):
-    # Проверяем капчу
-    correct_answer = captcha_store.get(session_id)
-    if not correct_answer or str(correct_answer) != user_answer.strip():
-        # Пересоздаём капчу при ошибке
-        question, new_answer = generate_captcha()
-        captcha_store[session_id] = new_answer
-        return templates.TemplateResponse("register.html", {
-            "request": request,
-            "error": "Неверный ответ на капчу",
-            "captcha_question": question,
-            "session_id": session_id
-        })
-
-    # Проверка существования пользователя
-    existing_user = db.query(User).filter(User.username == username).first()
+    limited = register_rate_limited(request)
+    if limited:
+        return limited
+
+    # Проверяем капчу: ответ забирается из хранилища, повторно ту же капчу не отправить
+    correct_answer = ephemeral.store.pop("captcha", session_id)
+    if correct_answer is None or correct_answer != user_answer.strip():
+        return register_form(request, "Неверный ответ на капчу")
+
+    with write_session() as db:
+        # Проверка существования пользователя
+        existing_user = db.query(User).filter(User.username == username).first()
+        if not existing_user:
+            # Хэшируем пароль
+            hashed_password = get_password_hash(password)
+
+            # Создаём пользователя
+            new_user = User(
+                username=username,
+                password=hashed_password,
+                email=email,
+                is_admin=0
+            )
+            db.add(new_user)
+            db.commit()
+            # Автоматически логиним
+            token = create_session_token(new_user)
+    # Новую капчу кладём после сессии записи: хранилище в базе пишет своей сессией
     if existing_user:
-        question, new_answer = generate_captcha()
-        captcha_store[session_id] = new_answer
-        return templates.TemplateResponse("register.html", {
-            "request": request,
-            "error": "Пользователь уже существует",
-            "captcha_question": question,
-            "session_id": session_id
-        })
-
-    # Хэшируем пароль
-    hashed_password = get_password_hash(password)
+        return register_form(request, "Пользователь уже существует")
 
-    # Создаём пользователя
-    new_user = User(
-        username=username,
-        password=hashed_password,
-        email=email,
-        is_admin=0
-    )
-    db.add(new_user)
-    db.commit()
-
-    # Автоматически логиним
-    token = create_access_token(data={"sub": username})
     resp = RedirectResponse("/", status_code=303)
     resp.set_cookie(key="access_token", value=token, httponly=True)
     return resp
 
 @app.get("/", response_class=HTMLResponse)
-async def index(request: Request, db: Session = Depends(get_db)):
-    user = get_current_user(request, db)
+def index(request: Request, db: Session = Depends(get_db)):
+    user = get_current_user(request)
     if not user:
         return RedirectResponse("/login")
 
-    playlists = db.query(Playlist).filter(Playlist.owner_id == user.id).all()
+    playlists = db.query(Playlist).options(defer(Playlist.content)).filter(Playlist.owner_id == user.id).all()
     return templates.TemplateResponse(
         "index.html",
         {
@@ -194,28 +338,28 @@ async def index(request: Request, db: Session = Depends(get_db)):
     )
 
 @app.get("/playlists", response_class=HTMLResponse)
-async def my_playlists(request: Request, db: Session = Depends(get_db)):
-    user = get_current_user(request, db)
+def my_playlists(request: Request, db: Session = Depends(get_db)):
+    user = get_current_user(request)
     if not user:
         return RedirectResponse("/login")
 
-    playlists = db.query(Playlist).filter(Playlist.owner_id == user.id).all()
-
-    # Добавляем количество каналов
-    playlists_with_info = []
-    for pl in playlists:
-        try:
-            # Используем parse_m3u из utils.parser
-            result = parse_m3u(pl.content)
-            channels = result.get('channels', []) if isinstance(result, dict) and 'channels' in result else []
-            channel_count = len(channels)
-        except Exception as e:
-            logger.error(f"Ошибка парсинга плейлиста {pl.id}: {str(e)}")
-            channel_count = 0
-        playlists_with_info.append({
-            "playlist": pl,
-            "channel_count": channel_count
-        })
+    # Количество каналов хранится в самой записи — текст плейлистов не загружаем
+    playlists = (
+        db.query(Playlist)
+        .options(defer(Playlist.content))
+        .filter(Playlist.owner_id == user.id)
+        .all()
+    )
+    sources = {
+        subscription.playlist_id: subscription
+        for subscription in db.query(Subscription).join(Playlist, Playlist.id == Subscription.playlist_id).filter(
+            Playlist.owner_id == user.id
+        )
+    }
+    playlists_with_info = [
+        {"playlist": pl, "channel_count": pl.channel_count or 0, "subscription": sources.get(pl.id)}
+        for pl in playlists
+    ]
 
     return templates.TemplateResponse(
         "playlists.html",
@@ -227,8 +371,8 @@ async def my_playlists(request: Request, db: Session = Depends(get_db)):
     )
 
 @app.get("/profile", response_class=HTMLResponse)
-async def profile(request: Request, db: Session = Depends(get_db)):
-    user = get_current_user(request, db)
+def profile(request: Request, db: Session = Depends(get_db)):
+    user = get_current_user(request)
     if not user:
         return RedirectResponse("/login")
 
@@ -244,127 +388,374 @@ async def profile(request: Request, db: Session = Depends(get_db)):
     )
 
 @app.get("/upload", response_class=HTMLResponse)
-async def upload_page(request: Request, db: Session = Depends(get_db)):
-    user = get_current_user(request, db)
+def upload_page(request: Request, db: Session = Depends(get_db)):
+    user = get_current_user(request)
     if not user:
         return RedirectResponse("/login")
-    return templates.TemplateResponse("upload.html", {"request": request})
+    return templates.TemplateResponse("upload.html", {"request": request, "user": user})
 
 # === Загрузка плейлиста ===
-@app.post("/upload", response_class=JSONResponse)
-async def upload_playlist(
+# Разбор идёт фоновой задачей в пуле процессов (jobs.py): /upload и /parse-text
+# сразу отвечают id задачи, а клиент опрашивает /jobs/{id} до готовности.
+# Задач в работе у процесса не больше PARSE_MAX_JOBS: сверх — 429, файл даже не сохраняется
+def start_parse_job(save, user) -> dict:
+    if not ratelimit.parse_jobs.acquire():
+        raise too_many_requests(5)
+    try:
+        job_id = jobs.start_parse_job(
+            save(), owner_id=user.id if user else None, on_finish=ratelimit.parse_jobs.release
+        )
+    except ValueError as e:
+        ratelimit.parse_jobs.release()
+        raise HTTPException(status_code=400, detail=str(e))
+    except Exception:
+        ratelimit.parse_jobs.release()
+        raise
+    return {"job_id": job_id, "status_url": f"/jobs/{job_id}"}
+
+@app.post("/upload", response_class=JSONResponse, status_code=202)
+def upload_playlist(
         file: UploadFile = File(...),
-        db: Session = Depends(get_db),
-        user: User = Depends(get_current_user)
+        user: SessionUser = Depends(get_current_user)
 ):
     if not file.filename.endswith((".m3u", ".m3u8")):
         raise HTTPException(status_code=400, detail="Файл должен быть .m3u или .m3u8")
 
-    content = await file.read()
-    try:
-        result = parse_m3u(content.decode("utf-8", errors="ignore"))
-        channels = result.get('channels', []) if isinstance(result, dict) and 'channels' in result else []
-    except Exception as e:
-        raise HTTPException(status_code=500, detail=f"Ошибка парсинга: {str(e)}")
+    # Процессы пула читают свои куски из файла на диске
+    return start_parse_job(lambda: jobs.save_upload(file.file), user)
 
-    return {"channels": channels}
+@app.get("/jobs/{job_id}")
+def parse_job_status(job_id: str, user: SessionUser = Depends(get_current_user)):
+    job = jobs.get_job(job_id)
+    if not job or job.owner_id != (user.id if user else None):
+        raise HTTPException(status_code=404, detail="Задача не найдена")
+    if job.status == "done":
+        # Каналы уже закодированы процессами пула — ответ просто склеивается из кусков
+        return StreamingResponse(jobs.iter_result_json(job), media_type="application/json")
+    return jobs.summary(job)
 
 @app.get("/playlists/{playlist_id}/edit")
-async def edit_playlist(playlist_id: str, db: Session = Depends(get_db), user: User = Depends(get_current_user)):
+def edit_playlist(playlist_id: str, db: Session = Depends(get_db), user: SessionUser = Depends(get_current_user)):
     playlist = db.query(Playlist).filter(Playlist.id == playlist_id, Playlist.owner_id == user.id).first()
     if not playlist:
         raise HTTPException(status_code=404, detail="Плейлист не найден")
 
-    try:
-        result = parse_m3u(playlist.content)
-        channels = result.get('channels', []) if isinstance(result, dict) and 'channels' in result else []
-        tvg_url = result.get('tvg_url', '') if isinstance(result, dict) else ''
-        return {
-            "id": playlist.id,
-            "name": playlist.name,
-            "filename": playlist.filename,
-            "channels": channels,
-            "tvg_url": tvg_url
-        }
-    except Exception as e:
-        raise HTTPException(status_code=500, detail=f"Ошибка парсинга плейлиста: {str(e)}")
-
-@app.put("/playlists/{playlist_id}")
-async def update_playlist(
+    fields = {
+        "id": playlist.id,
+        "name": playlist.name,
+        "filename": playlist.filename,
+        "tvg_url": playlist.tvg_url or "",
+        "version": playlist.version
+    }
+    channels = storage.load_channels(db, playlist)
+    return StreamingResponse(iter_json_response(fields, channels), media_type="application/json")
+
+@app.get("/playlists/{playlist_id}/channels")
+def playlist_channels_page(
         playlist_id: str,
-        data: dict,
+        after: Optional[int] = None,
+        limit: int = Query(200, ge=1, le=1000),
+        group: Optional[str] = None,
+        q: Optional[str] = None,
         db: Session = Depends(get_db),
-        user: User = Depends(get_current_user)
+        user: SessionUser = Depends(get_current_user)
 ):
-    playlist = db.query(Playlist).filter(Playlist.id == playlist_id, Playlist.owner_id == user.id).first()
+    """Каналы постранично, для редактора: ?after=<id последнего канала>&group=...&q=..."""
+    playlist = db.query(Playlist).options(defer(Playlist.content)).filter(
+        Playlist.id == playlist_id, Playlist.owner_id == user.id
+    ).first()
+    if not playlist:
+        raise HTTPException(status_code=404, detail="Плейлист не найден")
+
+    try:
+        page = storage.load_channel_page(db, playlist, after=after, limit=limit, group=group, search=q)
+    except ValueError as e:
+        # Канал-курсор удалён другой правкой — клиенту нужно начать сначала
+        raise HTTPException(status_code=409, detail=str(e))
+    channels = page.pop("channels")
+    return Response("".join(iter_json_response(page, channels)), media_type="application/json")
+
+@app.get("/playlists/{playlist_id}/groups")
+def playlist_groups(playlist_id: str, db: Session = Depends(get_db), user: SessionUser = Depends(get_current_user)):
+    playlist = db.query(Playlist).options(defer(Playlist.content)).filter(
+        Playlist.id == playlist_id, Playlist.owner_id == user.id
+    ).first()
     if not playlist:
         raise HTTPException(status_code=404, detail="Плейлист не найден")
 
+    return {"groups": storage.channel_groups(db, playlist)}
+
+@app.put("/playlists/{playlist_id}")
+def update_playlist(
+        playlist_id: str,
+        data: dict,
+        user: SessionUser = Depends(get_current_user)
+):
     name = data.get("name", "Без названия")
     channels = data.get("channels", [])
 
-    m3u_content = generate_m3u(channels, tvg_url=data.get('tvg_url'))
+    with write_session() as db:
+        playlist = db.query(Playlist).filter(Playlist.id == playlist_id, Playlist.owner_id == user.id).first()
+        if not playlist:
+            raise HTTPException(status_code=404, detail="Плейлист не найден")
 
-    playlist.name = name
-    playlist.filename = f"{name}.m3u"
-    playlist.content = m3u_content
-    db.commit()
+        playlist.name = name
+        playlist.filename = f"{name}.m3u"
+        # Переписываются только изменившиеся строки каналов
+        storage.save_channels(db, playlist, channels, tvg_url=data.get('tvg_url'))
+        db.commit()
+    playlist_cache.invalidate(playlist_id)
 
     return {"message": "Плейлист обновлён", "url": f"/playlists/{playlist_id}.m3u"}
 
+@app.patch("/playlists/{playlist_id}")
+def patch_playlist(
+        playlist_id: str,
+        patch: PlaylistPatch,
+        user: SessionUser = Depends(get_current_user)
+):
+    with write_session() as db:
+        playlist = db.query(Playlist).options(defer(Playlist.content)).filter(
+            Playlist.id == playlist_id, Playlist.owner_id == user.id
+        ).first()
+        if not playlist:
+            raise HTTPException(status_code=404, detail="Плейлист не найден")
+
+        # Правки применяются к строкам каналов на месте, без пересылки всего плейлиста
+        try:
+            refs = storage.apply_operations(db, playlist, patch.ops, base_version=patch.base_version)
+        except storage.VersionConflict:
+            db.rollback()
+            raise HTTPException(status_code=409, detail="Плейлист был изменён в другом окне. Обновите страницу")
+        except ValueError as e:
+            db.rollback()
+            raise HTTPException(status_code=400, detail=str(e))
+        db.commit()
+        version = playlist.version
+    playlist_cache.invalidate(playlist_id)
+
+    return {
+        "message": "Плейлист обновлён",
+        "version": version,
+        "refs": refs,
+        "url": f"/{playlist_id}.m3u"
+    }
+
 @app.delete("/playlists/{playlist_id}")
-async def delete_playlist(playlist_id: str, db: Session = Depends(get_db), user: User = Depends(get_current_user)):
-    playlist = db.query(Playlist).filter(Playlist.id == playlist_id, Playlist.owner_id == user.id).first()
+def delete_playlist(playlist_id: str, user: SessionUser = Depends(get_current_user)):
+    with write_session() as db:
+        playlist = db.query(Playlist).filter(Playlist.id == playlist_id, Playlist.owner_id == user.id).first()
+        if not playlist:
+            raise HTTPException(status_code=404, detail="Плейлист не найден")
+
+        storage.delete_playlist(db, playlist)
+        db.commit()
+    playlist_cache.invalidate(playlist_id)
+    return {"message": "Плейлист удалён"}
+
+# === Проверка потоков ===
+def owns_playlist(playlist_id: str, user) -> bool:
+    with replica_session() as db:
+        return db.query(Playlist.id).filter(Playlist.id == playlist_id, Playlist.owner_id == user.id).first() is not None
+
+@app.post("/playlists/{playlist_id}/health", status_code=202)
+async def start_health_check(playlist_id: str, user: SessionUser = Depends(get_current_user)):
+    """Запускает проверку потоков; ход и результат — GET того же адреса"""
+    if not user:
+        raise HTTPException(status_code=401, detail="Требуется вход")
+    if not await run_in_threadpool(owns_playlist, playlist_id, user):
+        raise HTTPException(status_code=404, detail="Плейлист не найден")
+    try:
+        await health.start_check(playlist_id)
+    except health.CheckRunning:
+        raise HTTPException(status_code=409, detail="Проверка уже идёт")
+    return {"message": "Проверка запущена", "status": "running"}
+
+@app.get("/playlists/{playlist_id}/health")
+def health_check_report(playlist_id: str, db: Session = Depends(get_db), user: SessionUser = Depends(get_current_user)):
+    if not user:
+        raise HTTPException(status_code=401, detail="Требуется вход")
+    playlist = db.query(Playlist.id).filter(Playlist.id == playlist_id, Playlist.owner_id == user.id).first()
     if not playlist:
         raise HTTPException(status_code=404, detail="Плейлист не найден")
 
-    db.delete(playlist)
-    db.commit()
-    return {"message": "Плейлист удалён"}
+    report = health.report(db, playlist_id)
+    if report is None:
+        raise HTTPException(status_code=404, detail="Плейлист ещё не проверялся")
+    return report
 
-@app.post("/parse-text", response_class=JSONResponse)
-async def parse_text(data: dict):
+@app.post("/playlists/{playlist_id}/health/remove-dead")
+def remove_dead_channels(
+        playlist_id: str,
+        data: dict,
+        user: SessionUser = Depends(get_current_user)
+):
+    """
+    Удаляет каналы, поток которых при последней проверке вернул ошибку;
+    не ответившие вовремя — только с include_timeouts
+    """
+    if not user:
+        raise HTTPException(status_code=401, detail="Требуется вход")
+    with write_session() as db:
+        playlist = db.query(Playlist).options(defer(Playlist.content)).filter(
+            Playlist.id == playlist_id, Playlist.owner_id == user.id
+        ).first()
+        if not playlist:
+            raise HTTPException(status_code=404, detail="Плейлист не найден")
+
+        ids = health.dead_channel_ids(db, playlist_id, include_timeouts=bool(data.get("include_timeouts")))
+        if ids:
+            try:
+                storage.apply_operations(
+                    db, playlist, [PlaylistOperation(op="delete", ids=ids)], base_version=data.get("base_version")
+                )
+            except storage.VersionConflict:
+                db.rollback()
+                raise HTTPException(status_code=409, detail="Плейлист был изменён в другом окне. Обновите страницу")
+            db.commit()
+        version = playlist.version
+    if ids:
+        playlist_cache.invalidate(playlist_id)
+
+    return {"message": f"Удалено каналов: {len(ids)}", "removed": len(ids), "version": version}
+
+@app.post("/parse-text", response_class=JSONResponse, status_code=202)
+def parse_text(data: dict, user: SessionUser = Depends(get_current_user)):
     content = data.get("content", "")
     if not content.strip():
         raise HTTPException(status_code=400, detail="Пустой контент")
-    try:
-        result = parse_m3u(content)
-        channels = result.get('channels', []) if isinstance(result, dict) and 'channels' in result else []
-        return {"channels": channels}
-    except Exception as e:
-        raise HTTPException(status_code=500, detail=f"Ошибка парсинга: {str(e)}")
+    return start_parse_job(lambda: jobs.save_text(content), user)
 
 @app.post("/save", response_class=JSONResponse)
-async def save_playlist(
+def save_playlist(
         data: dict,
-        db: Session = Depends(get_db),
-        user: User = Depends(get_current_user)
+        user: SessionUser = Depends(get_current_user)
 ):
     name = data.get("name", "Без названия")
     channels = data.get("channels", [])
 
-    playlist_id = generate_short_id(5)
-    while db.query(Playlist).filter(Playlist.id == playlist_id).first():
+    with write_session() as db:
         playlist_id = generate_short_id(5)
-
-    m3u_content = generate_m3u(channels, tvg_url=data.get('tvg_url'))
-
-    playlist = Playlist(
-        id=playlist_id,
-        name=name,
-        filename=f"{name}.m3u",
-        content=m3u_content,
-        owner_id=user.id
-    )
-    db.add(playlist)
-    db.commit()
+        while db.query(Playlist).filter(Playlist.id == playlist_id).first():
+            playlist_id = generate_short_id(5)
+
+        playlist = Playlist(
+            id=playlist_id,
+            name=name,
+            filename=f"{name}.m3u",
+            owner_id=user.id
+        )
+        storage.save_channels(db, playlist, channels, tvg_url=data.get('tvg_url'))
+        db.commit()
 
     url = f"/{playlist_id}.m3u"  # Изменили: теперь без /playlists/
     return {"message": "Сохранено", "url": url}
 
+# === Подписки на источники ===
+def subscription_interval(data: dict) -> int:
+    hours = data.get("interval_hours")
+    try:
+        hours = settings.SUBSCRIPTION_INTERVAL_HOURS if hours in (None, "") else float(hours)
+    except (TypeError, ValueError):
+        raise HTTPException(status_code=400, detail="Интервал должен быть числом часов")
+    if not 1 <= hours <= 24 * 7:
+        raise HTTPException(status_code=400, detail="Интервал — от 1 часа до недели")
+    return int(hours * 3600)
+
+def refresh_subscription(playlist_id: str, fetched: dict = None) -> dict:
+    try:
+        result = subscriptions.refresh(playlist_id, fetched)
+    except ValueError as e:
+        raise HTTPException(status_code=502, detail=str(e))
+    playlist_cache.invalidate(playlist_id)
+    return result
+
+@app.post("/subscriptions", status_code=201)
+def create_subscription(data: dict, user: SessionUser = Depends(get_current_user)):
+    """Новый плейлист, который следит за источником по ссылке"""
+    if not user:
+        raise HTTPException(status_code=401, detail="Требуется вход")
+    try:
+        url = subscriptions.check_url(data.get("url"))
+    except ValueError as e:
+        raise HTTPException(status_code=400, detail=str(e))
+    interval = subscription_interval(data)
+    # Источник читаем до создания плейлиста: если он недоступен, плейлиста не будет
+    try:
+        fetched = subscriptions.fetch(url)
+    except ValueError as e:
+        raise HTTPException(status_code=502, detail=str(e))
+
+    name = data.get("name") or "Без названия"
+    with write_session() as db:
+        playlist_id = generate_short_id(5)
+        while db.query(Playlist.id).filter(Playlist.id == playlist_id).first():
+            playlist_id = generate_short_id(5)
+        playlist = Playlist(id=playlist_id, name=name, filename=f"{name}.m3u", owner_id=user.id)
+        storage.save_channels(db, playlist, [])
+        subscriptions.subscribe(db, playlist, url, interval)
+        db.commit()
+    result = refresh_subscription(playlist_id, fetched)
+    return dict(result, id=playlist_id, url=f"/{playlist_id}.m3u")
+
+@app.get("/playlists/{playlist_id}/subscription")
+def get_subscription(playlist_id: str, db: Session = Depends(get_db), user: SessionUser = Depends(get_current_user)):
+    if not user:
+        raise HTTPException(status_code=401, detail="Требуется вход")
+    subscription = db.query(Subscription).join(Playlist, Playlist.id == Subscription.playlist_id).filter(
+        Subscription.playlist_id == playlist_id, Playlist.owner_id == user.id
+    ).first()
+    if not subscription:
+        raise HTTPException(status_code=404, detail="Подписка не найдена")
+    return subscriptions.summary(subscription)
+
+@app.put("/playlists/{playlist_id}/subscription")
+def update_subscription(playlist_id: str, data: dict, user: SessionUser = Depends(get_current_user)):
+    """Подписывает плейлист на источник или меняет ссылку и интервал, и сразу обновляет его"""
+    if not user:
+        raise HTTPException(status_code=401, detail="Требуется вход")
+    try:
+        url = subscriptions.check_url(data.get("url"))
+    except ValueError as e:
+        raise HTTPException(status_code=400, detail=str(e))
+    interval = subscription_interval(data)
+    with write_session() as db:
+        playlist = db.query(Playlist).options(defer(Playlist.content)).filter(
+            Playlist.id == playlist_id, Playlist.owner_id == user.id
+        ).first()
+        if not playlist:
+            raise HTTPException(status_code=404, detail="Плейлист не найден")
+        subscriptions.subscribe(db, playlist, url, interval)
+        db.commit()
+    return refresh_subscription(playlist_id)
+
+@app.post("/playlists/{playlist_id}/subscription/refresh")
+def refresh_subscription_now(playlist_id: str, db: Session = Depends(get_db), user: SessionUser = Depends(get_current_user)):
+    if not user:
+        raise HTTPException(status_code=401, detail="Требуется вход")
+    subscription = db.query(Subscription.playlist_id).join(Playlist, Playlist.id == Subscription.playlist_id).filter(
+        Subscription.playlist_id == playlist_id, Playlist.owner_id == user.id
+    ).first()
+    if not subscription:
+        raise HTTPException(status_code=404, detail="Подписка не найдена")
+    return refresh_subscription(playlist_id)
+
+@app.delete("/playlists/{playlist_id}/subscription")
+def delete_subscription(playlist_id: str, user: SessionUser = Depends(get_current_user)):
+    """Отписывает плейлист от источника; каналы остаются"""
+    if not user:
+        raise HTTPException(status_code=401, detail="Требуется вход")
+    with write_session() as db:
+        playlist = db.query(Playlist.id).filter(Playlist.id == playlist_id, Playlist.owner_id == user.id).first()
+        if not playlist:
+            raise HTTPException(status_code=404, detail="Плейлист не найден")
+        subscriptions.unsubscribe(db, playlist_id)
+        db.commit()
+    return {"message": "Подписка отменена"}
+
 @app.get("/new", response_class=HTMLResponse)
-async def new_playlist_page(request: Request, db: Session = Depends(get_db)):
-    user = get_current_user(request, db)
+def new_playlist_page(request: Request, db: Session = Depends(get_db)):
+    user = get_current_user(request)
     if not user:
         return RedirectResponse("/login")
 
@@ -378,59 +769,238 @@ async def new_playlist_page(request: Request, db: Session = Depends(get_db)):
         }
     )
 
-@app.get("/{playlist_id}.m3u")
-async def serve_playlist_root(playlist_id: str, db: Session = Depends(get_db)):
-    playlist = db.query(Playlist).filter(Playlist.id == playlist_id).first()
+@app.get("/playlists/{playlist_id}/editor", response_class=HTMLResponse)
+def playlist_editor_page(playlist_id: str, request: Request, db: Session = Depends(get_db)):
+    user = get_current_user(request)
+    if not user:
+        return RedirectResponse("/login")
+
+    playlist = db.query(Playlist).options(defer(Playlist.content)).filter(
+        Playlist.id == playlist_id, Playlist.owner_id == user.id
+    ).first()
     if not playlist:
         raise HTTPException(status_code=404, detail="Плейлист не найден")
-    return HTMLResponse(content=playlist.content, media_type="audio/mpegurl")
+
+    # Каналы редактор подгружает сам, постранично через /playlists/{id}/channels
+    return templates.TemplateResponse(
+        "edit.html",
+        {
+            "request": request,
+            "user": user,
+            "playlist": playlist,
+            "channels": []
+        }
+    )
+
+def load_playlist_for_cache(playlist_id: str):
+    with replica_session() as db:
+        if not storage.needs_render(db, playlist_id):
+            try:
+                return storage.load_cached_playlist(db, playlist_id, playlist_cache.find_body)
+            except storage.BlobLost:
+                pass
+    # Устаревший или потерянный текст перерисовывается и сохраняется — это уже запись
+    with write_session() as db:
+        return storage.load_cached_playlist(db, playlist_id, playlist_cache.find_body, rerender_lost=True)
+
+def load_playlist_etag(playlist_id: str):
+    with replica_session() as db:
+        return storage.playlist_etag(db, playlist_id)
+
+@app.api_route("/{playlist_id}.m3u", methods=["GET", "HEAD"])
+async def serve_playlist_root(playlist_id: str, request: Request):
+    # Попадание в кэш обслуживается прямо в event loop, без пула потоков и базы;
+    # промах (чтение и, возможно, рендер плейлиста) уходит в пул потоков
+    retry_after = ratelimit.playlist_requests.hit(f"{ratelimit.client_ip(request)} {playlist_id}")
+    if retry_after:
+        raise too_many_requests(retry_after)
+    entry = playlist_cache.get(playlist_id)
+    if entry is not None and playlist_cache.expired(entry):
+        # Плейлист мог изменить другой процесс: сверяем ETag, тело перечитываем, только если он другой
+        if await run_in_threadpool(load_playlist_etag, playlist_id) == entry.etag:
+            playlist_cache.revalidated(entry)
+        else:
+            playlist_cache.invalidate(playlist_id)
+            entry = None
+    if entry is None:
+        generation = playlist_cache.generation
+        entry = await run_in_threadpool(load_playlist_for_cache, playlist_id)
+        if entry is None:
+            raise HTTPException(status_code=404, detail="Плейлист не найден")
+        playlist_cache.put(playlist_id, entry, generation)
+
+    # У каждой версии (без сжатия, gzip, brotli) свой ETag; 304 несёт ETag той, что отдали бы
+    encoding = choose_encoding(request.headers.get("accept-encoding"), entry.encodings)
+    headers = {"ETag": encoded_etag(entry.etag, encoding), "Cache-Control": "no-cache", "Vary": "Accept-Encoding"}
+    if entry.last_modified:
+        headers["Last-Modified"] = http_date(entry.last_modified)
+    if is_not_modified(request.headers.get("if-none-match"), request.headers.get("if-modified-since"),
+                       entry.etag, entry.last_modified):
+        return Response(status_code=304, headers=headers)
+
+    if encoding:
+        headers["Content-Encoding"] = encoding
+    if entry.files is not None:
+        # Текст в файле: FileResponse читает его с диска кусками (тело не попадает
+        # в память целиком) и сам отвечает на Range и If-Range
+        path = entry.files[encoding or ""]
+        try:
+            stat_result = os.stat(path)
+        except FileNotFoundError:
+            # Файл удалили в обход приложения: следующий запрос перерисует текст
+            playlist_cache.invalidate(playlist_id)
+            raise HTTPException(status_code=503, detail="Плейлист обновляется, повторите запрос")
+        return FileResponse(path, media_type="audio/mpegurl", headers=headers, stat_result=stat_result)
+    body = {"br": entry.body_br, "gzip": entry.body_gz}.get(encoding, entry.body)
+    return Response(content=body, media_type="audio/mpegurl", headers=headers)
+
+
+@app.get("/admin/cache/stats")
+async def cache_stats(user: SessionUser = Depends(get_current_user)):
+    if not user or not user.is_admin:
+        raise HTTPException(status_code=403, detail="Доступ запрещён")
+    return playlist_cache.stats()
+
+
+@app.get("/admin/rate-limits/stats")
+async def rate_limit_stats(user: SessionUser = Depends(get_current_user)):
+    """Пропущенные и отклонённые запросы по ограничениям этого процесса"""
+    if not user or not user.is_admin:
+        raise HTTPException(status_code=403, detail="Доступ запрещён")
+    return ratelimit.stats()
+
+
+@app.get("/metrics")
+def metrics_page(request: Request):
+    """
+    Метрики этого процесса в текстовом формате Prometheus. В метках — id
+    плейлистов, то есть секретные ссылки, поэтому нужен администратор или METRICS_TOKEN
+    """
+    authorization = request.headers.get("authorization", "")
+    token_ok = bool(settings.METRICS_TOKEN) and hmac.compare_digest(
+        authorization.encode("utf-8"), f"Bearer {settings.METRICS_TOKEN}".encode("utf-8")
+    )
+    if not token_ok:
+        user = get_current_user(request)
+        if not user or not user.is_admin:
+            raise HTTPException(status_code=403, detail="Доступ запрещён")
+    return Response(content=metrics.render(), media_type="text/plain; version=0.0.4; charset=utf-8")
+
+
+# === Профилирование (profiling.py) ===
+@app.post("/admin/profiling")
+def arm_profiling(data: dict, user: SessionUser = Depends(get_current_user)):
+    """Профилировать следующие запросы к маршруту: {"route": "/shared", "mode": "cprofile"|"sample", "count": 5}"""
+    if not user or not user.is_admin:
+        raise HTTPException(status_code=403, detail="Доступ запрещён")
+    routes = {route.path for route in app.routes if isinstance(route, profiling.ProfiledRoute)}
+    try:
+        return profiling.arm(
+            data.get("route"), data.get("mode", "cprofile"), data.get("count", 1), data.get("method"), routes
+        )
+    except ValueError as e:
+        raise HTTPException(status_code=400, detail=str(e))
+
+
+@app.get("/admin/profiling")
+async def profiling_status(user: SessionUser = Depends(get_current_user)):
+    """Включённые записи и готовые результаты этого процесса, новые первыми"""
+    if not user or not user.is_admin:
+        raise HTTPException(status_code=403, detail="Доступ запрещён")
+    return profiling.status()
+
+
+@app.delete("/admin/profiling")
+async def disarm_profiling(user: SessionUser = Depends(get_current_user)):
+    if not user or not user.is_admin:
+        raise HTTPException(status_code=403, detail="Доступ запрещён")
+    profiling.disarm()
+    return {"message": "Профилирование выключено"}
+
+
+@app.get("/admin/profiling/{capture_id}/profile")
+async def download_profile(capture_id: str, user: SessionUser = Depends(get_current_user)):
+    """Профиль файлом: .pstats для cprofile, .collapsed (свёрнутые стеки для flame graph) для sample"""
+    if not user or not user.is_admin:
+        raise HTTPException(status_code=403, detail="Доступ запрещён")
+    capture = profiling.get_capture(capture_id)
+    if capture is None or capture.profile is None:
+        raise HTTPException(status_code=404, detail="Профиль не найден")
+    media_type = "application/octet-stream" if capture.mode == "cprofile" else "text/plain; charset=utf-8"
+    return Response(
+        content=capture.profile, media_type=media_type,
+        headers={"Content-Disposition": f'attachment; filename="{capture.filename}"'}
+    )
+
+
+@app.get("/admin/profiling/{capture_id}/sql")
+async def profile_sql(capture_id: str, user: SessionUser = Depends(get_current_user)):
+    """SQL-запросы профилированного запроса с временем каждого, по порядку"""
+    if not user or not user.is_admin:
+        raise HTTPException(status_code=403, detail="Доступ запрещён")
+    capture = profiling.get_capture(capture_id)
+    if capture is None:
+        raise HTTPException(status_code=404, detail="Профиль не найден")
+    return capture.sql()
 
 
 @app.get("/shared", response_class=HTMLResponse)
-async def shared_playlists_page(request: Request, db: Session = Depends(get_db)):
-    user = get_current_user(request, db)
+def shared_playlists_page(
+        request: Request,
+        q: Optional[str] = None,
+        db: Session = Depends(get_replica_db),
+        user: SessionUser = Depends(get_current_user)
+):
+    # Список общих плейлистов читается с реплики, пользователь — с основной базы
     if not user:
         return RedirectResponse("/login")
 
     # Получаем все плейлисты, отмеченные как общие
     shared_playlists = (
         db.query(Playlist, User.username.label("owner_username"))
+        .options(defer(Playlist.content))
         .join(User, Playlist.owner_id == User.id)
         .filter(Playlist.is_shared == True)
         .all()
     )
-
-    # Добавляем количество каналов
-    playlists_with_info = []
-    for playlist, owner_username in shared_playlists:
-        try:
-            # Используем parse_m3u из utils.parser
-            result = parse_m3u(playlist.content)
-            channels = result.get('channels', []) if isinstance(result, dict) and 'channels' in result else []
-            channel_count = len(channels)
-        except Exception as e:
-            logger.error(f"Ошибка парсинга плейлиста {playlist.id}: {str(e)}")
-            channel_count = 0
-        playlists_with_info.append({
+    playlists_with_info = [
+        {
             "playlist": playlist,
             "owner_username": owner_username,
-            "channel_count": channel_count
-        })
+            "channel_count": playlist.channel_count or 0
+        }
+        for playlist, owner_username in shared_playlists
+    ]
 
     return templates.TemplateResponse(
         "shared.html",
         {
             "request": request,
             "user": user,
-            "playlists": playlists_with_info
+            "playlists": playlists_with_info,
+            "query": q or "",
+            "found": search.search_shared_channels(db, q, limit=100) if q else None
         }
     )
 
 
+@app.get("/search/channels")
+def search_channels(
+        q: str = "",
+        limit: int = Query(50, ge=1, le=200),
+        db: Session = Depends(get_replica_db),
+        user: SessionUser = Depends(get_current_user)
+):
+    """Каналы общих плейлистов по имени, tvg-id или группе: в каких плейлистах есть канал"""
+    if not user:
+        raise HTTPException(status_code=401, detail="Требуется вход")
+    return {"query": q, "channels": search.search_shared_channels(db, q, limit)}
+
+
 
 @app.get("/users", response_class=HTMLResponse)
-async def users_page(request: Request, db: Session = Depends(get_db)):
-    user = get_current_user(request, db)
+def users_page(request: Request, db: Session = Depends(get_db)):
+    user = get_current_user(request)
     if not user:
         return RedirectResponse("/login")
     if not user.is_admin:
@@ -457,88 +1027,103 @@ async def users_page(request: Request, db: Session = Depends(get_db)):
     )
 
 @app.post("/users", response_class=HTMLResponse)
-async def create_user(
+def create_user(
         username: str = Form(...),
         password: str = Form(...),
         email: str = Form(...),
-        is_admin: bool = Form(False),
-        db: Session = Depends(get_db)
+        is_admin: bool = Form(False)
 ):
-    existing_user = db.query(User).filter(User.username == username).first()
-    if existing_user:
-        raise HTTPException(status_code=400, detail="Пользователь уже существует")
-
+    # Хэш считается до очереди на запись: он медленный, а очередь одна на процесс
     hashed_password = get_password_hash(password)
-    new_user = User(
-        username=username,
-        password=hashed_password,
-        email=email,
-        is_admin=bool(is_admin)
-    )
-    db.add(new_user)
-    db.commit()
+    with write_session() as db:
+        existing_user = db.query(User).filter(User.username == username).first()
+        if existing_user:
+            raise HTTPException(status_code=400, detail="Пользователь уже существует")
+
+        new_user = User(
+            username=username,
+            password=hashed_password,
+            email=email,
+            is_admin=int(bool(is_admin))
+        )
+        db.add(new_user)
+        db.commit()
 
     return RedirectResponse("/users?created=true", status_code=303)
 
 @app.get("/users/{user_id}/edit")
-async def get_user_for_edit(user_id: int, db: Session = Depends(get_db)):
+def get_user_for_edit(user_id: int, db: Session = Depends(get_db)):
     user = db.query(User).filter(User.id == user_id).first()
     if not user:
         raise HTTPException(status_code=404, detail="Пользователь не найден")
     return user
 
 @app.post("/users/{user_id}/edit")
-async def update_user(
+def update_user(
         user_id: int,
         username: str = Form(...),
         password: str = Form(None),  # Может быть None, если поле пустое
-        email: str = Form(...),
-        db: Session = Depends(get_db)
+        email: str = Form(...)
 ):
-    user = db.query(User).filter(User.id == user_id).first()
-    if not user:
-        raise HTTPException(status_code=404, detail="Пользователь не найден")
-
-    # Проверяем, не существует ли другой пользователь с таким именем
-    existing_user = db.query(User).filter(User.username == username, User.id != user_id).first()
-    if existing_user:
-        raise HTTPException(status_code=400, detail="Имя пользователя уже занято")
-
-    # Обновляем данные
-    user.username = username
-    user.email = email
-    if password:  # Если пароль указан, хэшируем и обновляем
-        user.password = get_password_hash(password)
-    
-    db.commit()
+    # Хэш считается до очереди на запись: он медленный, а очередь одна на процесс
+    hashed_password = get_password_hash(password) if password else None
+    with write_session() as db:
+        user = db.query(User).filter(User.id == user_id).first()
+        if not user:
+            raise HTTPException(status_code=404, detail="Пользователь не найден")
+
+        # Проверяем, не существует ли другой пользователь с таким именем
+        existing_user = db.query(User).filter(User.username == username, User.id != user_id).first()
+        if existing_user:
+            raise HTTPException(status_code=400, detail="Имя пользователя уже занято")
+
+        # Смена имени или пароля отзывает выданные пользователю токены
+        if username != user.username or password:
+            revoke_tokens(user)
+        # Обновляем данные
+        user.username = username
+        user.email = email
+        if hashed_password:  # Если пароль указан, обновляем
+            user.password = hashed_password
+
+        db.commit()
+    forget_user(user_id)
     return {"message": "Пользователь успешно обновлён"}
 
 @app.delete("/users/{user_id}")
-async def delete_user(user_id: int, db: Session = Depends(get_db)):
-    user = db.query(User).filter(User.id == user_id).first()
-    if not user:
-        raise HTTPException(status_code=404, detail="Пользователь не найден")
-    if user.is_admin:
-        raise HTTPException(status_code=400, detail="Нельзя удалить администратора")
-    db.delete(user)
-    db.commit()
+def delete_user(user_id: int):
+    with write_session() as db:
+        user = db.query(User).filter(User.id == user_id).first()
+        if not user:
+            raise HTTPException(status_code=404, detail="Пользователь не найден")
+        if user.is_admin:
+            raise HTTPException(status_code=400, detail="Нельзя удалить администратора")
+        db.delete(user)
+        db.commit()
+    forget_user(user_id)
     return {"message": "Пользователь удалён"}
 
 @app.post("/users/{user_id}/admin")
-async def toggle_admin_status(user_id: int, data: dict, request: Request, db: Session = Depends(get_db)):
-    user = db.query(User).filter(User.id == user_id).first()
-    if not user:
-        raise HTTPException(status_code=404, detail="Пользователь не найден")
+def toggle_admin_status(user_id: int, data: dict, request: Request):
     # Получаем текущего пользователя из токена
-    current_user = get_current_user(request, db)
-    if not current_user or not current_user.is_admin:
-        raise HTTPException(status_code=403, detail="Доступ запрещён")
-
-    # Нельзя лишить себя прав администратора
-    if user.id == current_user.id and data.get("is_admin") is False:
-        raise HTTPException(status_code=400, detail="Нельзя лишить себя прав администратора")
-    user.is_admin = data.get("is_admin", False)
-    db.commit()
+    current_user = get_current_user(request)
+    with write_session() as db:
+        user = db.query(User).filter(User.id == user_id).first()
+        if not user:
+            raise HTTPException(status_code=404, detail="Пользователь не найден")
+        if not current_user or not current_user.is_admin:
+            raise HTTPException(status_code=403, detail="Доступ запрещён")
+
+        # Нельзя лишить себя прав администратора
+        if user.id == current_user.id and data.get("is_admin") is False:
+            raise HTTPException(status_code=400, detail="Нельзя лишить себя прав администратора")
+        is_admin = int(bool(data.get("is_admin", False)))  # Колонка целочисленная, а PostgreSQL не приводит bool сам
+        if is_admin != (user.is_admin or 0):
+            # Права записаны в токене — выданные с прежними правами больше не годятся
+            revoke_tokens(user)
+        user.is_admin = is_admin
+        db.commit()
+    forget_user(user_id)
     return {"message": "Статус администратора обновлён"}
 
     # Добавляем количество каналов
@@ -567,18 +1152,19 @@ async def toggle_admin_status(user_id: int, data: dict, request: Request, db: Se
         }
     )
 @app.post("/playlists/{playlist_id}/share")
-async def toggle_shared_status(
+def toggle_shared_status(
         playlist_id: str,
         data: dict,
-        db: Session = Depends(get_db),
-        user: User = Depends(get_current_user)
+        user: SessionUser = Depends(get_current_user)
 ):
-    playlist = db.query(Playlist).filter(Playlist.id == playlist_id, Playlist.owner_id == user.id).first()
-    if not playlist:
-        raise HTTPException(status_code=404, detail="Плейлист не найден")
+    with write_session() as db:
+        playlist = db.query(Playlist).filter(Playlist.id == playlist_id, Playlist.owner_id == user.id).first()
+        if not playlist:
+            raise HTTPException(status_code=404, detail="Плейлист не найден")
 
-    playlist.is_shared = data.get("is_shared", False)
-    db.commit()
+        playlist.is_shared = data.get("is_shared", False)
+        db.commit()
+    playlist_cache.invalidate(playlist_id)
 
     return {"message": "Статус общего доступа обновлён"}
 
@@ -677,5 +1263,8 @@ if __name__ == "__main__":
         host=settings.APP_HOST,
         port=settings.APP_PORT,
         reload=settings.DEBUG,
+        workers=settings.APP_WORKERS,
+        # Заголовки прокси разбирает приложение по TRUSTED_PROXIES; сам uvicorn по умолчанию верит 127.0.0.1
+        proxy_headers=False,
         log_level="info"
     )
\ No newline at end of file
@@ -0,0 +1,208 @@
+"""
+Метрики приложения в текстовом формате Prometheus (/metrics).
+
+Счётчики и гистограммы живут в памяти процесса: при нескольких процессах
+(APP_WORKERS) каждый считает своё, и запрос к /metrics попадает в один из них.
+Что считается:
+- запросы и их длительность по шаблону маршрута (MetricsMiddleware);
+- длительность SQL-запросов по виду (SELECT, INSERT...) через события SQLAlchemy;
+- разбор загрузок и генерация текста плейлистов: длительность и число каналов;
+- байты, отданные по каждому плейлисту;
+- кэши и ограничения запросов — их собственные счётчики, читаются при выдаче (sampled).
+
+METRICS_ENABLED=False выключает сбор; /metrics тогда отдаёт только sampled.
+"""
+import threading
+import time
+from bisect import bisect_left
+from typing import Callable, Iterable
+
+from sqlalchemy import event
+from sqlalchemy.engine import Engine
+
+from config import settings
+
+LATENCY_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10, 30, 60)
+DB_BUCKETS = (0.0005, 0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 5)
+CHANNEL_BUCKETS = (10, 100, 1000, 10000, 100000, 1000000)
+SQL_OPERATIONS = {"SELECT", "INSERT", "UPDATE", "DELETE", "WITH", "BEGIN", "PRAGMA"}
+
+_registry = []
+
+
+def _escape(value) -> str:
+    return str(value).replace("\\", "\\\\").replace('"', '\\"').replace("\n", "\\n")
+
+
+def _labels(names: tuple, values: tuple, extra: str = "") -> str:
+    pairs = [f'{name}="{_escape(value)}"' for name, value in zip(names, values)]
+    if extra:
+        pairs.append(extra)
+    return "{" + ",".join(pairs) + "}" if pairs else ""
+
+
+def _number(value) -> str:
+    if value == float("inf"):
+        return "+Inf"
+    return str(int(value)) if float(value).is_integer() else repr(float(value))
+
+
+class Counter:
+    type = "counter"
+
+    def __init__(self, name: str, help: str, labels: tuple = ()):
+        self.name = name
+        self.help = help
+        self.labels = labels
+        self._values = {}
+        self._lock = threading.Lock()
+        _registry.append(self)
+
+    def inc(self, *label_values, amount: float = 1):
+        with self._lock:
+            self._values[label_values] = self._values.get(label_values, 0) + amount
+
+    def lines(self) -> Iterable[str]:
+        with self._lock:
+            values = list(self._values.items())
+        for label_values, value in values:
+            yield f"{self.name}{_labels(self.labels, label_values)} {_number(value)}"
+
+
+class Histogram:
+    type = "histogram"
+
+    def __init__(self, name: str, help: str, labels: tuple = (), buckets: tuple = LATENCY_BUCKETS):
+        self.name = name
+        self.help = help
+        self.labels = labels
+        self.buckets = buckets
+        self._values = {}  # значения меток -> [число попаданий по корзинам (+Inf последней), сумма]
+        self._lock = threading.Lock()
+        _registry.append(self)
+
+    def observe(self, value: float, *label_values):
+        with self._lock:
+            state = self._values.get(label_values)
+            if state is None:
+                state = self._values[label_values] = [[0] * (len(self.buckets) + 1), 0.0]
+            state[0][bisect_left(self.buckets, value)] += 1
+            state[1] += value
+
+    def lines(self) -> Iterable[str]:
+        with self._lock:
+            values = [(label_values, list(counts), total) for label_values, (counts, total) in self._values.items()]
+        for label_values, counts, total in values:
+            cumulative = 0
+            for bound, count in zip((*self.buckets, float("inf")), counts):
+                cumulative += count
+                le = f'le="{_number(bound)}"'
+                yield f"{self.name}_bucket{_labels(self.labels, label_values, le)} {cumulative}"
+            yield f"{self.name}_sum{_labels(self.labels, label_values)} {_number(total)}"
+            yield f"{self.name}_count{_labels(self.labels, label_values)} {cumulative}"
+
+
+class Sampled:
+    """Значения, которые считает кто-то другой (кэш, ограничения): read() -> число или {значения меток: число}"""
+
+    def __init__(self, name: str, help: str, type: str, read: Callable, labels: tuple = ()):
+        self.name = name
+        self.help = help
+        self.type = type
+        self.read = read
+        self.labels = labels
+        _registry.append(self)
+
+    def lines(self) -> Iterable[str]:
+        values = self.read()
+        if not isinstance(values, dict):
+            values = {(): values}
+        for label_values, value in values.items():
+            yield f"{self.name}{_labels(self.labels, label_values)} {_number(value)}"
+
+
+def sampled(name: str, help: str, type: str, read: Callable, labels: tuple = ()) -> Sampled:
+    return Sampled(name, help, type, read, labels)
+
+
+def render() -> str:
+    out = []
+    for metric in _registry:
+        out.append(f"# HELP {metric.name} {metric.help}")
+        out.append(f"# TYPE {metric.name} {metric.type}")
+        out.extend(metric.lines())
+    return "\n".join(out) + "\n"
+
+
+http_requests = Counter("http_requests_total", "Запросы по маршруту, методу и коду ответа", ("route", "method", "status"))
+http_duration = Histogram("http_request_duration_seconds", "Время ответа по маршруту", ("route", "method"))
+playlist_bytes = Counter("playlist_bytes_served_total", "Байты тела, отданные по плейлисту", ("playlist",))
+db_duration = Histogram("db_query_duration_seconds", "Время SQL-запросов по виду", ("operation",), DB_BUCKETS)
+parse_duration = Histogram("parse_job_duration_seconds", "Время разбора загруженного плейлиста", ("status",))
+parse_channels = Histogram("parse_job_channels", "Каналов в разобранном плейлисте", buckets=CHANNEL_BUCKETS)
+render_duration = Histogram("playlist_render_duration_seconds", "Время генерации текста плейлиста")
+render_channels = Histogram("playlist_render_channels", "Каналов в сгенерированном плейлисте", buckets=CHANNEL_BUCKETS)
+compress_duration = Histogram(
+    "playlist_compress_duration_seconds", "Время сжатия текста плейлиста", ("encoding",)
+)
+
+
+class MetricsMiddleware:
+    """ASGI-обёртка: считает запросы, их время и байты тела ответа"""
+
+    PLAYLIST_ROUTE = "/{playlist_id}.m3u"
+
+    def __init__(self, app):
+        self.app = app
+
+    async def __call__(self, scope, receive, send):
+        if scope["type"] != "http" or not settings.METRICS_ENABLED:
+            await self.app(scope, receive, send)
+            return
+        started = time.perf_counter()
+        status = 500
+        sent = 0
+
+        async def counting_send(message):
+            nonlocal status, sent
+            if message["type"] == "http.response.start":
+                status = message["status"]
+            elif message["type"] == "http.response.body":
+                sent += len(message.get("body", b""))
+            await send(message)
+
+        try:
+            await self.app(scope, receive, counting_send)
+        finally:
+            # Шаблон маршрута, а не путь: иначе у каждого плейлиста был бы свой ряд
+            route = getattr(scope.get("route"), "path", None)
+            if route is None:
+                route = "/static" if scope["path"].startswith("/static/") else "unmatched"
+            http_requests.inc(route, scope["method"], status)
+            http_duration.observe(time.perf_counter() - started, route, scope["method"])
+            if route == self.PLAYLIST_ROUTE and status in (200, 206):
+                playlist_bytes.inc(scope["path_params"]["playlist_id"], amount=sent)
+
+
+def _sql_operation(statement: str) -> str:
+    words = statement.lstrip()[:10].split(None, 1)
+    operation = words[0].upper() if words else ""
+    return operation if operation in SQL_OPERATIONS else "OTHER"
+
+
+def _before_cursor_execute(conn, cursor, statement, parameters, context, executemany):
+    if settings.METRICS_ENABLED and context is not None:
+        context._metrics_started = time.perf_counter()
+
+
+def _after_cursor_execute(conn, cursor, statement, parameters, context, executemany):
+    started = getattr(context, "_metrics_started", None)
+    if started is not None:
+        db_duration.observe(time.perf_counter() - started, _sql_operation(statement))
+
+
+def instrument_db():
+    """Время SQL-запросов всех движков, включая реплики"""
+    if not event.contains(Engine, "before_cursor_execute", _before_cursor_execute):
+        event.listen(Engine, "before_cursor_execute", _before_cursor_execute)
+        event.listen(Engine, "after_cursor_execute", _after_cursor_execute)
@@ -0,0 +1,383 @@
+"""
+Версионированные миграции схемы базы.
+
+Каждая миграция — функция upgrade(conn) с номером; номера применённых
+миграций хранятся в таблице schema_version. Миграции описывают таблицы
+такими, какими они были на момент миграции, а не через текущие модели:
+иначе свежая база получила бы колонку раньше миграции, которая её добавляет.
+
+Применяются при старте приложения (AUTO_MIGRATE) или отдельно, до запуска
+процессов приложения:
+    python -m migrations
+"""
+from contextlib import contextmanager
+from datetime import datetime
+
+from sqlalchemy import (
+    Boolean, Column, DateTime, ForeignKey, Index, Integer, LargeBinary, MetaData, String, Table, Text,
+    func, inspect, select, text
+)
+from sqlalchemy.orm import Session
+
+from database import write_engine
+from logging_conf import get_logger
+
+logger = get_logger(__name__)
+
+# Произвольный ключ pg_advisory_xact_lock: миграции разных процессов идут по очереди
+_PG_LOCK_KEY = 5170001
+
+_version_metadata = MetaData()
+schema_version = Table(
+    "schema_version", _version_metadata,
+    Column("version", Integer, primary_key=True, autoincrement=False),
+    Column("description", String, nullable=False),
+    Column("applied_at", DateTime, nullable=False),
+)
+
+
+def add_missing_columns(conn, metadata: MetaData):
+    """
+    create_all не трогает уже существующие таблицы, поэтому колонки и индексы,
+    которых нет в базе, созданной до миграций, добавляем вручную
+    """
+    inspector = inspect(conn)
+    for table in metadata.sorted_tables:
+        existing = {column["name"] for column in inspector.get_columns(table.name)}
+        for column in table.columns:
+            if column.name not in existing:
+                ddl = f"{column.name} {column.type.compile(dialect=conn.dialect)}"
+                if column.server_default is not None:
+                    ddl += f" DEFAULT {column.server_default.arg}"
+                conn.execute(text(f"ALTER TABLE {table.name} ADD COLUMN {ddl}"))
+        for index in table.indexes:
+            index.create(bind=conn, checkfirst=True)
+
+
+def initial_schema(conn):
+    """
+    Схема на момент появления миграций. Базы, созданные раньше через
+    create_all, доводятся до неё добавлением недостающих колонок.
+    """
+    metadata = MetaData()
+    Table(
+        "users", metadata,
+        Column("id", Integer, primary_key=True, index=True),
+        Column("username", String, unique=True, index=True),
+        Column("password", String),
+        Column("email", String, nullable=True),
+        Column("is_admin", Integer, server_default="0"),
+        Column("created_at", DateTime),
+    )
+    Table(
+        "playlists", metadata,
+        Column("id", String, primary_key=True, index=True),
+        Column("name", String, index=True),
+        Column("filename", String),
+        Column("content", Text),
+        Column("owner_id", Integer, ForeignKey("users.id"), index=True),
+        Column("created_at", DateTime),
+        Column("is_shared", Boolean, index=True),
+        Column("tvg_url", String, nullable=True),
+        Column("channel_count", Integer, nullable=True),
+        Column("group_count", Integer, nullable=True),
+        Column("content_size", Integer, nullable=True),
+        Column("content_hash", String(64), nullable=True),
+        Column("content_gz", LargeBinary, nullable=True),
+        Column("content_br", LargeBinary, nullable=True),
+        Column("updated_at", DateTime, nullable=True),
+        Column("version", Integer, nullable=False, server_default="0"),
+    )
+    Table(
+        "channels", metadata,
+        Column("id", Integer, primary_key=True),
+        Column("playlist_id", String, ForeignKey("playlists.id", ondelete="CASCADE"), nullable=False),
+        Column("position", Integer, nullable=False),
+        Column("name", String, nullable=False),
+        Column("tvg_id", String, nullable=True),
+        Column("tvg_name", String, nullable=True),
+        Column("tvg_logo", String, nullable=True),
+        Column("group_title", String, nullable=True),
+        Column("url", String, nullable=False),
+        Column("attrs", Text, nullable=True),
+        Index("ix_channels_playlist_position", "playlist_id", "position"),
+        Index("ix_channels_playlist_group", "playlist_id", "group_title"),
+        Index("ix_channels_name", "name"),
+    )
+    metadata.create_all(bind=conn)
+    add_missing_columns(conn, metadata)
+
+
+def parse_jobs(conn):
+    """Задачи фонового разбора переезжают из памяти процесса в базу"""
+    metadata = MetaData()
+    Table(
+        "parse_jobs", metadata,
+        Column("id", String(32), primary_key=True),
+        Column("owner_id", Integer, nullable=True, index=True),
+        Column("status", String(16), nullable=False),
+        Column("shards", Integer, nullable=False),
+        Column("shards_done", Integer, nullable=False),
+        Column("channel_count", Integer, nullable=False),
+        Column("tvg_url", String, nullable=True),
+        Column("error", String, nullable=True),
+        Column("result", Text, nullable=True),
+        Column("updated_at", DateTime, nullable=False, index=True),
+    )
+    metadata.create_all(bind=conn)
+
+
+def playlist_blobs(conn):
+    """
+    Тексты плейлистов переезжают в playlist_blobs, по одному на хэш. Плейлисты
+    без хэша (сохранённые до сжатых версий) сохраняют текст в playlists.content,
+    он переносится при первой отдаче.
+    """
+    metadata = MetaData()
+    playlists = Table(
+        "playlists", metadata,
+        Column("id", String, primary_key=True),
+        Column("content", Text),
+        Column("content_hash", String(64)),
+        Column("content_gz", LargeBinary),
+        Column("content_br", LargeBinary),
+    )
+    blobs = Table(
+        "playlist_blobs", metadata,
+        Column("hash", String(64), primary_key=True),
+        Column("content", Text, nullable=False),
+        Column("content_gz", LargeBinary, nullable=False),
+        Column("content_br", LargeBinary, nullable=True),
+        Column("size", Integer, nullable=False),
+        Column("ref_count", Integer, nullable=False),
+        Column("created_at", DateTime),
+    )
+    blobs.create(bind=conn)
+
+    moved = playlists.c.content_hash.isnot(None) & playlists.c.content.isnot(None)
+    counts = conn.execute(
+        select(playlists.c.content_hash, func.count()).where(moved).group_by(playlists.c.content_hash)
+    ).all()
+    for content_hash, ref_count in counts:
+        row = conn.execute(
+            select(playlists.c.content, playlists.c.content_gz, playlists.c.content_br)
+            .where(playlists.c.content_hash == content_hash).limit(1)
+        ).one()
+        conn.execute(blobs.insert().values(
+            hash=content_hash, content=row.content, content_gz=row.content_gz, content_br=row.content_br,
+            size=len(row.content.encode("utf-8")), ref_count=ref_count, created_at=datetime.utcnow()
+        ))
+    conn.execute(playlists.update().where(moved).values(content=None))
+    for column in ("content_gz", "content_br"):
+        conn.execute(text(f"ALTER TABLE playlists DROP COLUMN {column}"))
+
+
+def nullable_blob_content(conn):
+    """Текст блоба может лежать в файле (PLAYLIST_STORAGE=files), а не в базе"""
+    if conn.dialect.name == "postgresql":
+        for column in ("content", "content_gz"):
+            conn.execute(text(f"ALTER TABLE playlist_blobs ALTER COLUMN {column} DROP NOT NULL"))
+        return
+    # SQLite не умеет снимать NOT NULL с колонки — пересоздаём таблицу
+    conn.execute(text("ALTER TABLE playlist_blobs RENAME TO playlist_blobs_old"))
+    metadata = MetaData()
+    Table(
+        "playlist_blobs", metadata,
+        Column("hash", String(64), primary_key=True),
+        Column("content", Text, nullable=True),
+        Column("content_gz", LargeBinary, nullable=True),
+        Column("content_br", LargeBinary, nullable=True),
+        Column("size", Integer, nullable=False),
+        Column("ref_count", Integer, nullable=False),
+        Column("created_at", DateTime),
+    ).create(bind=conn)
+    conn.execute(text(
+        "INSERT INTO playlist_blobs (hash, content, content_gz, content_br, size, ref_count, created_at) "
+        "SELECT hash, content, content_gz, content_br, size, ref_count, created_at FROM playlist_blobs_old"
+    ))
+    conn.execute(text("DROP TABLE playlist_blobs_old"))
+
+
+def channel_search(conn):
+    """
+    Полнотекстовый индекс каналов по имени, tvg-id и группе. В SQLite —
+    таблица FTS5 над channels, которую ведут триггеры; в PostgreSQL —
+    GIN-индекс по выражению, то же выражение стоит в запросах search.py
+    """
+    if conn.dialect.name == "postgresql":
+        conn.execute(text(
+            "CREATE INDEX ix_channels_search ON channels USING gin (to_tsvector('simple', translate("
+            "coalesce(name, '') || ' ' || coalesce(tvg_id, '') || ' ' || coalesce(group_title, ''), "
+            "'.-_/|:@()[]', '           ')))"
+        ))
+        return
+    conn.execute(text(
+        "CREATE VIRTUAL TABLE channels_fts USING fts5(name, tvg_id, group_title, "
+        "content='channels', content_rowid='id', tokenize='unicode61 remove_diacritics 2')"
+    ))
+    conn.execute(text(
+        "CREATE TRIGGER channels_fts_insert AFTER INSERT ON channels BEGIN "
+        "INSERT INTO channels_fts (rowid, name, tvg_id, group_title) "
+        "VALUES (new.id, new.name, new.tvg_id, new.group_title); END"
+    ))
+    conn.execute(text(
+        "CREATE TRIGGER channels_fts_delete AFTER DELETE ON channels BEGIN "
+        "INSERT INTO channels_fts (channels_fts, rowid, name, tvg_id, group_title) "
+        "VALUES ('delete', old.id, old.name, old.tvg_id, old.group_title); END"
+    ))
+    conn.execute(text(
+        "CREATE TRIGGER channels_fts_update AFTER UPDATE OF name, tvg_id, group_title ON channels BEGIN "
+        "INSERT INTO channels_fts (channels_fts, rowid, name, tvg_id, group_title) "
+        "VALUES ('delete', old.id, old.name, old.tvg_id, old.group_title); "
+        "INSERT INTO channels_fts (rowid, name, tvg_id, group_title) "
+        "VALUES (new.id, new.name, new.tvg_id, new.group_title); END"
+    ))
+    conn.execute(text("INSERT INTO channels_fts (channels_fts) VALUES ('rebuild')"))
+
+
+def stream_health(conn):
+    """Состояние проверок потоков и результаты по каналам"""
+    metadata = MetaData()
+    Table(
+        "health_checks", metadata,
+        Column("playlist_id", String, primary_key=True),
+        Column("status", String(16), nullable=False),
+        Column("total", Integer, nullable=False),
+        Column("checked", Integer, nullable=False),
+        Column("error", String, nullable=True),
+        Column("started_at", DateTime, nullable=False),
+        Column("updated_at", DateTime, nullable=False),
+    )
+    Table(
+        "channel_health", metadata,
+        Column("channel_id", Integer, primary_key=True, autoincrement=False),
+        Column("playlist_id", String, nullable=False, index=True),
+        Column("url", String, nullable=False),
+        Column("status", String(16), nullable=False),
+        Column("http_status", Integer, nullable=True),
+        Column("latency_ms", Integer, nullable=True),
+        Column("error", String, nullable=True),
+        Column("checked_at", DateTime, nullable=False),
+    )
+    metadata.create_all(bind=conn)
+
+
+def playlist_subscriptions(conn):
+    """Подписки плейлистов на источники и соответствие их каналов"""
+    metadata = MetaData()
+    Table(
+        "subscriptions", metadata,
+        Column("playlist_id", String, primary_key=True),
+        Column("url", String, nullable=False),
+        Column("interval", Integer, nullable=False),
+        Column("etag", String, nullable=True),
+        Column("last_modified", String, nullable=True),
+        Column("content_hash", String(64), nullable=True),
+        Column("tvg_url", String, nullable=True),
+        Column("next_refresh_at", DateTime, nullable=False, index=True),
+        Column("checked_at", DateTime, nullable=True),
+        Column("changed_at", DateTime, nullable=True),
+        Column("status", String(16), nullable=True),
+        Column("error", String, nullable=True),
+    )
+    Table(
+        "subscription_channels", metadata,
+        Column("playlist_id", String, primary_key=True),
+        Column("key", String, primary_key=True),
+        Column("channel_id", Integer, nullable=True),
+        Column("base", Text, nullable=False),
+    )
+    metadata.create_all(bind=conn)
+
+
+def user_token_version(conn):
+    """Версия токенов пользователя: её смена отзывает выданные токены"""
+    conn.execute(text("ALTER TABLE users ADD COLUMN token_version INTEGER NOT NULL DEFAULT 0"))
+
+
+def ephemeral_state(conn):
+    """Краткоживущее состояние, общее для процессов: ответы на капчу"""
+    metadata = MetaData()
+    Table(
+        "ephemeral_state", metadata,
+        Column("namespace", String(32), primary_key=True),
+        Column("key", String(64), primary_key=True),
+        Column("value", Text, nullable=False),
+        Column("expires_at", DateTime, nullable=False, index=True),
+    )
+    metadata.create_all(bind=conn)
+
+
+def parse_job_shards(conn):
+    """Результат задачи разбора хранится по кускам, а не одним значением в parse_jobs.result"""
+    metadata = MetaData()
+    Table(
+        "parse_job_shards", metadata,
+        Column("job_id", String(32), primary_key=True),
+        Column("shard", Integer, primary_key=True, autoincrement=False),
+        Column("result", Text, nullable=False),
+    )
+    metadata.create_all(bind=conn)
+
+
+# Номер, описание, функция. Новые миграции только дописываются в конец
+MIGRATIONS = [
+    (1, "Начальная схема", initial_schema),
+    (2, "Таблица задач разбора", parse_jobs),
+    (3, "Общие тексты плейлистов", playlist_blobs),
+    (4, "Тексты плейлистов в файлах", nullable_blob_content),
+    (5, "Поиск каналов", channel_search),
+    (6, "Проверка потоков", stream_health),
+    (7, "Подписки на источники", playlist_subscriptions),
+    (8, "Версия токенов пользователя", user_token_version),
+    (9, "Краткоживущее состояние", ephemeral_state),
+    (10, "Результаты разбора по кускам", parse_job_shards),
+]
+
+
+def _lock(conn):
+    """SQLite уже заблокирован на запись (BEGIN IMMEDIATE), PostgreSQL — блокируем явно"""
+    if conn.dialect.name == "postgresql":
+        conn.execute(text("SELECT pg_advisory_xact_lock(:key)"), {"key": _PG_LOCK_KEY})
+
+
+def current_version(conn) -> int:
+    if not inspect(conn).has_table(schema_version.name):
+        return 0
+    return conn.execute(select(func.max(schema_version.c.version))).scalar() or 0
+
+
+def migrate() -> int:
+    """Применяет недостающие миграции, каждую в своей транзакции; возвращает версию схемы"""
+    version = 0
+    for number, description, upgrade in MIGRATIONS:
+        with write_engine.begin() as conn:
+            _lock(conn)
+            schema_version.create(bind=conn, checkfirst=True)
+            version = current_version(conn)
+            if number <= version:
+                continue
+            upgrade(conn)
+            conn.execute(schema_version.insert().values(
+                version=number, description=description, applied_at=datetime.utcnow()
+            ))
+            version = number
+            logger.info(f"Применена миграция {number}: {description}")
+    return version
+
+
+@contextmanager
+def locked_session():
+    """
+    Сессия в одной транзакции под той же блокировкой, что и миграции: разовые
+    переносы данных при старте не выполняются двумя процессами одновременно.
+    commit() внутри лишь сбрасывает изменения, фиксируются они на выходе.
+    """
+    with write_engine.begin() as conn:
+        _lock(conn)
+        with Session(bind=conn) as db:
+            yield db
+
+
+if __name__ == "__main__":
+    print(f"Версия схемы: {migrate()}")
@@ -1,5 +1,5 @@
 from pydantic import BaseModel
-from typing import Optional
+from typing import Any, Dict, List, Literal, Optional
 
 
 class Channel(BaseModel):
@@ -9,4 +9,27 @@ class Channel(BaseModel):
     tvg_logo: Optional[str] = None
     group_title: Optional[str] = None
     url: str
-    tvg_url: Optional[str] = None
\ No newline at end of file
+    tvg_url: Optional[str] = None
+    attrs: Dict[str, str] = {}  # Прочие атрибуты #EXTINF (tvg-chno, catchup и т.д.)
+
+
+class PlaylistOperation(BaseModel):
+    """
+    Одна операция PATCH /playlists/{id}. Канал адресуется id из базы или ref —
+    временным ключом канала, вставленного раньше в том же запросе.
+    """
+    op: Literal["insert", "delete", "move", "update", "rename_group", "set"]
+    id: Optional[int] = None
+    ref: Optional[str] = None
+    ids: List[int] = []  # delete: id каналов
+    refs: List[str] = []  # delete: ref каналов
+    index: Optional[int] = None  # insert/move: позиция в плейлисте, с 0; None — в конец
+    channels: List[Dict[str, Any]] = []  # insert: каналы, каждый может нести свой ref
+    fields: Dict[str, Any] = {}  # update: поля канала; set: name и/или tvg_url плейлиста
+    group_from: Optional[str] = None  # rename_group
+    group_to: Optional[str] = None
+
+
+class PlaylistPatch(BaseModel):
+    base_version: Optional[int] = None  # Версия, от которой считал правки клиент
+    ops: List[PlaylistOperation]
@@ -0,0 +1,308 @@
+"""
+Профилирование запросов по требованию администратора.
+
+Администратор включает запись для шаблона маршрута (как в метках /metrics:
+"/shared", "/playlists/{playlist_id}") — следующие count запросов к нему
+выполняются под профилировщиком:
+- cprofile — cProfile, точный счёт вызовов; результат в формате pstats
+  (python -m pstats, snakeviz);
+- sample — стек обработчика снимается раз в SAMPLE_INTERVAL из отдельного
+  потока, сам запрос почти не замедляется; результат — свёрнутые стеки
+  (collapsed), их читают flamegraph.pl, speedscope и inferno.
+cProfile в процессе одновременно пишет только одна запись: запросы, пришедшие
+в это время, записываются выборкой (mode результата — sample).
+Вместе с профилем записываются SQL-запросы запроса и время каждого.
+
+Профилируется тело обработчика — для обычных def в том потоке пула, где оно
+выполняется. Зависимости (get_db и т.п.) в профиль не попадают, их SQL — попадает.
+Пока ничего не включено, маршрут проверяет только, пуст ли словарь _armed.
+
+Включённые записи и результаты хранятся в памяти процесса: при нескольких
+процессах (APP_WORKERS) запись включается в том, куда попал запрос администратора.
+"""
+import asyncio
+import cProfile
+import functools
+import marshal
+import os
+import sys
+import threading
+import time
+import uuid
+from collections import Counter, OrderedDict
+from contextlib import contextmanager
+from contextvars import ContextVar
+from dataclasses import dataclass, field
+from datetime import datetime
+from typing import Optional
+
+from fastapi import HTTPException
+from fastapi.routing import APIRoute
+from sqlalchemy import event
+from sqlalchemy.engine import Engine
+
+MODES = ("cprofile", "sample")
+MAX_COUNT = 100  # Запросов на одно включение
+MAX_CAPTURES = 50  # Хранимых результатов; старые вытесняются
+MAX_STATEMENTS = 1000  # SQL-запросов на один результат
+MAX_STATEMENT_LENGTH = 2000
+SAMPLE_INTERVAL = 0.005
+
+_lock = threading.Lock()
+_armed = {}  # шаблон маршрута -> Trigger
+_captures = OrderedDict()  # id -> Capture
+_current = ContextVar("profiling_capture", default=None)
+# cProfile одновременно — только один на процесс: второй в том же потоке заменил бы первый,
+# а с Python 3.12 и в другом потоке enable() падает ("Another profiling tool is already active")
+_cprofile_lock = threading.Lock()
+
+
+@dataclass
+class Trigger:
+    route: str
+    mode: str
+    remaining: int
+    method: Optional[str] = None
+
+    def summary(self) -> dict:
+        return {"route": self.route, "mode": self.mode, "remaining": self.remaining, "method": self.method}
+
+
+@dataclass
+class Capture:
+    route: str
+    method: str
+    path: str
+    mode: str
+    id: str = field(default_factory=lambda: uuid.uuid4().hex[:12])
+    started_at: datetime = field(default_factory=datetime.utcnow)
+    duration: float = 0.0
+    status: Optional[int] = None
+    statements: list = field(default_factory=list)  # [(текст, секунды)]
+    dropped_statements: int = 0
+    profile: Optional[bytes] = None
+
+    def add_statement(self, statement: str, elapsed: float):
+        if len(self.statements) >= MAX_STATEMENTS:
+            self.dropped_statements += 1
+            return
+        self.statements.append((statement[:MAX_STATEMENT_LENGTH], elapsed))
+
+    @property
+    def filename(self) -> str:
+        return f"{self.id}.pstats" if self.mode == "cprofile" else f"{self.id}.collapsed"
+
+    def summary(self) -> dict:
+        return {
+            "id": self.id,
+            "route": self.route,
+            "method": self.method,
+            "path": self.path,
+            "mode": self.mode,
+            "started_at": self.started_at.isoformat(),
+            "duration_ms": round(self.duration * 1000, 2),
+            "status": self.status,
+            "sql_count": len(self.statements) + self.dropped_statements,
+            "sql_ms": round(sum(elapsed for _, elapsed in self.statements) * 1000, 2),
+            "profile_bytes": len(self.profile) if self.profile is not None else 0,
+        }
+
+    def sql(self) -> dict:
+        return {
+            "id": self.id,
+            "statements": [
+                {"statement": statement, "ms": round(elapsed * 1000, 3)} for statement, elapsed in self.statements
+            ],
+            "dropped": self.dropped_statements,
+        }
+
+
+def arm(route: str, mode: str, count: int, method: Optional[str], routes: set) -> dict:
+    """Профилировать следующие count запросов к шаблону маршрута route; ValueError — неверные параметры"""
+    if route not in routes:
+        raise ValueError(f"Нет маршрута {route}")
+    if mode not in MODES:
+        raise ValueError(f"Режим — один из: {', '.join(MODES)}")
+    if isinstance(count, bool) or not isinstance(count, int) or not 1 <= count <= MAX_COUNT:
+        raise ValueError(f"Число запросов — от 1 до {MAX_COUNT}")
+    trigger = Trigger(route, mode, count, method.upper() if method else None)
+    with _lock:
+        _armed[route] = trigger
+    return trigger.summary()
+
+
+def disarm():
+    with _lock:
+        _armed.clear()
+
+
+def status() -> dict:
+    with _lock:
+        return {
+            "armed": [trigger.summary() for trigger in _armed.values()],
+            "captures": [capture.summary() for capture in reversed(_captures.values())],
+        }
+
+
+def get_capture(capture_id: str) -> Optional[Capture]:
+    with _lock:
+        return _captures.get(capture_id)
+
+
+def _take(route: str, method: str) -> Optional[str]:
+    """Режим, если этот запрос нужно профилировать; расходует одно из включённых"""
+    with _lock:
+        trigger = _armed.get(route)
+        if trigger is None or trigger.method not in (None, method):
+            return None
+        trigger.remaining -= 1
+        if trigger.remaining <= 0:
+            del _armed[route]
+        return trigger.mode
+
+
+def _store(capture: Capture):
+    with _lock:
+        _captures[capture.id] = capture
+        while len(_captures) > MAX_CAPTURES:
+            _captures.popitem(last=False)
+
+
+class _Sampler(threading.Thread):
+    """Снимает стек потока thread_id, пока не вызван stop; стеки в свёрнутом виде"""
+
+    def __init__(self, thread_id: int):
+        super().__init__(name="profiling-sampler", daemon=True)
+        self.thread_id = thread_id
+        self.stacks = Counter()
+        self._done = threading.Event()
+
+    def run(self):
+        while not self._done.wait(SAMPLE_INTERVAL):
+            frame = sys._current_frames().get(self.thread_id)
+            stack = []
+            while frame is not None:
+                code = frame.f_code
+                stack.append(f"{code.co_name} ({os.path.basename(code.co_filename)}:{code.co_firstlineno})")
+                frame = frame.f_back
+            if stack:
+                self.stacks[";".join(reversed(stack))] += 1
+
+    def stop(self) -> bytes:
+        self._done.set()
+        self.join()
+        return "".join(f"{stack} {count}\n" for stack, count in self.stacks.most_common()).encode("utf-8")
+
+
+def _start_cprofile() -> Optional[cProfile.Profile]:
+    """Включённый cProfile; None — он уже занят другой записью или чужим профилировщиком"""
+    if not _cprofile_lock.acquire(blocking=False):
+        return None
+    profile = cProfile.Profile()
+    try:
+        profile.enable()
+    except ValueError:
+        _cprofile_lock.release()
+        return None
+    return profile
+
+
+@contextmanager
+def _profiler(capture: Capture):
+    profile = _start_cprofile() if capture.mode == "cprofile" else None
+    if profile is not None:
+        try:
+            yield
+        finally:
+            profile.disable()
+            _cprofile_lock.release()
+            profile.create_stats()
+            capture.profile = marshal.dumps(profile.stats)  # Тот же формат, что у dump_stats
+    else:
+        # cProfile уже пишет другой запрос (или асинхронный обработчик в том же потоке event loop) — снимаем выборку
+        capture.mode = "sample"
+        sampler = _Sampler(threading.get_ident())
+        sampler.start()
+        try:
+            yield
+        finally:
+            capture.profile = sampler.stop()
+
+
+def _profiled(endpoint):
+    """Обёртка обработчика: под профилировщиком, если запрос выбран для записи"""
+    if asyncio.iscoroutinefunction(endpoint):
+        @functools.wraps(endpoint)
+        async def wrapper(*args, **kwargs):
+            capture = _current.get()
+            if capture is None:
+                return await endpoint(*args, **kwargs)
+            # У асинхронного обработчика в профиль попадут и запросы, выполнявшиеся в event loop одновременно с ним
+            with _profiler(capture):
+                return await endpoint(*args, **kwargs)
+    else:
+        @functools.wraps(endpoint)
+        def wrapper(*args, **kwargs):
+            capture = _current.get()
+            if capture is None:
+                return endpoint(*args, **kwargs)
+            with _profiler(capture):
+                return endpoint(*args, **kwargs)
+    return wrapper
+
+
+class ProfiledRoute(APIRoute):
+    """Маршрут, запросы к которому можно профилировать (app.router.route_class)"""
+
+    def __init__(self, path: str, endpoint, **kwargs):
+        super().__init__(path, _profiled(endpoint), **kwargs)
+
+    def get_route_handler(self):
+        handler = super().get_route_handler()
+
+        async def profiled_handler(request):
+            if not _armed:
+                return await handler(request)
+            mode = _take(self.path, request.method)
+            if mode is None:
+                return await handler(request)
+            capture = Capture(self.path, request.method, request.url.path, mode)
+            # Контекст копируется в потоки пула: его видят обработчик, зависимости и события SQL
+            token = _current.set(capture)
+            started = time.perf_counter()
+            try:
+                response = await handler(request)
+                capture.status = response.status_code
+                return response
+            except HTTPException as e:
+                capture.status = e.status_code
+                raise
+            except Exception:
+                capture.status = 500
+                raise
+            finally:
+                capture.duration = time.perf_counter() - started
+                _current.reset(token)
+                _store(capture)
+
+        return profiled_handler
+
+
+def _before_cursor_execute(conn, cursor, statement, parameters, context, executemany):
+    capture = _current.get()
+    if capture is not None and context is not None:
+        context._profiling = (capture, time.perf_counter())
+
+
+def _after_cursor_execute(conn, cursor, statement, parameters, context, executemany):
+    profiling = getattr(context, "_profiling", None)
+    if profiling is not None:
+        capture, started = profiling
+        capture.add_statement(statement, time.perf_counter() - started)
+
+
+def instrument_db():
+    """Запись SQL профилируемых запросов на всех движках; параметры запросов не сохраняются"""
+    if not event.contains(Engine, "before_cursor_execute", _before_cursor_execute):
+        event.listen(Engine, "before_cursor_execute", _before_cursor_execute)
+        event.listen(Engine, "after_cursor_execute", _after_cursor_execute)
@@ -0,0 +1,140 @@
+"""
+Ограничение запросов и допуск к дорогим обработчикам.
+
+TokenBucket — ведро на ключ (IP, плейлист, имя пользователя): в нём до
+burst жетонов, за минуту добавляется per_minute; запрос забирает жетон, а
+при пустом ведре получает отказ и время, через которое жетон появится.
+Вёдра лежат в хранилище ephemeral.py: вход и регистрация считаются в
+RATE_LIMIT_STORE (database — общий счёт для всех процессов и узлов),
+отдача плейлиста — всегда в памяти процесса: попадание в кэш обслуживается
+без базы, и запись в базу на каждый запрос стоила бы дороже самой отдачи.
+
+ConcurrencyCap — не больше limit одновременных дорогих операций в процессе;
+лишние сразу получают отказ, а не ждут очереди.
+
+Предел RATE_LIMIT_MAX_KEYS у хранилищ считается на каждое ограничение
+отдельно (namespace = имя ограничения): перебор адресов на отдаче
+плейлистов не вытесняет счёт попыток входа.
+
+Адрес клиента — request.client.host. За обратным прокси это адрес прокси;
+настоящий адрес из X-Forwarded-For подставляет ProxyHeadersMiddleware
+(main.py), и только для запросов с адресов TRUSTED_PROXIES — иначе клиент
+мог бы сам выбрать, на чьё ведро тратить жетоны.
+
+Отказы считаются по ограничениям (stats). Если хранилище недоступно,
+запрос пропускается: ограничение не должно ронять вход.
+RATE_LIMIT_ENABLED=False выключает все ограничения.
+"""
+import hashlib
+import threading
+import time
+from functools import partial
+
+from config import settings
+from ephemeral import MemoryStore, create_store
+from logging_conf import get_logger
+
+logger = get_logger(__name__)
+
+# Ключ ephemeral_state не длиннее 64 символов: длинные ключи заменяем хэшем
+_MAX_KEY = 64
+
+
+class TokenBucket:
+    def __init__(self, name: str, per_minute: float, burst: int, store):
+        self.name = name
+        self.rate = per_minute / 60  # Жетонов в секунду
+        self.burst = burst
+        self.store = store
+        # Через столько секунд пустое ведро снова полное — запись можно забыть
+        self.ttl = burst / self.rate
+        self.allowed = 0
+        self.rejected = 0
+        self._lock = threading.Lock()
+
+    def hit(self, key: str) -> float:
+        """0 — запрос пропущен, иначе через сколько секунд повторить"""
+        if not settings.RATE_LIMIT_ENABLED:
+            return 0.0
+        if len(key) > _MAX_KEY:
+            key = hashlib.sha256(key.encode("utf-8")).hexdigest()
+        try:
+            retry_after = self.store.update(self.name, key, partial(self._take, time.time()), self.ttl)
+        except Exception as e:
+            logger.error(f"Ограничение {self.name}: хранилище недоступно, запрос пропущен: {e}")
+            return 0.0
+        with self._lock:
+            if retry_after:
+                self.rejected += 1
+            else:
+                self.allowed += 1
+        return retry_after
+
+    def _take(self, now: float, value):
+        """Значение в хранилище: "жетоны время"; возвращает новое значение и время до повтора"""
+        tokens = self.burst
+        if value:
+            stored, updated = value.split(" ")
+            tokens = min(self.burst, float(stored) + max(now - float(updated), 0) * self.rate)
+        if tokens >= 1:
+            return f"{tokens - 1:.4f} {now:.3f}", 0.0
+        return f"{tokens:.4f} {now:.3f}", (1 - tokens) / self.rate
+
+    def stats(self) -> dict:
+        return {"allowed": self.allowed, "rejected": self.rejected,
+                "per_minute": self.rate * 60, "burst": self.burst}
+
+
+class ConcurrencyCap:
+    def __init__(self, name: str, limit: int):
+        self.name = name
+        self.limit = limit
+        self.active = 0
+        self.rejected = 0
+        self._lock = threading.Lock()
+
+    def acquire(self) -> bool:
+        """Занимает место, если оно есть; освобождать — release"""
+        with self._lock:
+            if self.active >= self.limit and settings.RATE_LIMIT_ENABLED:
+                self.rejected += 1
+                return False
+            self.active += 1
+            return True
+
+    def release(self):
+        with self._lock:
+            self.active -= 1
+
+    def stats(self) -> dict:
+        return {"active": self.active, "limit": self.limit, "rejected": self.rejected}
+
+
+# Предел ключей у хранилищ — на каждое ведро (namespace) отдельно
+_shared_store = create_store(settings.RATE_LIMIT_STORE, settings.RATE_LIMIT_MAX_KEYS)
+
+playlist_requests = TokenBucket(
+    "rate:playlist", settings.RATE_LIMIT_PLAYLIST_PER_MINUTE, settings.RATE_LIMIT_PLAYLIST_BURST,
+    MemoryStore(settings.RATE_LIMIT_MAX_KEYS),
+)
+login_by_ip = TokenBucket(
+    "rate:login-ip", settings.RATE_LIMIT_LOGIN_PER_MINUTE, settings.RATE_LIMIT_LOGIN_BURST, _shared_store
+)
+login_by_user = TokenBucket(
+    "rate:login-user", settings.RATE_LIMIT_LOGIN_PER_MINUTE, settings.RATE_LIMIT_LOGIN_BURST, _shared_store
+)
+register_by_ip = TokenBucket(
+    "rate:register-ip", settings.RATE_LIMIT_LOGIN_PER_MINUTE, settings.RATE_LIMIT_LOGIN_BURST, _shared_store
+)
+parse_jobs = ConcurrencyCap("parse-jobs", settings.PARSE_MAX_JOBS)
+
+LIMITS = (playlist_requests, login_by_ip, login_by_user, register_by_ip, parse_jobs)
+
+
+def client_ip(request) -> str:
+    """Адрес клиента; за доверенным прокси его уже подставил ProxyHeadersMiddleware"""
+    return request.client.host if request.client else "unknown"
+
+
+def stats() -> dict:
+    return {limit.name: limit.stats() for limit in LIMITS}
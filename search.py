@@ -0,0 +1,73 @@
+"""
+Поиск каналов по общим плейлистам: по имени, tvg-id и группе.
+
+Индекс ведёт сама база (миграция channel_search): в SQLite — таблица FTS5
+channels_fts, которую обновляют триггеры на channels, в PostgreSQL —
+GIN-индекс по tsvector тех же полей. Поэтому он не отстаёт ни от
+сохранения, ни от правки, ни от удаления каналов, а общий ли плейлист,
+проверяется в самом запросе.
+
+Находятся каналы, в которых есть все слова запроса, каждое — как начало
+слова; совпадения целых слов идут первыми.
+"""
+import re
+
+from sqlalchemy import text
+from sqlalchemy.orm import Session
+
+# Слова запроса; "_" — разделитель, как и в индексе
+_WORD_RE = re.compile(r"[^\W_]+")
+MAX_WORDS = 8
+
+_COLUMNS = (
+    "c.id, c.name, c.tvg_id, c.tvg_logo, c.group_title, p.id AS playlist_id, p.name AS playlist_name, "
+    "u.username AS owner"
+)
+
+_SQLITE_QUERY = text(
+    f"SELECT {_COLUMNS} FROM channels_fts f "
+    "JOIN channels c ON c.id = f.rowid "
+    "JOIN playlists p ON p.id = c.playlist_id "
+    "JOIN users u ON u.id = p.owner_id "
+    "WHERE channels_fts MATCH :match AND p.is_shared = 1 "
+    "LIMIT :limit"
+)
+
+# Выражение должно совпадать с индексом ix_channels_search, иначе PostgreSQL его не использует
+_PG_QUERY = text(
+    f"SELECT {_COLUMNS} FROM channels c "
+    "JOIN playlists p ON p.id = c.playlist_id "
+    "JOIN users u ON u.id = p.owner_id "
+    "WHERE to_tsvector('simple', translate("
+    "coalesce(c.name, '') || ' ' || coalesce(c.tvg_id, '') || ' ' || coalesce(c.group_title, ''), "
+    "'.-_/|:@()[]', '           ')) @@ to_tsquery('simple', :match) "
+    "AND p.is_shared "
+    "LIMIT :limit"
+)
+
+
+def query_words(query: str) -> list:
+    return _WORD_RE.findall(query.lower())[:MAX_WORDS]
+
+
+def _statement(db: Session, words: list, prefix: bool):
+    if db.get_bind().dialect.name == "postgresql":
+        return _PG_QUERY, " & ".join(f"{word}:*" if prefix else word for word in words)
+    return _SQLITE_QUERY, " ".join(f'"{word}"*' if prefix else f'"{word}"' for word in words)
+
+
+def search_shared_channels(db: Session, query: str, limit: int = 50) -> list:
+    """Каналы общих плейлистов, подходящие под запрос, не больше limit; [] — в запросе нет слов"""
+    words = query_words(query)
+    if not words:
+        return []
+    # Сначала ищем слова целиком: такие совпадения база отдаёт по мере чтения индекса,
+    # а по началу слова сперва собирает все совпадения — на частых словах это десятки мс
+    found = {}
+    for prefix in (False, True):
+        statement, match = _statement(db, words, prefix)
+        for row in db.execute(statement, {"match": match, "limit": limit + len(found)}).mappings():
+            found.setdefault(row["id"], dict(row))
+        if len(found) >= limit:
+            break
+    return list(found.values())[:limit]
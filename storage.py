@@ -0,0 +1,615 @@
+import gzip
+import hashlib
+import json
+import time
+from datetime import datetime
+from typing import Optional
+
+from sqlalchemy import func, or_
+from sqlalchemy.exc import IntegrityError
+from sqlalchemy.orm import Session, defer
+
+import metrics
+from config import settings
+from database import (
+    ChannelHealth, HealthCheck, Playlist, PlaylistBlob, PlaylistChannel, Subscription, SubscriptionChannel
+)
+from logging_conf import get_logger
+from utils import blob_files
+from utils.cache import CachedPlaylist
+from utils.channels import ChannelTable
+from utils.http_cache import make_etag
+from utils.generator import iter_m3u
+from utils.parser import parse_m3u
+
+try:
+    import brotli
+except ImportError:  # brotli необязателен: без него отдаём gzip
+    brotli = None
+
+logger = get_logger(__name__)
+
+# Поля канала, которые хранятся отдельными колонками
+CHANNEL_FIELDS = ("name", "tvg_id", "tvg_name", "tvg_logo", "group_title", "url")
+
+# Сколько id передавать в одном IN (...) — у SQLite есть лимит на число параметров
+_ID_BATCH = 500
+
+
+def channel_row(channel: dict, playlist_id: str, position: int) -> dict:
+    """Канал из запроса/парсера -> значения колонок PlaylistChannel"""
+    attrs = channel.get("attrs")
+    return {
+        "playlist_id": playlist_id,
+        "position": position,
+        "name": channel.get("name") or "",
+        "tvg_id": channel.get("tvg_id"),
+        "tvg_name": channel.get("tvg_name"),
+        "tvg_logo": channel.get("tvg_logo"),
+        "group_title": channel.get("group_title"),
+        "url": channel.get("url") or "",
+        "attrs": _attrs_json(attrs),
+    }
+
+
+def _attrs_json(attrs: Optional[dict]) -> Optional[str]:
+    # Без пробелов после разделителей: строка хранится у каждого канала
+    return json.dumps(attrs, ensure_ascii=False, separators=(",", ":")) if attrs else None
+
+
+def _channel_dict(row, tvg_url) -> dict:
+    """Строка (id, поля CHANNEL_FIELDS, attrs) -> словарь канала"""
+    channel_id, name, tvg_id, tvg_name, tvg_logo, group_title, url, attrs = row
+    return {
+        "id": channel_id,
+        "name": name,
+        "tvg_id": tvg_id,
+        "tvg_name": tvg_name,
+        "tvg_logo": tvg_logo,
+        "group_title": group_title,
+        "url": url,
+        "tvg_url": tvg_url,
+        "attrs": json.loads(attrs) if attrs else {},
+    }
+
+
+def _channel_query(db: Session, playlist: Playlist):
+    return db.query(
+        PlaylistChannel.id, *(getattr(PlaylistChannel, f) for f in CHANNEL_FIELDS), PlaylistChannel.attrs
+    ).filter(PlaylistChannel.playlist_id == playlist.id)
+
+
+def load_channels(db: Session, playlist: Playlist) -> ChannelTable:
+    """Каналы плейлиста по порядку (как их отдаёт parse_m3u, плюс id)"""
+    channels = ChannelTable(playlist.tvg_url or None, with_ids=True)
+    for row in _channel_query(db, playlist).order_by(PlaylistChannel.position).yield_per(1000):
+        channels.append_row(row)
+    return channels
+
+
+def iter_channels(db: Session, playlist: Playlist, batch: int = 1000):
+    """Каналы плейлиста по порядку, читаются из базы пачками, а не списком целиком"""
+    tvg_url = playlist.tvg_url or None
+    query = _channel_query(db, playlist).order_by(PlaylistChannel.position).yield_per(batch)
+    for row in query:
+        yield _channel_dict(row, tvg_url)
+
+
+def load_channel_page(db: Session, playlist: Playlist, after: int = None, limit: int = 200,
+                      group: str = None, search: str = None) -> dict:
+    """
+    Страница каналов для редактора. Курсор — id последнего полученного
+    канала: следующая страница начинается сразу за его текущей позицией,
+    поэтому сохранённые между запросами правки не сдвигают выдачу.
+    group == "" — каналы без группы; search — подстрока в имени.
+    total считается только для первой страницы.
+    """
+    query = _channel_query(db, playlist)
+    if group is not None:
+        if group:
+            query = query.filter(PlaylistChannel.group_title == group)
+        else:
+            query = query.filter(or_(PlaylistChannel.group_title.is_(None), PlaylistChannel.group_title == ""))
+    if search:
+        # icontains, а не contains: LIKE в PostgreSQL, в отличие от SQLite, различает регистр
+        query = query.filter(PlaylistChannel.name.icontains(search, autoescape=True))
+
+    total = query.count() if after is None else None
+    if after is not None:
+        position = db.query(PlaylistChannel.position).filter(
+            PlaylistChannel.id == after,
+            PlaylistChannel.playlist_id == playlist.id
+        ).scalar()
+        if position is None:
+            raise ValueError(f"Канал {after} не найден")
+        query = query.filter(PlaylistChannel.position > position)
+
+    rows = query.order_by(PlaylistChannel.position).limit(limit + 1).all()
+    has_more = len(rows) > limit
+    channels = ChannelTable(playlist.tvg_url or None, with_ids=True)
+    for row in rows[:limit]:
+        channels.append_row(row)
+    return {
+        "channels": channels,
+        "next_cursor": channels[-1]["id"] if has_more else None,
+        "total": total,
+        "version": playlist.version,
+    }
+
+
+def channel_groups(db: Session, playlist: Playlist) -> list:
+    """Группы плейлиста с числом каналов, по алфавиту; "" — каналы без группы"""
+    rows = (
+        db.query(PlaylistChannel.group_title, func.count(PlaylistChannel.id))
+        .filter(PlaylistChannel.playlist_id == playlist.id)
+        .group_by(PlaylistChannel.group_title)
+        .all()
+    )
+    counts = {}
+    for group, count in rows:
+        counts[group or ""] = counts.get(group or "", 0) + count
+    return [{"group": group, "count": counts[group]} for group in sorted(counts)]
+
+
+def set_summary(playlist: Playlist, channels):
+    """Сводка по каналам плейлиста (списка словарей или ChannelTable): число каналов и групп"""
+    if isinstance(channels, ChannelTable):
+        groups = set(channels.group_titles())
+    else:
+        groups = {ch.get("group_title") for ch in channels}
+    playlist.channel_count = len(channels)
+    playlist.group_count = len(groups - {None, ""})
+
+
+def set_playlist_content(db: Session, playlist: Playlist, content: str, channels):
+    """Записывает текст плейлиста и сводку по нему (каналы, группы, размер)"""
+    set_summary(playlist, channels)
+    set_renditions(db, playlist, content)
+
+
+def render_content(db: Session, playlist: Playlist, channels):
+    """
+    Генерирует текст плейлиста из каналов (списка или потока из iter_channels)
+    и записывает его вместе со сжатыми версиями. Текст собирается из кусков
+    iter_m3u, без промежуточного списка строк на каждый канал.
+    """
+    started = time.perf_counter()
+    data = b"".join(iter_m3u(channels, tvg_url=playlist.tvg_url))
+    metrics.render_duration.observe(time.perf_counter() - started)
+    metrics.render_channels.observe(playlist.channel_count or 0)
+    _set_renditions(db, playlist, data)
+
+
+def set_renditions(db: Session, playlist: Playlist, content: str):
+    """
+    Записывает текст плейлиста вместе с тем, что нужно для быстрой отдачи:
+    хэш для ETag, время изменения и заранее сжатые gzip/brotli версии
+    """
+    _set_renditions(db, playlist, content.encode("utf-8"), content)
+
+
+def _set_renditions(db: Session, playlist: Playlist, data: bytes, content: str = None):
+    content_hash = hashlib.sha256(data).hexdigest()
+    if content_hash != playlist.content_hash:
+        _acquire_blob(db, content_hash, data, content)
+        _point_to_blob(db, playlist, content_hash)
+    playlist.content = None
+    playlist.content_size = len(data)
+    playlist.updated_at = datetime.utcnow()
+
+
+def _acquire_blob(db: Session, content_hash: str, data: bytes, content: str = None):
+    """Добавляет ссылку на блоб с этим текстом; сжимается текст, только если такого блоба ещё нет"""
+    if _add_ref(db, content_hash, 1):
+        return
+    blob = PlaylistBlob(hash=content_hash, size=len(data), ref_count=1)
+    started = time.perf_counter()
+    content_gz = gzip.compress(data, mtime=0)
+    metrics.compress_duration.observe(time.perf_counter() - started, "gzip")
+    content_br = None
+    if brotli:
+        started = time.perf_counter()
+        content_br = brotli.compress(data, quality=settings.BROTLI_QUALITY)
+        metrics.compress_duration.observe(time.perf_counter() - started, "br")
+    if settings.PLAYLIST_STORAGE == "files":
+        # Файлы пишутся до строки: если транзакция откатится, их уберёт blob_files.sweep
+        blob_files.write(content_hash, {"": data, "gzip": content_gz, "br": content_br})
+    else:
+        blob.content = data.decode("utf-8") if content is None else content
+        blob.content_gz = content_gz
+        blob.content_br = content_br
+    try:
+        with db.begin_nested():
+            db.add(blob)
+    except IntegrityError:
+        # Такой же текст только что сохранил параллельный запрос
+        _add_ref(db, content_hash, 1)
+
+
+def _point_to_blob(db: Session, playlist: Playlist, content_hash):
+    """Переставляет плейлист на другой блоб (None — текст устарел), отпуская прежний"""
+    # Прежний хэш перечитываем с блокировкой строки: параллельная правка могла его уже сменить
+    db.flush()
+    old = db.query(Playlist.content_hash).filter(Playlist.id == playlist.id).with_for_update().scalar()
+    if old is not None and old != content_hash:
+        _add_ref(db, old, -1)
+        db.query(PlaylistBlob).filter(
+            PlaylistBlob.hash == old, PlaylistBlob.ref_count <= 0
+        ).delete(synchronize_session=False)
+    playlist.content_hash = content_hash
+
+
+def _add_ref(db: Session, content_hash: str, delta: int) -> bool:
+    return bool(db.query(PlaylistBlob).filter(PlaylistBlob.hash == content_hash).update(
+        {PlaylistBlob.ref_count: PlaylistBlob.ref_count + delta}, synchronize_session=False
+    ))
+
+
+def save_channels(db: Session, playlist: Playlist, channels: list, tvg_url: str = None):
+    """
+    Сохраняет полный список каналов плейлиста.
+
+    Каналы с id существующей строки обновляются, только если что-то изменилось;
+    каналы без id добавляются, строки, которых нет в списке, удаляются.
+    """
+    # Строка плейлиста должна попасть в базу раньше ссылающихся на неё каналов
+    db.add(playlist)
+    db.flush()
+
+    columns = (PlaylistChannel.id, PlaylistChannel.position,
+               *(getattr(PlaylistChannel, f) for f in CHANNEL_FIELDS), PlaylistChannel.attrs)
+    existing = {
+        row[0]: row[1:]
+        for row in db.query(*columns).filter(PlaylistChannel.playlist_id == playlist.id)
+    }
+
+    inserts, updates, kept = [], [], set()
+    for position, channel in enumerate(channels):
+        row = channel_row(channel, playlist.id, position)
+        channel_id = channel.get("id")
+        old = existing.get(channel_id)
+        if old is None or channel_id in kept:
+            inserts.append(row)
+            continue
+        kept.add(channel_id)
+        new = (position, *(row[f] for f in CHANNEL_FIELDS), row["attrs"])
+        if new != tuple(old):
+            row["id"] = channel_id
+            updates.append(row)
+
+    removed = [channel_id for channel_id in existing if channel_id not in kept]
+    for i in range(0, len(removed), _ID_BATCH):
+        db.query(PlaylistChannel).filter(
+            PlaylistChannel.id.in_(removed[i:i + _ID_BATCH])
+        ).delete(synchronize_session=False)
+    if updates:
+        db.bulk_update_mappings(PlaylistChannel, updates)
+    if inserts:
+        db.bulk_insert_mappings(PlaylistChannel, inserts)
+
+    playlist.tvg_url = tvg_url
+    playlist.version = (playlist.version or 0) + 1
+    set_summary(playlist, channels)
+    render_content(db, playlist, channels)
+
+
+def update_channel(db: Session, playlist: Playlist, channel_id: int, fields: dict) -> bool:
+    """
+    Меняет поля одного канала, не трогая остальные строки. Текст плейлиста
+    помечается устаревшим и будет перегенерирован при следующей отдаче.
+    """
+    updated = _update_channel_row(db, playlist, channel_id, fields)
+    if updated:
+        invalidate_content(db, playlist)
+    return updated
+
+
+def _update_channel_row(db: Session, playlist: Playlist, channel_id: int, fields: dict) -> bool:
+    values = {f: fields[f] for f in CHANNEL_FIELDS if f in fields}
+    for required in ("name", "url"):
+        if required in values:
+            values[required] = values[required] or ""
+    if "attrs" in fields:
+        values["attrs"] = _attrs_json(fields["attrs"])
+    if not values:
+        return False
+    return bool(db.query(PlaylistChannel).filter(
+        PlaylistChannel.id == channel_id,
+        PlaylistChannel.playlist_id == playlist.id
+    ).update(values, synchronize_session=False))
+
+
+def _position_at(db: Session, playlist: Playlist, index, exclude_id: int = None) -> int:
+    """
+    Позиция канала, стоящего сейчас на месте index (позиции могут идти с
+    пропусками); если index за концом списка — позиция после последнего канала
+    """
+    query = db.query(PlaylistChannel.position).filter(PlaylistChannel.playlist_id == playlist.id)
+    if exclude_id is not None:
+        query = query.filter(PlaylistChannel.id != exclude_id)
+    if index is not None and index >= 0:
+        position = query.order_by(PlaylistChannel.position).offset(index).limit(1).scalar()
+        if position is not None:
+            return position
+    last = query.order_by(PlaylistChannel.position.desc()).limit(1).scalar()
+    return 0 if last is None else last + 1
+
+
+def _shift_positions(db: Session, playlist: Playlist, start: int, delta: int, exclude_id: int = None):
+    """Сдвигает позиции каналов начиная со start, освобождая место под вставку"""
+    query = db.query(PlaylistChannel).filter(
+        PlaylistChannel.playlist_id == playlist.id,
+        PlaylistChannel.position >= start
+    )
+    if exclude_id is not None:
+        query = query.filter(PlaylistChannel.id != exclude_id)
+    query.update({PlaylistChannel.position: PlaylistChannel.position + delta}, synchronize_session=False)
+
+
+class VersionConflict(Exception):
+    """Плейлист изменился с тех пор, как клиент его загрузил"""
+
+
+def apply_operations(db: Session, playlist: Playlist, ops: list, base_version: int = None) -> dict:
+    """
+    Применяет пакет операций PATCH к строкам каналов по очереди, не
+    перечитывая весь плейлист. Возвращает соответствие ref -> id для
+    вставленных каналов. Ошибки в операциях — ValueError.
+    """
+    # Версию поднимаем первым же UPDATE: он берёт блокировку на запись,
+    # поэтому из двух правок от одной версии пройдёт только одна
+    query = db.query(Playlist).filter(Playlist.id == playlist.id)
+    if base_version is not None:
+        query = query.filter(Playlist.version == base_version)
+    if not query.update({Playlist.version: Playlist.version + 1}, synchronize_session=False):
+        raise VersionConflict()
+    db.refresh(playlist, ["version"])
+
+    refs = {}
+
+    def resolve(op) -> int:
+        if op.id is not None:
+            return op.id
+        if op.ref is not None and op.ref in refs:
+            return refs[op.ref]
+        raise ValueError(f"Операция {op.op}: не указан канал (id или ref)")
+
+    for op in ops:
+        if op.op == "insert":
+            if not op.channels:
+                continue
+            position = _position_at(db, playlist, op.index)
+            _shift_positions(db, playlist, position, len(op.channels))
+            db.bulk_insert_mappings(PlaylistChannel, [
+                channel_row(channel, playlist.id, position + offset)
+                for offset, channel in enumerate(op.channels)
+            ])
+            # Позиции внутри плейлиста уникальны — по ним и узнаём id новых строк
+            if any(channel.get("ref") is not None for channel in op.channels):
+                inserted = dict(
+                    db.query(PlaylistChannel.position, PlaylistChannel.id).filter(
+                        PlaylistChannel.playlist_id == playlist.id,
+                        PlaylistChannel.position >= position,
+                        PlaylistChannel.position < position + len(op.channels)
+                    )
+                )
+                for offset, channel in enumerate(op.channels):
+                    if channel.get("ref") is not None:
+                        refs[str(channel["ref"])] = inserted[position + offset]
+
+        elif op.op == "delete":
+            ids = list(op.ids) + [refs[ref] for ref in op.refs if ref in refs]
+            for i in range(0, len(ids), _ID_BATCH):
+                db.query(PlaylistChannel).filter(
+                    PlaylistChannel.playlist_id == playlist.id,
+                    PlaylistChannel.id.in_(ids[i:i + _ID_BATCH])
+                ).delete(synchronize_session=False)
+
+        elif op.op == "move":
+            channel_id = resolve(op)
+            position = _position_at(db, playlist, op.index, exclude_id=channel_id)
+            _shift_positions(db, playlist, position, 1, exclude_id=channel_id)
+            moved = db.query(PlaylistChannel).filter(
+                PlaylistChannel.id == channel_id,
+                PlaylistChannel.playlist_id == playlist.id
+            ).update({PlaylistChannel.position: position}, synchronize_session=False)
+            if not moved:
+                raise ValueError(f"Канал {channel_id} не найден")
+
+        elif op.op == "update":
+            channel_id = resolve(op)
+            if op.fields and not _update_channel_row(db, playlist, channel_id, op.fields):
+                raise ValueError(f"Канал {channel_id} не найден")
+
+        elif op.op == "rename_group":
+            if op.group_from is None:
+                raise ValueError("rename_group: не указана исходная группа")
+            db.query(PlaylistChannel).filter(
+                PlaylistChannel.playlist_id == playlist.id,
+                PlaylistChannel.group_title == op.group_from
+            ).update({PlaylistChannel.group_title: op.group_to or None}, synchronize_session=False)
+
+        elif op.op == "set":
+            if "name" in op.fields:
+                name = op.fields["name"] or "Без названия"
+                playlist.name = name
+                playlist.filename = f"{name}.m3u"
+            if "tvg_url" in op.fields:
+                playlist.tvg_url = op.fields["tvg_url"]
+
+    playlist.channel_count = db.query(PlaylistChannel.id).filter(PlaylistChannel.playlist_id == playlist.id).count()
+    invalidate_content(db, playlist)
+    return refs
+
+
+def invalidate_content(db: Session, playlist: Playlist):
+    """Помечает текст плейлиста устаревшим после точечных правок каналов"""
+    _point_to_blob(db, playlist, None)
+    playlist.content = None
+    playlist.content_size = None
+    playlist.group_count = (
+        db.query(PlaylistChannel.group_title)
+        .filter(PlaylistChannel.playlist_id == playlist.id, PlaylistChannel.group_title.isnot(None),
+                PlaylistChannel.group_title != "")
+        .distinct()
+        .count()
+    )
+
+
+def ensure_rendered(db: Session, playlist: Playlist):
+    """Если каналы менялись, перегенерирует текст плейлиста и сохраняет его"""
+    if playlist.content_hash is not None:
+        return
+    if playlist.content is not None:
+        # Плейлист сохранён до появления блобов — переносим его текст как есть
+        set_renditions(db, playlist, playlist.content)
+    else:
+        # Сводку уже пересчитали при правке, остаётся только текст
+        render_content(db, playlist, iter_channels(db, playlist))
+    db.commit()
+
+
+def stored_content(db: Session, playlist: Playlist) -> str:
+    """Сохранённый текст плейлиста как есть, без перегенерации; None — его нет"""
+    if playlist.content_hash is None:
+        return playlist.content
+    content = db.query(PlaylistBlob.content).filter(PlaylistBlob.hash == playlist.content_hash).scalar()
+    return blob_files.read_text(playlist.content_hash) if content is None else content
+
+
+def get_content(db: Session, playlist: Playlist) -> str:
+    """Текст M3U плейлиста; если каналы менялись, перегенерирует и сохраняет его"""
+    ensure_rendered(db, playlist)
+    return stored_content(db, playlist)
+
+
+def needs_render(db: Session, playlist_id: str) -> bool:
+    """Придётся ли get_content перегенерировать текст плейлиста (и записать его в базу)"""
+    return db.query(Playlist.id).filter(Playlist.id == playlist_id, Playlist.content_hash.is_(None)).first() is not None
+
+
+def playlist_etag(db: Session, playlist_id: str):
+    """ETag текущего текста плейлиста; None — плейлиста нет или текст устарел"""
+    content_hash = db.query(Playlist.content_hash).filter(Playlist.id == playlist_id).scalar()
+    return make_etag(content_hash) if content_hash else None
+
+
+class BlobLost(Exception):
+    """Текст плейлиста пропал: нет строки блоба или его файлов в PLAYLISTS_DIR"""
+
+
+def load_cached_playlist(db: Session, playlist_id: str, find_cached=None, rerender_lost: bool = False):
+    """
+    Готовит запись для кэша отдачи; None — плейлиста нет. find_cached(etag) —
+    запись кэша с тем же текстом: если она есть, блоб из базы не читается.
+    Текст в файлах в память не читается, в записи остаются только пути к ним.
+    Если блоб или его файлы пропали — BlobLost, а с rerender_lost текст перегенерируется
+    """
+    playlist = db.query(Playlist).options(defer(Playlist.content)).filter(Playlist.id == playlist_id).first()
+    if not playlist:
+        return None
+    ensure_rendered(db, playlist)
+    etag = make_etag(playlist.content_hash)
+    shared = find_cached(etag) if find_cached else None
+    if shared is not None:
+        body, body_gz, body_br, files = shared.body, shared.body_gz, shared.body_br, shared.files
+    else:
+        blob = db.get(PlaylistBlob, playlist.content_hash)
+        if blob is not None and blob.content is not None:
+            body, body_gz, body_br, files = blob.content.encode("utf-8"), blob.content_gz, blob.content_br, None
+        else:
+            body = body_gz = body_br = None
+            # Строки блоба может не быть: её удалила чистка по счётчику ссылок или она не записалась
+            files = blob_files.paths(playlist.content_hash) if blob is not None else None
+            if files is None:
+                if not rerender_lost:
+                    raise BlobLost(playlist.content_hash)
+                _forget_blob(db, playlist, "блоба нет в базе" if blob is None else "файлы не найдены")
+                return load_cached_playlist(db, playlist_id, find_cached)
+    return CachedPlaylist(
+        body=body,
+        body_gz=body_gz,
+        body_br=body_br,
+        files=files,
+        etag=etag,
+        last_modified=playlist.updated_at,
+        is_shared=bool(playlist.is_shared)
+    )
+
+
+def _forget_blob(db: Session, playlist: Playlist, reason: str):
+    """Текст потерян (нет блоба или его файлов): все его плейлисты помечаются устаревшими и перерисуются из каналов"""
+    content_hash = playlist.content_hash
+    logger.error(f"Текст {content_hash} потерян ({reason}, PLAYLISTS_DIR {settings.PLAYLISTS_DIR}), "
+                 f"плейлисты будут перегенерированы")
+    db.query(Playlist).filter(Playlist.content_hash == content_hash).update(
+        {Playlist.content_hash: None}, synchronize_session=False
+    )
+    db.query(PlaylistBlob).filter(PlaylistBlob.hash == content_hash).delete(synchronize_session=False)
+    db.commit()
+
+
+def sweep_blob_files(db: Session) -> int:
+    """Удаляет из PLAYLISTS_DIR файлы текстов, на которые больше не ссылается ни один блоб"""
+    known = {content_hash for (content_hash,) in db.query(PlaylistBlob.hash).filter(PlaylistBlob.content.is_(None))}
+    removed = blob_files.sweep(known)
+    if removed:
+        logger.info(f"Удалено файлов неиспользуемых текстов: {removed}")
+    return removed
+
+
+def delete_playlist(db: Session, playlist: Playlist):
+    """Удаляет плейлист вместе с его каналами; текст удаляется, если на него больше никто не ссылается"""
+    _point_to_blob(db, playlist, None)
+    db.query(PlaylistChannel).filter(PlaylistChannel.playlist_id == playlist.id).delete(synchronize_session=False)
+    db.query(ChannelHealth).filter(ChannelHealth.playlist_id == playlist.id).delete(synchronize_session=False)
+    db.query(HealthCheck).filter(HealthCheck.playlist_id == playlist.id).delete(synchronize_session=False)
+    db.query(SubscriptionChannel).filter(SubscriptionChannel.playlist_id == playlist.id).delete(
+        synchronize_session=False
+    )
+    db.query(Subscription).filter(Subscription.playlist_id == playlist.id).delete(synchronize_session=False)
+    db.delete(playlist)
+
+
+def backfill_playlist_summaries(db: Session):
+    """Однократно считает сводку для плейлистов, сохранённых до появления этих колонок"""
+    playlists = db.query(Playlist).filter(Playlist.channel_count.is_(None)).all()
+    for playlist in playlists:
+        content = playlist.content or ""
+        try:
+            channels = parse_m3u(content)["channels"]
+        except Exception as e:
+            logger.error(f"Ошибка парсинга плейлиста {playlist.id}: {str(e)}")
+            channels = []
+        set_playlist_content(db, playlist, content, channels)
+    if playlists:
+        db.commit()
+        logger.info(f"Посчитана сводка для {len(playlists)} плейлистов")
+
+
+def migrate_content_to_channels(db: Session):
+    """
+    Однократно раскладывает плейлисты, хранившиеся только текстом, на строки
+    каналов. Сам текст не перегенерируется, поэтому отдаётся байт в байт как раньше.
+    """
+    has_channels = db.query(PlaylistChannel.id).filter(PlaylistChannel.playlist_id == Playlist.id).exists()
+    playlists = db.query(Playlist).filter(Playlist.channel_count > 0, ~has_channels).all()
+    migrated = 0
+    for playlist in playlists:
+        try:
+            result = parse_m3u(stored_content(db, playlist) or "")
+        except Exception as e:
+            logger.error(f"Ошибка парсинга плейлиста {playlist.id}: {str(e)}")
+            continue
+        if not result["channels"]:
+            continue
+        db.bulk_insert_mappings(PlaylistChannel, [
+            channel_row(channel, playlist.id, position)
+            for position, channel in enumerate(result["channels"])
+        ])
+        if not playlist.tvg_url:
+            playlist.tvg_url = result["tvg_url"]
+        db.commit()
+        migrated += 1
+    if migrated:
+        logger.info(f"Каналы {migrated} плейлистов перенесены в отдельную таблицу")
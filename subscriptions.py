@@ -0,0 +1,401 @@
+"""
+Подписки: плейлист следит за источником по ссылке и обновляется по расписанию.
+
+Источник запрашивается условно (If-None-Match / If-Modified-Since), ответ
+разбирается по мере чтения M3UParser'ом, без текста целиком в памяти.
+Если текст не изменился, плейлист не трогается.
+
+Новые каналы источника сливаются с правками пользователя. Каналы
+сопоставляются по ключу — tvg-id и имени; у каждого канала источника
+запоминается, в какой канал плейлиста он попал и какими были его поля
+(таблица subscription_channels). Поэтому при обновлении:
+- поле, которое пользователь не менял, берётся из источника, а изменённое
+  им остаётся как есть;
+- канал, который пользователь удалил, не возвращается;
+- канал, пропавший из источника, удаляется, если пользователь его не правил;
+- новые каналы источника добавляются в конец плейлиста;
+- каналы, добавленные пользователем, не трогаются.
+Правки применяются через storage.apply_operations, поэтому переписываются
+только изменившиеся строки каналов.
+
+Расписание хранится в таблице subscriptions (next_refresh_at), так что его
+видит любой процесс приложения; подписку забирает тот процесс, который
+первым отодвинул её время. Время следующего обновления сдвигается на
+случайные ±10% интервала, чтобы обновления не собирались в одну минуту.
+"""
+import asyncio
+import codecs
+import hashlib
+import json
+import random
+from collections import Counter
+from datetime import datetime, timedelta
+from functools import partial
+from typing import Optional
+from urllib.parse import urlsplit
+
+import httpx
+from sqlalchemy.orm import Session, defer
+from starlette.concurrency import run_in_threadpool
+
+import storage
+from config import settings
+from database import Playlist, PlaylistChannel, SessionLocal, Subscription, SubscriptionChannel, write_session
+from logging_conf import get_logger
+from models import PlaylistOperation
+from utils import url_guard
+from utils.channels import FIELDS
+from utils.parser import M3UParser
+
+logger = get_logger(__name__)
+
+# Поля канала, которые сливаются с правками пользователя
+MERGE_FIELDS = (*FIELDS, "attrs")
+
+# На сколько подписка считается занятой обновлением: за это время упавший процесс её не вернёт
+_CLAIM_LEASE = timedelta(minutes=15)
+
+# Сколько подписок забирать за один проход расписания
+_CLAIM_BATCH = 20
+
+_READ_CHUNK = 64 * 1024
+
+# Сколько значений передавать в одном IN (...), как в storage
+_ID_BATCH = 500
+
+# Значения полей канала источника в JSON — так они хранятся в subscription_channels.base
+_encode = json.JSONEncoder(ensure_ascii=False, separators=(",", ":")).encode
+
+
+def check_url(url: str) -> str:
+    url = (url or "").strip()
+    if urlsplit(url).scheme.lower() not in ("http", "https") or not urlsplit(url).hostname:
+        raise ValueError("Нужна ссылка http:// или https://")
+    return url
+
+
+def fetch(url: str, etag: str = None, last_modified: str = None) -> Optional[dict]:
+    """
+    Скачивает и разбирает источник: {"channels", "etag", "last_modified",
+    "content_hash"}; None — источник ответил 304. Ошибки — ValueError
+    """
+    headers = {}
+    if etag:
+        headers["If-None-Match"] = etag
+    if last_modified:
+        headers["If-Modified-Since"] = last_modified
+    limit = settings.SUBSCRIPTION_MAX_MB * 1024 * 1024
+    try:
+        with httpx.Client(
+                timeout=settings.SUBSCRIPTION_TIMEOUT, follow_redirects=True, max_redirects=5,
+                # Источник и каждый его редирект — только на публичные адреса (utils/url_guard.py)
+                event_hooks={"request": [
+                    partial(url_guard.check_request, allow_private=settings.SUBSCRIPTION_ALLOW_PRIVATE)
+                ]}
+        ) as client:
+            with client.stream("GET", url, headers=headers) as response:
+                if response.status_code == 304:
+                    return None
+                if response.status_code >= 400:
+                    raise ValueError(f"Источник ответил {response.status_code}")
+                parser = M3UParser()
+                decoder = codecs.getincrementaldecoder(response.charset_encoding or "utf-8-sig")("replace")
+                digest = hashlib.sha256()
+                size = 0
+                for chunk in response.iter_bytes(_READ_CHUNK):
+                    size += len(chunk)
+                    if size > limit:
+                        raise ValueError(f"Источник больше {settings.SUBSCRIPTION_MAX_MB} МБ")
+                    digest.update(chunk)
+                    parser.feed(decoder.decode(chunk))
+                parser.feed(decoder.decode(b"", final=True))
+                return {
+                    "channels": parser.close(),
+                    "etag": response.headers.get("etag"),
+                    "last_modified": response.headers.get("last-modified"),
+                    "content_hash": digest.hexdigest(),
+                }
+    except httpx.HTTPError as e:
+        raise ValueError(f"Не удалось получить источник: {e or type(e).__name__}")
+    except LookupError:
+        raise ValueError("Неизвестная кодировка источника")
+
+
+def channel_keys(pairs):
+    """
+    Ключи каналов по (имя, tvg_id): tvg-id и имя без регистра и лишних
+    пробелов; у повторов — номер повтора
+    """
+    seen = Counter()
+    for name, tvg_id in pairs:
+        key = f"{tvg_id or ''}|{' '.join((name or '').split()).casefold()}"
+        count = seen[key]
+        seen[key] += 1
+        yield f"{key}#{count}" if count else key
+
+
+def _values(row) -> list:
+    """Кортеж (FIELDS..., attrs) из ChannelTable.tuples() -> значения, как их хранит база"""
+    name, tvg_id, tvg_name, tvg_logo, group_title, url, attrs = row
+    return [name or "", tvg_id, tvg_name, tvg_logo, group_title, url or "", attrs or {}]
+
+
+def _load_values(db: Session, playlist: Playlist, channel_ids: list) -> dict:
+    """Значения полей каналов плейлиста по id, в том же виде, что _values"""
+    columns = (PlaylistChannel.id, *(getattr(PlaylistChannel, f) for f in FIELDS), PlaylistChannel.attrs)
+    values = {}
+    for i in range(0, len(channel_ids), _ID_BATCH):
+        for channel_id, *fields, attrs in db.query(*columns).filter(
+            PlaylistChannel.playlist_id == playlist.id,
+            PlaylistChannel.id.in_(channel_ids[i:i + _ID_BATCH])
+        ):
+            values[channel_id] = [*fields, json.loads(attrs) if attrs else {}]
+    return values
+
+
+def merge(db: Session, playlist: Playlist, theirs) -> dict:
+    """
+    Сливает каналы источника (ChannelTable) с каналами плейлиста и
+    записывает изменения. Возвращает число добавленных, изменённых и
+    удалённых каналов.
+
+    Каналы, которые в источнике не изменились, сверяются только по JSON их
+    полей, без чтения из базы: читаются лишь каналы, по которым есть что решать
+    """
+    existing = [
+        channel_id for channel_id, in db.query(PlaylistChannel.id).filter(
+            PlaylistChannel.playlist_id == playlist.id
+        ).order_by(PlaylistChannel.position)
+    ]
+    present = set(existing)
+    links = {
+        key: (channel_id, base)
+        for key, channel_id, base in db.query(
+            SubscriptionChannel.key, SubscriptionChannel.channel_id, SubscriptionChannel.base
+        ).filter(SubscriptionChannel.playlist_id == playlist.id)
+    }
+    rows = [_values(row) for row in theirs.tuples()]
+    source = {
+        key: (values, _encode(values))
+        for key, values in zip(channel_keys((values[0], values[1]) for values in rows), rows)
+    }
+
+    # Каналы плейлиста, ещё не связанные с источником (например, подписку добавили
+    # к загруженному раньше плейлисту), связываются по ключу
+    linked = {channel_id for channel_id, _ in links.values()}
+    unlinked_ids = [channel_id for channel_id in existing if channel_id not in linked]
+    changed = [
+        links[key][0] for key, (_, base) in source.items()
+        if key in links and links[key][0] in present and links[key][1] != base
+    ]
+    gone = [channel_id for key, (channel_id, _) in links.items() if key not in source and channel_id in present]
+    current = _load_values(db, playlist, unlinked_ids + changed + gone)
+    unlinked = dict(zip(
+        channel_keys((current[channel_id][0], current[channel_id][1]) for channel_id in unlinked_ids),
+        unlinked_ids
+    ))
+
+    new_links, inserts, updates = {}, [], []
+    for key, (values, base) in source.items():
+        if key in links:
+            channel_id, old_base = links[key]
+            if channel_id not in present:
+                # Пользователь удалил канал — не возвращаем его
+                new_links[key] = (None, base)
+                continue
+            fields = {}
+            if old_base != base:
+                old = json.loads(old_base)
+                fields = {
+                    field: new for field, was, now, new in zip(MERGE_FIELDS, old, current[channel_id], values)
+                    if now == was and new != now
+                }
+        elif key in unlinked:
+            channel_id = unlinked.pop(key)
+            fields = {
+                field: new for field, now, new in zip(MERGE_FIELDS, current[channel_id], values) if new != now
+            }
+        else:
+            inserts.append(dict(zip(MERGE_FIELDS, values), ref=key))
+            new_links[key] = (None, base)
+            continue
+        new_links[key] = (channel_id, base)
+        if fields:
+            updates.append(PlaylistOperation(op="update", id=channel_id, fields=fields))
+
+    # Каналы, пропавшие из источника, удаляются, только если пользователь их не правил
+    removed = [
+        channel_id for key, (channel_id, base) in links.items()
+        if key not in source and channel_id in present and current[channel_id] == json.loads(base)
+    ]
+
+    ops = list(updates)
+    if removed:
+        ops.insert(0, PlaylistOperation(op="delete", ids=removed))
+    if inserts:
+        ops.append(PlaylistOperation(op="insert", index=None, channels=inserts))
+    subscription = db.get(Subscription, playlist.id)
+    if (playlist.tvg_url or None) == (subscription.tvg_url or None) and theirs.tvg_url != subscription.tvg_url:
+        ops.append(PlaylistOperation(op="set", fields={"tvg_url": theirs.tvg_url}))
+    subscription.tvg_url = theirs.tvg_url
+
+    refs = storage.apply_operations(db, playlist, ops) if ops else {}
+    for key, channel_id in refs.items():
+        new_links[key] = (channel_id, new_links[key][1])
+    _save_links(db, playlist.id, links, new_links)
+    return {"added": len(inserts), "updated": len(updates), "removed": len(removed)}
+
+
+def _save_links(db: Session, playlist_id: str, old: dict, new: dict):
+    """Переписывает только изменившиеся связи каналов"""
+    gone = [key for key in old if key not in new]
+    for i in range(0, len(gone), _ID_BATCH):
+        db.query(SubscriptionChannel).filter(
+            SubscriptionChannel.playlist_id == playlist_id,
+            SubscriptionChannel.key.in_(gone[i:i + _ID_BATCH])
+        ).delete(synchronize_session=False)
+    inserts, updates = [], []
+    for key, (channel_id, base) in new.items():
+        row = {"playlist_id": playlist_id, "key": key, "channel_id": channel_id, "base": base}
+        if key not in old:
+            inserts.append(row)
+        elif old[key] != (channel_id, base):
+            updates.append(row)
+    if updates:
+        db.bulk_update_mappings(SubscriptionChannel, updates)
+    if inserts:
+        db.bulk_insert_mappings(SubscriptionChannel, inserts)
+
+
+def _next_refresh(interval: int) -> datetime:
+    return datetime.utcnow() + timedelta(seconds=interval * random.uniform(0.9, 1.1))
+
+
+def subscribe(db: Session, playlist: Playlist, url: str, interval: int):
+    """Подписывает плейлист на источник (или меняет ссылку и интервал); обновляет его вызывающий"""
+    subscription = db.get(Subscription, playlist.id)
+    if subscription is None:
+        subscription = Subscription(playlist_id=playlist.id, tvg_url=playlist.tvg_url)
+        db.add(subscription)
+    elif subscription.url != url:
+        # У нового источника свои валидаторы и свой текст
+        subscription.etag = subscription.last_modified = subscription.content_hash = None
+    subscription.url = url
+    subscription.interval = interval
+    subscription.next_refresh_at = datetime.utcnow()
+
+
+def unsubscribe(db: Session, playlist_id: str):
+    """Отписывает плейлист; каналы остаются как есть"""
+    db.query(SubscriptionChannel).filter(SubscriptionChannel.playlist_id == playlist_id).delete(
+        synchronize_session=False
+    )
+    db.query(Subscription).filter(Subscription.playlist_id == playlist_id).delete(synchronize_session=False)
+
+
+def refresh(playlist_id: str, fetched: dict = None) -> dict:
+    """
+    Обновляет плейлист из источника: {"status", "added", "updated", "removed"}.
+    fetched — уже полученный ответ fetch(). Ошибки источника записываются в
+    подписку и поднимаются как ValueError
+    """
+    with SessionLocal() as db:
+        subscription = db.get(Subscription, playlist_id)
+        if subscription is None:
+            raise ValueError("Плейлист не подписан на источник")
+        url, etag, last_modified = subscription.url, subscription.etag, subscription.last_modified
+
+    # Источник читаем вне транзакции: запись в SQLite на это время не блокируется
+    try:
+        if fetched is None:
+            fetched = fetch(url, etag, last_modified)
+    except ValueError as e:
+        _finish(playlist_id, url, status="error", error=str(e))
+        raise
+
+    with write_session() as db:
+        playlist = db.query(Playlist).options(defer(Playlist.content)).filter(
+            Playlist.id == playlist_id
+        ).with_for_update().first()
+        subscription = db.get(Subscription, playlist_id)
+        if playlist is None or subscription is None or subscription.url != url:
+            # Пока шёл запрос, плейлист удалили или сменили источник
+            return {"status": "unchanged", "added": 0, "updated": 0, "removed": 0}
+        result = {"status": "not_modified", "added": 0, "updated": 0, "removed": 0}
+        if fetched is not None:
+            subscription.etag = fetched["etag"]
+            subscription.last_modified = fetched["last_modified"]
+            if fetched["content_hash"] == subscription.content_hash:
+                result["status"] = "unchanged"
+            else:
+                result.update(merge(db, playlist, fetched["channels"]))
+                result["status"] = "updated" if result["added"] or result["updated"] or result["removed"] \
+                    else "unchanged"
+                subscription.content_hash = fetched["content_hash"]
+        now = datetime.utcnow()
+        subscription.status = result["status"]
+        subscription.error = None
+        subscription.checked_at = now
+        if result["status"] == "updated":
+            subscription.changed_at = now
+        subscription.next_refresh_at = _next_refresh(subscription.interval)
+        db.commit()
+    logger.info(f"Подписка {playlist_id}: {result}")
+    return result
+
+
+def _finish(playlist_id: str, url: str, **values):
+    with write_session() as db:
+        subscription = db.get(Subscription, playlist_id)
+        if subscription is not None and subscription.url == url:
+            for key, value in values.items():
+                setattr(subscription, key, value)
+            subscription.checked_at = datetime.utcnow()
+            subscription.next_refresh_at = _next_refresh(subscription.interval)
+            db.commit()
+
+
+def claim_due(limit: int = _CLAIM_BATCH) -> list:
+    """Забирает подписки, которым пора обновиться: их время отодвигается, чтобы их не взял другой процесс"""
+    now = datetime.utcnow()
+    with write_session() as db:
+        due = [
+            subscription for subscription in db.query(Subscription)
+            .filter(Subscription.next_refresh_at <= now)
+            .order_by(Subscription.next_refresh_at)
+            .limit(limit)
+            .with_for_update(skip_locked=True)
+        ]
+        for subscription in due:
+            subscription.next_refresh_at = now + _CLAIM_LEASE
+        db.commit()
+        return [subscription.playlist_id for subscription in due]
+
+
+async def refresh_due() -> list:
+    """Обновляет подписки, которым пора, не больше SUBSCRIPTION_CONCURRENCY сразу; возвращает изменившиеся плейлисты"""
+    semaphore = asyncio.Semaphore(settings.SUBSCRIPTION_CONCURRENCY)
+
+    async def refresh_one(playlist_id: str):
+        async with semaphore:
+            try:
+                return (await run_in_threadpool(refresh, playlist_id))["status"] == "updated"
+            except Exception as e:
+                logger.error(f"Подписка {playlist_id}: {e}")
+                return False
+
+    playlist_ids = await run_in_threadpool(claim_due)
+    changed = await asyncio.gather(*(refresh_one(playlist_id) for playlist_id in playlist_ids))
+    return [playlist_id for playlist_id, updated in zip(playlist_ids, changed) if updated]
+
+
+def summary(subscription: Subscription) -> dict:
+    return {
+        "url": subscription.url,
+        "interval_hours": round(subscription.interval / 3600, 2),
+        "status": subscription.status,
+        "error": subscription.error,
+        "checked_at": subscription.checked_at.isoformat() if subscription.checked_at else None,
+        "changed_at": subscription.changed_at.isoformat() if subscription.changed_at else None,
+        "next_refresh_at": subscription.next_refresh_at.isoformat(),
+    }
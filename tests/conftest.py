@@ -0,0 +1,51 @@
+import os
+import tempfile
+
+import pytest
+
+# Приложение настраивается из окружения при импорте: база и каталоги — временные
+_tmp_dir = tempfile.mkdtemp(prefix="iptv-tests-")
+os.environ.update({
+    "DATABASE_URL": f"sqlite:///{os.path.join(_tmp_dir, 'test.db')}",
+    "DATABASE_REPLICA_URLS": "",
+    "PLAYLISTS_DIR": os.path.join(_tmp_dir, "uploads"),
+    "LOG_DIR": os.path.join(_tmp_dir, "logs"),
+    "ADMIN_USERNAME": "admin",
+    "ADMIN_PASSWORD": "admin",
+    "STATE_STORE": "memory",
+    "RATE_LIMIT_ENABLED": "False",
+})
+
+
+@pytest.fixture
+def client():
+    from fastapi.testclient import TestClient
+
+    import main
+
+    client = TestClient(main.app)
+    response = client.post("/login", data={"username": "admin", "password": "admin"}, follow_redirects=False)
+    assert response.status_code == 303
+    return client
+
+
+@pytest.fixture
+def make_playlist(client):
+    """Плейлист с каналами по именам; возвращает его id"""
+    def make(names) -> str:
+        response = client.post("/save", json={
+            "name": "test", "channels": [{"name": name, "url": f"http://x/{name}"} for name in names]
+        })
+        assert response.status_code == 200, response.text
+        return response.json()["url"][1:-4]
+    return make
+
+
+@pytest.fixture
+def list_channels(client):
+    """Каналы плейлиста по порядку, как их видит редактор"""
+    def list_(playlist_id: str) -> list:
+        response = client.get(f"/playlists/{playlist_id}/channels", params={"limit": 1000})
+        assert response.status_code == 200, response.text
+        return response.json()["channels"]
+    return list_
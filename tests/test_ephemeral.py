@@ -0,0 +1,22 @@
+from ephemeral import MemoryStore
+
+
+def test_memory_store_limits_each_namespace_separately():
+    store = MemoryStore(max_entries=3)
+    store.put("login", "alice", "1", ttl=60)
+    for i in range(10):
+        store.put("playlist", f"10.0.0.{i}", "1", ttl=60)
+
+    # Поток ключей одного namespace вытесняет только его собственные старые записи
+    assert store.get("login", "alice") == "1"
+    assert [store.get("playlist", f"10.0.0.{i}") for i in range(10)] == [None] * 7 + ["1"] * 3
+    assert len(store) == 4
+
+
+def test_memory_store_update_and_pop():
+    store = MemoryStore(max_entries=10)
+    assert store.update("n", "k", lambda value: ((value or "") + "x", value), ttl=60) is None
+    assert store.update("n", "k", lambda value: ((value or "") + "x", value), ttl=60) == "x"
+    assert store.pop("n", "k") == "xx"
+    assert store.pop("n", "k") is None
+    assert store.get("other", "k") is None
@@ -0,0 +1,30 @@
+from utils.generator import generate_m3u
+from utils.parser import parse_m3u
+
+# Всё, на чём str.splitlines() делит строку
+LINE_BREAKS = "\n\r\x0b\x0c\x1c\x1d\x1e\x85\u2028\u2029"
+
+
+def test_line_breaks_in_values_do_not_split_entries():
+    channels = [
+        {"name": f"A{char}B", "url": f"http://x/{ord(char)}{char}", "group_title": f"G{char}\"q\"",
+         "attrs": {"catchup": f"d{char}e"}}
+        for char in LINE_BREAKS
+    ]
+    text = generate_m3u(channels + [{"name": "Plain", "url": "http://x/plain"}], tvg_url=f"http://e{LINE_BREAKS}")
+    assert len(text.splitlines()) == 1 + 2 * (len(channels) + 1)
+
+    parsed = parse_m3u(text)
+    assert parsed["tvg_url"] == "http://e" + " " * len(LINE_BREAKS)
+    rows = parsed["channels"].to_dicts()
+    assert [row["name"] for row in rows] == ["A B"] * len(channels) + ["Plain"]
+    assert all(row["group_title"] == "G 'q'" and row["attrs"] == {"catchup": "d e"} for row in rows[:-1])
+
+
+def test_values_round_trip_unchanged():
+    channels = [{"name": "Канал, 1", "url": "http://x/1?a=b", "tvg_id": "id.1", "group_title": "Новости",
+                 "attrs": {"tvg-chno": "5"}}]
+    row = parse_m3u(generate_m3u(channels))["channels"].to_dicts()[0]
+    assert (row["name"], row["url"], row["tvg_id"], row["group_title"], row["attrs"]) == (
+        "Канал, 1", "http://x/1?a=b", "id.1", "Новости", {"tvg-chno": "5"}
+    )
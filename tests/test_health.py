@@ -0,0 +1,79 @@
+import asyncio
+import socket
+from datetime import datetime
+from functools import partial
+
+import httpx
+
+import health
+from database import ChannelHealth, HealthCheck, SessionLocal
+
+
+def _record_check(playlist_id: str, channels: list, statuses: dict):
+    """Результат проверки без сети: статус по имени канала"""
+    now = datetime.utcnow()
+    with SessionLocal() as db:
+        db.merge(HealthCheck(playlist_id=playlist_id, status="done", total=len(channels), checked=len(channels),
+                           started_at=now, updated_at=now))
+        for channel in channels:
+            # id удалённых в других тестах каналов SQLite выдаёт заново — их строки заменяются
+            db.merge(ChannelHealth(channel_id=channel["id"], playlist_id=playlist_id, url=channel["url"],
+                                   status=statuses[channel["name"]], checked_at=now))
+        db.commit()
+
+
+def test_remove_dead_keeps_timeouts_unless_asked(client, make_playlist, list_channels):
+    playlist_id = make_playlist(["ok", "dead", "slow"])
+    _record_check(playlist_id, list_channels(playlist_id), {"ok": "ok", "dead": "dead", "slow": "timeout"})
+
+    response = client.post(f"/playlists/{playlist_id}/health/remove-dead", json={})
+    assert response.status_code == 200, response.text
+    assert response.json()["removed"] == 1
+    assert [channel["name"] for channel in list_channels(playlist_id)] == ["ok", "slow"]
+
+    response = client.post(f"/playlists/{playlist_id}/health/remove-dead", json={"include_timeouts": True})
+    assert response.json()["removed"] == 1
+    assert [channel["name"] for channel in list_channels(playlist_id)] == ["ok"]
+
+
+def test_report_lists_timeouts_as_problems(client, make_playlist, list_channels):
+    playlist_id = make_playlist(["ok", "dead", "slow"])
+    _record_check(playlist_id, list_channels(playlist_id), {"ok": "ok", "dead": "dead", "slow": "timeout"})
+
+    report = client.get(f"/playlists/{playlist_id}/health").json()
+    assert sorted(problem["status"] for problem in report["problems"]) == ["dead", "timeout"]
+
+
+def test_internal_addresses_are_blocked_not_fetched(monkeypatch):
+    addresses = {"streams.example": "93.184.216.34", "internal.example": "10.0.0.5"}
+    requested = []
+
+    def getaddrinfo(host, port, *args, **kwargs):
+        address = addresses.get(host, host)
+        return [(socket.AF_INET6 if ":" in address else socket.AF_INET, socket.SOCK_STREAM, 6, "", (address, port))]
+
+    def handler(request):
+        requested.append(request.url.host)
+        if request.url.path == "/redirect":
+            return httpx.Response(302, headers={"location": "http://internal.example/live"})
+        return httpx.Response(200)
+
+    monkeypatch.setattr(socket, "getaddrinfo", getaddrinfo)
+    monkeypatch.setattr(httpx, "AsyncClient", partial(httpx.AsyncClient, transport=httpx.MockTransport(handler)))
+
+    async def check(urls) -> dict:
+        return {url: result["status"] async for url, result in health.check_urls(urls)}
+
+    statuses = asyncio.run(check([
+        "http://streams.example/live", "http://streams.example/redirect", "http://127.0.0.1:8024/metrics",
+        "http://169.254.169.254/latest/meta-data/", "http://[::1]/", "http://internal.example/live",
+    ]))
+    assert statuses == {
+        "http://streams.example/live": "ok",
+        "http://streams.example/redirect": "blocked",
+        "http://127.0.0.1:8024/metrics": "blocked",
+        "http://169.254.169.254/latest/meta-data/": "blocked",
+        "http://[::1]/": "blocked",
+        "http://internal.example/live": "blocked",
+    }
+    assert set(requested) == {"streams.example"}
@@ -0,0 +1,29 @@
+from utils.http_cache import encoded_etag, is_not_modified
+
+
+def test_each_encoding_gets_its_own_etag():
+    etag = '"abc123"'
+    tags = {encoded_etag(etag, encoding) for encoding in (None, "gzip", "br")}
+    assert tags == {'"abc123"', '"abc123-gz"', '"abc123-br"'}
+
+
+def test_if_none_match_accepts_any_encoding_of_the_same_text():
+    etag = '"abc123"'
+    for tag in ('"abc123"', '"abc123-gz"', 'W/"abc123-br"', '"other", "abc123-br"'):
+        assert is_not_modified(tag, None, etag, None)
+    assert not is_not_modified('"abc124-gz"', None, etag, None)
+    assert not is_not_modified('"abc123-xz"', None, etag, None)
+
+
+def test_served_etag_depends_on_encoding(client, make_playlist):
+    playlist_id = make_playlist([f"C{i}" for i in range(50)])
+    plain = client.get(f"/{playlist_id}.m3u", headers={"accept-encoding": "identity"})
+    gzipped = client.get(f"/{playlist_id}.m3u", headers={"accept-encoding": "gzip"})
+    assert gzipped.headers["content-encoding"] == "gzip"
+    assert plain.headers["etag"] != gzipped.headers["etag"]
+
+    # Клиент, сменивший Accept-Encoding, всё равно получает 304 — с ETag новой версии
+    revalidated = client.get(f"/{playlist_id}.m3u",
+                             headers={"accept-encoding": "gzip", "if-none-match": plain.headers["etag"]})
+    assert revalidated.status_code == 304
+    assert revalidated.headers["etag"] == gzipped.headers["etag"]
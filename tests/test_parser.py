@@ -0,0 +1,38 @@
+import time
+
+from utils.parser import parse_attributes, parse_extinf
+
+# Строки, на которых разбор с откатами тратил экспоненциальное или квадратичное время
+ADVERSARIAL = [
+    "#EXTINF:-1 " + "a=a" * 18 + " x",
+    "#EXTINF:-1 " + "a=a" * 100000 + " x",
+    "#EXTINF:" + " \t" * 20000 + "a=b x",
+    "#EXTINF:-1 " + "a" * 40000,
+    '#EXTINF:-1 ' + 'a="' * 50000,
+]
+
+
+def test_adversarial_lines_parse_in_linear_time():
+    for line in ADVERSARIAL:
+        started = time.perf_counter()
+        parse_extinf(line)
+        assert time.perf_counter() - started < 0.5, line[:40]
+
+
+def test_extinf_attributes_and_name():
+    attrs, name = parse_extinf('#EXTINF:-1 tvg-id="a" tvg-logo=http://x/a.png group-title="G, x",Name, y')
+    assert attrs == {"tvg-id": "a", "tvg-logo": "http://x/a.png", "group-title": "G, x"}
+    assert name == "Name, y"
+
+
+def test_extinf_without_attributes():
+    assert parse_extinf("#EXTINF:0,Plain") == ({}, "Plain")
+    assert parse_extinf("#EXTINF:-1,") == ({}, "Unknown")
+
+
+def test_bare_value_with_equals_sign():
+    assert parse_extinf("#EXTINF:-1 url=http://x/?a=b,N") == ({"url": "http://x/?a=b"}, "N")
+
+
+def test_attributes_are_matched_from_word_start():
+    assert parse_attributes('#EXTM3U url-tvg="http://e" xurl-tvg') == {"url-tvg": "http://e"}
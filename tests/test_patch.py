@@ -0,0 +1,118 @@
+def patch(client, playlist_id, ops, base_version=None):
+    return client.patch(f"/playlists/{playlist_id}", json={"base_version": base_version, "ops": ops})
+
+
+def names(channels) -> list:
+    return [channel["name"] for channel in channels]
+
+
+def test_refs_resolve_across_ops(client, make_playlist, list_channels):
+    playlist_id = make_playlist(["A", "B"])
+    response = patch(client, playlist_id, [
+        {"op": "insert", "index": 0, "channels": [{"name": "N1", "url": "http://n1", "ref": "r1"},
+                                                   {"name": "N2", "url": "http://n2", "ref": "r2"}]},
+        {"op": "update", "ref": "r1", "fields": {"name": "N1 renamed"}},
+        {"op": "move", "ref": "r2", "index": 10},
+        {"op": "delete", "refs": ["r1"]},
+    ])
+    assert response.status_code == 200, response.text
+    refs = response.json()["refs"]
+    assert set(refs) == {"r1", "r2"}
+    channels = list_channels(playlist_id)
+    assert names(channels) == ["A", "B", "N2"]
+    assert channels[-1]["id"] == refs["r2"]
+
+
+def test_unknown_ref_is_rejected_and_rolled_back(client, make_playlist, list_channels):
+    playlist_id = make_playlist(["A", "B"])
+    response = patch(client, playlist_id, [
+        {"op": "delete", "refs": []},
+        {"op": "insert", "channels": [{"name": "N", "url": "http://n"}]},
+        {"op": "update", "ref": "missing", "fields": {"name": "X"}},
+    ])
+    assert response.status_code == 400
+    assert names(list_channels(playlist_id)) == ["A", "B"]
+
+
+def test_index_positions_and_out_of_range(client, make_playlist, list_channels):
+    playlist_id = make_playlist(["A", "B", "C"])
+    response = patch(client, playlist_id, [
+        {"op": "insert", "index": 1, "channels": [{"name": "AB", "url": "http://ab"}]},
+        {"op": "insert", "index": 100, "channels": [{"name": "END", "url": "http://end"}]},
+        {"op": "insert", "index": -5, "channels": [{"name": "NEG", "url": "http://neg"}]},
+    ])
+    assert response.status_code == 200, response.text
+    assert names(list_channels(playlist_id)) == ["A", "AB", "B", "C", "END", "NEG"]
+
+    channels = list_channels(playlist_id)
+    response = patch(client, playlist_id, [
+        {"op": "move", "id": channels[0]["id"], "index": 2},
+        {"op": "move", "id": channels[5]["id"], "index": 0},
+        {"op": "move", "id": channels[1]["id"], "index": 999},
+    ])
+    assert response.status_code == 200, response.text
+    assert names(list_channels(playlist_id)) == ["NEG", "B", "A", "C", "END", "AB"]
+
+
+def test_delete_unknown_id_is_ignored(client, make_playlist, list_channels):
+    playlist_id = make_playlist(["A", "B"])
+    other_id = make_playlist(["O"])
+    foreign = list_channels(other_id)[0]["id"]
+    channels = list_channels(playlist_id)
+    response = patch(client, playlist_id, [{"op": "delete", "ids": [channels[0]["id"], 10 ** 9, foreign]}])
+    assert response.status_code == 200, response.text
+    assert names(list_channels(playlist_id)) == ["B"]
+    # Канал чужого плейлиста не удаляется, даже если передан его id
+    assert names(list_channels(other_id)) == ["O"]
+
+
+def test_move_or_update_unknown_id_is_rejected(client, make_playlist, list_channels):
+    playlist_id = make_playlist(["A", "B"])
+    assert patch(client, playlist_id, [{"op": "move", "id": 10 ** 9, "index": 0}]).status_code == 400
+    assert patch(client, playlist_id, [{"op": "update", "id": 10 ** 9, "fields": {"name": "X"}}]).status_code == 400
+    assert patch(client, playlist_id, [{"op": "update", "fields": {"name": "X"}}]).status_code == 400
+    assert names(list_channels(playlist_id)) == ["A", "B"]
+
+
+def test_rename_group_and_set(client, make_playlist, list_channels):
+    playlist_id = make_playlist(["A", "B"])
+    channels = list_channels(playlist_id)
+    response = patch(client, playlist_id, [
+        {"op": "update", "id": channels[0]["id"], "fields": {"group_title": "News"}},
+        {"op": "rename_group", "group_from": "News", "group_to": "Новости"},
+        {"op": "set", "fields": {"name": "Renamed", "tvg_url": "http://epg"}},
+    ])
+    assert response.status_code == 200, response.text
+    assert [channel["group_title"] for channel in list_channels(playlist_id)] == ["Новости", None]
+    text = client.get(f"/{playlist_id}.m3u").text
+    assert text.startswith('#EXTM3U url-tvg="http://epg"')
+
+
+def test_stale_base_version_conflicts(client, make_playlist, list_channels):
+    playlist_id = make_playlist(["A", "B"])
+    version = patch(client, playlist_id, []).json()["version"]
+    channel_id = list_channels(playlist_id)[0]["id"]
+
+    response = patch(client, playlist_id, [{"op": "update", "id": channel_id, "fields": {"name": "First"}}], version)
+    assert response.status_code == 200, response.text
+    assert response.json()["version"] == version + 1
+
+    # Второе окно правило от той же версии — его правка не должна затереть первую
+    response = patch(client, playlist_id, [{"op": "update", "id": channel_id, "fields": {"name": "Second"}}], version)
+    assert response.status_code == 409
+    assert names(list_channels(playlist_id)) == ["First", "B"]
+
+
+def test_etag_changes_after_patch(client, make_playlist, list_channels):
+    playlist_id = make_playlist(["A", "B"])
+    before = client.get(f"/{playlist_id}.m3u")
+    etag = before.headers["etag"]
+    assert client.get(f"/{playlist_id}.m3u", headers={"if-none-match": etag}).status_code == 304
+
+    channel_id = list_channels(playlist_id)[1]["id"]
+    assert patch(client, playlist_id, [{"op": "update", "id": channel_id, "fields": {"name": "Changed"}}]).status_code == 200
+
+    after = client.get(f"/{playlist_id}.m3u", headers={"if-none-match": etag})
+    assert after.status_code == 200
+    assert after.headers["etag"] != etag
+    assert "Changed" in after.text and "Changed" not in before.text
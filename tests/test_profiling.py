@@ -0,0 +1,49 @@
+import threading
+
+import profiling
+
+
+def _busy():
+    return sum(i * i for i in range(20000))
+
+
+def test_overlapping_cprofile_captures_fall_back_to_sampling():
+    captures = [profiling.Capture("/r", "GET", "/r", "cprofile") for _ in range(2)]
+    inside = threading.Barrier(2, timeout=10)
+    errors = []
+
+    def run(capture):
+        try:
+            with profiling._profiler(capture):
+                inside.wait()  # Обе записи идут одновременно
+                _busy()
+                inside.wait()
+        except Exception as e:
+            errors.append(e)
+
+    threads = [threading.Thread(target=run, args=(capture,)) for capture in captures]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+
+    assert errors == []
+    assert sorted(capture.mode for capture in captures) == ["cprofile", "sample"]
+    assert all(capture.profile is not None for capture in captures)
+    # Блокировка отпущена: следующая запись снова получает cProfile
+    capture = profiling.Capture("/r", "GET", "/r", "cprofile")
+    with profiling._profiler(capture):
+        _busy()
+    assert capture.mode == "cprofile"
+
+
+def test_cprofile_taken_by_another_tool_falls_back_to_sampling(monkeypatch):
+    def enable(self, *args, **kwargs):
+        raise ValueError("Another profiling tool is already active")
+
+    monkeypatch.setattr(profiling.cProfile.Profile, "enable", enable)
+    capture = profiling.Capture("/r", "GET", "/r", "cprofile")
+    with profiling._profiler(capture):
+        _busy()
+    assert capture.mode == "sample"
+    assert not profiling._cprofile_lock.locked()
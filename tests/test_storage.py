@@ -0,0 +1,21 @@
+from database import Playlist, PlaylistBlob, SessionLocal
+
+
+def test_missing_blob_row_is_rerendered_from_channels(client, make_playlist):
+    import main
+
+    playlist_id = make_playlist(["A", "B"])
+    before = client.get(f"/{playlist_id}.m3u", headers={"accept-encoding": "identity"})
+    assert before.status_code == 200
+    # Строку блоба удалили (чистка по счётчику ссылок, сбой записи), а плейлист на неё ссылается
+    with SessionLocal() as db:
+        content_hash = db.get(Playlist, playlist_id).content_hash
+        db.query(PlaylistBlob).filter(PlaylistBlob.hash == content_hash).delete()
+        db.commit()
+    main.playlist_cache.invalidate(playlist_id)
+
+    after = client.get(f"/{playlist_id}.m3u", headers={"accept-encoding": "identity"})
+    assert after.status_code == 200
+    assert after.text == before.text
+    with SessionLocal() as db:
+        assert db.get(PlaylistBlob, db.get(Playlist, playlist_id).content_hash) is not None
@@ -0,0 +1,151 @@
+import hashlib
+import socket
+from functools import partial
+
+import httpx
+import pytest
+
+import subscriptions
+from config import settings
+from database import Playlist, write_session
+from utils.parser import M3UParser
+
+SOURCE_URL = "http://source.example/list.m3u"
+
+
+def names(channels) -> list:
+    return [channel["name"] for channel in channels]
+
+
+def fetched(*channels) -> dict:
+    """Ответ fetch() для источника из словарей каналов"""
+    text = "#EXTM3U\n" + "".join(
+        f'#EXTINF:-1 group-title="{channel.get("group", "")}",{channel["name"]}\n{channel["url"]}\n'
+        for channel in channels
+    )
+    parser = M3UParser()
+    parser.feed(text)
+    return {"channels": parser.close(), "etag": None, "last_modified": None,
+            "content_hash": hashlib.sha256(text.encode()).hexdigest()}
+
+
+@pytest.fixture
+def subscribed(make_playlist):
+    """Пустой плейлист, подписанный на SOURCE_URL; возвращает его id"""
+    playlist_id = make_playlist([])
+    with write_session() as db:
+        subscriptions.subscribe(db, db.get(Playlist, playlist_id), SOURCE_URL, 3600)
+        db.commit()
+    return playlist_id
+
+
+def edit(client, playlist_id, ops):
+    response = client.patch(f"/playlists/{playlist_id}", json={"ops": ops})
+    assert response.status_code == 200, response.text
+
+
+def test_local_edit_survives_upstream_change(client, subscribed, list_channels):
+    subscriptions.refresh(subscribed, fetched(
+        {"name": "A", "url": "http://s/a1", "group": "G1"}, {"name": "B", "url": "http://s/b1", "group": "G1"}
+    ))
+    a = list_channels(subscribed)[0]
+    edit(client, subscribed, [{"op": "update", "id": a["id"], "fields": {"url": "http://mine/a"}}])
+
+    result = subscriptions.refresh(subscribed, fetched(
+        {"name": "A", "url": "http://s/a2", "group": "G2"}, {"name": "B", "url": "http://s/b2", "group": "G1"}
+    ))
+    assert result == {"status": "updated", "added": 0, "updated": 2, "removed": 0}
+    channels = list_channels(subscribed)
+    # Поле, изменённое пользователем, остаётся; остальные берутся из источника
+    assert [(c["name"], c["url"], c["group_title"]) for c in channels] == [
+        ("A", "http://mine/a", "G2"), ("B", "http://s/b2", "G1")
+    ]
+
+
+def test_upstream_delete_keeps_locally_edited_channel(client, subscribed, list_channels):
+    subscriptions.refresh(subscribed, fetched(
+        {"name": "A", "url": "http://s/a"}, {"name": "B", "url": "http://s/b"}, {"name": "C", "url": "http://s/c"}
+    ))
+    b = list_channels(subscribed)[1]
+    edit(client, subscribed, [{"op": "update", "id": b["id"], "fields": {"group_title": "Любимые"}}])
+
+    result = subscriptions.refresh(subscribed, fetched({"name": "A", "url": "http://s/a"}))
+    assert result["removed"] == 1
+    assert names(list_channels(subscribed)) == ["A", "B"]
+
+    # Удалённый пользователем канал не возвращается, даже если источник его изменил
+    edit(client, subscribed, [{"op": "delete", "ids": [list_channels(subscribed)[0]["id"]]}])
+    subscriptions.refresh(subscribed, fetched({"name": "A", "url": "http://s/a2"}))
+    assert names(list_channels(subscribed)) == ["B"]
+
+
+def test_reorders(client, subscribed, list_channels):
+    subscriptions.refresh(subscribed, fetched(
+        {"name": "A", "url": "http://s/a"}, {"name": "B", "url": "http://s/b"}, {"name": "C", "url": "http://s/c"}
+    ))
+    # Порядок источника не переносится: плейлист упорядочивает пользователь
+    result = subscriptions.refresh(subscribed, fetched(
+        {"name": "C", "url": "http://s/c"}, {"name": "A", "url": "http://s/a"}, {"name": "B", "url": "http://s/b"}
+    ))
+    assert result == {"status": "unchanged", "added": 0, "updated": 0, "removed": 0}
+    assert names(list_channels(subscribed)) == ["A", "B", "C"]
+
+    c = list_channels(subscribed)[2]
+    edit(client, subscribed, [{"op": "move", "id": c["id"], "index": 0}])
+    subscriptions.refresh(subscribed, fetched(
+        {"name": "B", "url": "http://s/b2"}, {"name": "D", "url": "http://s/d"},
+        {"name": "C", "url": "http://s/c"}, {"name": "A", "url": "http://s/a"}
+    ))
+    channels = list_channels(subscribed)
+    assert names(channels) == ["C", "A", "B", "D"]
+    assert channels[2]["url"] == "http://s/b2"
+
+
+@pytest.mark.parametrize("url", [
+    "http://127.0.0.1/list.m3u",
+    "http://10.1.2.3/list.m3u",
+    "http://169.254.169.254/latest/meta-data/",
+    "http://0.0.0.0:8000/",
+    "http://[::1]/list.m3u",
+    "http://[::ffff:127.0.0.1]/list.m3u",
+])
+def test_fetch_rejects_internal_addresses(url):
+    with pytest.raises(ValueError, match="внутренней сети"):
+        subscriptions.fetch(url)
+
+
+@pytest.fixture
+def fake_network(monkeypatch):
+    """Имена source.example (публичный адрес) и internal.example (внутренний); запрошенные URL"""
+    addresses = {"source.example": "93.184.216.34", "internal.example": "10.0.0.5"}
+    requested = []
+
+    def getaddrinfo(host, port, *args, **kwargs):
+        if host not in addresses:
+            raise socket.gaierror(host)
+        return [(socket.AF_INET, socket.SOCK_STREAM, 6, "", (addresses[host], port))]
+
+    def handler(request):
+        requested.append(str(request.url))
+        if request.url.path == "/redirect":
+            return httpx.Response(302, headers={"location": request.url.params["to"]})
+        return httpx.Response(200, text="#EXTM3U\n#EXTINF:-1,A\nhttp://s/a\n")
+
+    monkeypatch.setattr(socket, "getaddrinfo", getaddrinfo)
+    monkeypatch.setattr(httpx, "Client", partial(httpx.Client, transport=httpx.MockTransport(handler)))
+    return requested
+
+
+def test_fetch_checks_every_redirect(fake_network):
+    assert len(subscriptions.fetch(SOURCE_URL)["channels"]) == 1
+
+    with pytest.raises(ValueError, match="внутренней сети"):
+        subscriptions.fetch("http://source.example/redirect?to=http://internal.example/list.m3u")
+    with pytest.raises(ValueError, match="http"):
+        subscriptions.fetch("http://source.example/redirect?to=file:///etc/passwd")
+    assert {httpx.URL(url).host for url in fake_network} == {"source.example"}
+
+
+def test_fetch_allows_internal_addresses_when_configured(fake_network, monkeypatch):
+    monkeypatch.setattr(settings, "SUBSCRIPTION_ALLOW_PRIVATE", True)
+    assert len(subscriptions.fetch("http://internal.example/list.m3u")["channels"]) == 1
@@ -0,0 +1,25 @@
+import asyncio
+
+import httpx
+from anyio import to_thread
+
+
+async def _save_concurrently(app, count: int, threads: int) -> list:
+    # Пул потоков меньше числа одновременных записей: ждущие очереди на запись
+    # не должны занять все потоки, пока её держит другой запрос
+    to_thread.current_default_thread_limiter().total_tokens = threads
+    async with httpx.AsyncClient(transport=httpx.ASGITransport(app=app), base_url="http://test") as client:
+        response = await client.post("/login", data={"username": "admin", "password": "admin"})
+        assert response.status_code == 303
+        requests = [
+            client.post("/save", json={"name": f"w{i}", "channels": [{"name": "A", "url": "http://a"}]})
+            for i in range(count)
+        ]
+        responses = await asyncio.wait_for(asyncio.gather(*requests), timeout=30)
+    return [response.status_code for response in responses]
+
+
+def test_more_concurrent_writes_than_threads():
+    import main
+
+    assert asyncio.run(_save_concurrently(main.app, count=24, threads=4)) == [200] * 24
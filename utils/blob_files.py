@@ -0,0 +1,92 @@
+"""
+Тексты плейлистов файлами в PLAYLISTS_DIR (PLAYLIST_STORAGE=files): отдача
+читает их с диска через FileResponse, не поднимая ни в базу, ни в память
+процесса. У блоба три файла: <хэш[:2]>/<хэш>.m3u и сжатые .m3u.gz и .m3u.br.
+
+Файлы пишутся до фиксации строки playlist_blobs и не удаляются вместе с ней:
+лишние файлы без строки убирает sweep, когда они старше SWEEP_GRACE.
+"""
+import os
+import re
+import tempfile
+import time
+from typing import Optional
+
+from config import settings
+
+# Расширение файла для каждой версии текста ("" — без сжатия)
+SUFFIXES = {"": ".m3u", "gzip": ".m3u.gz", "br": ".m3u.br"}
+
+# Файл моложе этого может принадлежать блобу, строка которого ещё не зафиксирована
+SWEEP_GRACE = 600
+SWEEP_INTERVAL = 3600
+
+_DIR_RE = re.compile(r"^[0-9a-f]{2}$")
+_FILE_RE = re.compile(r"^([0-9a-f]{64})\.m3u(\.gz|\.br)?$")
+
+
+def path(content_hash: str, encoding: str = "") -> str:
+    return os.path.join(settings.PLAYLISTS_DIR, content_hash[:2], content_hash + SUFFIXES[encoding])
+
+
+def write(content_hash: str, renditions: dict):
+    """
+    Записывает версии текста {кодировка: байты}. Каждая пишется во временный
+    файл и подменяет старую целиком, так что читатель не видит недописанный файл
+    """
+    directory = os.path.dirname(path(content_hash))
+    os.makedirs(directory, exist_ok=True)
+    for encoding, data in renditions.items():
+        if data is None:
+            continue
+        fd, tmp = tempfile.mkstemp(dir=directory, suffix=".tmp")
+        try:
+            with os.fdopen(fd, "wb") as f:
+                f.write(data)
+                f.flush()
+                os.fsync(f.fileno())
+            os.replace(tmp, path(content_hash, encoding))
+        except BaseException:
+            os.remove(tmp)
+            raise
+
+
+def paths(content_hash: str) -> Optional[dict]:
+    """Пути к версиям текста {кодировка: путь}; None — файлы пропали"""
+    found = {encoding: path(content_hash, encoding) for encoding in SUFFIXES}
+    found = {encoding: p for encoding, p in found.items() if os.path.exists(p)}
+    if "" not in found or "gzip" not in found:
+        return None
+    return found
+
+
+def read_text(content_hash: str) -> str:
+    with open(path(content_hash), encoding="utf-8", newline="") as f:
+        return f.read()
+
+
+def sweep(known: set) -> int:
+    """Удаляет файлы блобов не из known и брошенные временные файлы старше SWEEP_GRACE"""
+    if not os.path.isdir(settings.PLAYLISTS_DIR):
+        return 0
+    deadline = time.time() - SWEEP_GRACE
+    removed = 0
+    # Смотрим только каталоги блобов: в PLAYLISTS_DIR могут лежать и чужие файлы
+    for prefix in os.listdir(settings.PLAYLISTS_DIR):
+        directory = os.path.join(settings.PLAYLISTS_DIR, prefix)
+        if not _DIR_RE.match(prefix) or not os.path.isdir(directory):
+            continue
+        for name in os.listdir(directory):
+            match = _FILE_RE.match(name)
+            if match is None and not name.endswith(".tmp"):
+                continue
+            if match is not None and match.group(1) in known:
+                continue
+            full = os.path.join(directory, name)
+            try:
+                if os.path.getmtime(full) < deadline:
+                    os.remove(full)
+                    removed += 1
+            except FileNotFoundError:
+                pass  # Тот же файл убрал соседний процесс
+    return removed
@@ -0,0 +1,154 @@
+import threading
+import time
+from collections import OrderedDict
+from dataclasses import dataclass, field
+from datetime import datetime
+from typing import Optional
+
+
+@dataclass
+class CachedPlaylist:
+    """
+    Всё, что нужно для отдачи плейлиста без обращения к базе: сами байты или,
+    если текст хранится файлами (PLAYLIST_STORAGE=files), пути к ним
+    """
+    body: Optional[bytes]
+    body_gz: Optional[bytes]
+    body_br: Optional[bytes]
+    etag: str
+    last_modified: Optional[datetime]
+    is_shared: bool
+    files: Optional[dict] = None  # Кодировка ("", "gzip", "br") -> путь к файлу
+    checked_at: float = field(default_factory=time.monotonic)  # Когда запись последний раз сверяли с базой
+
+    @property
+    def size(self) -> int:
+        return len(self.body or b"") + len(self.body_gz or b"") + len(self.body_br or b"")
+
+    @property
+    def encodings(self) -> tuple:
+        """Сжатые версии, которые есть у записи, в порядке предпочтения"""
+        has_br = self.body_br is not None if self.files is None else "br" in self.files
+        return ("br", "gzip") if has_br else ("gzip",)
+
+
+class PlaylistCache:
+    """
+    Потокобезопасный LRU-кэш отрендеренных плейлистов с ограничением
+    и по числу записей, и по суммарному размеру в байтах.
+    Записи с одинаковым ETag (один и тот же текст у разных плейлистов) делят
+    одни и те же байты, и в размере кэша они учитываются один раз.
+    Запись старше ttl секунд нужно сверить с базой (см. expired): плейлист мог
+    изменить другой процесс, чьи инвалидации сюда не доходят. ttl=0 — не сверять.
+    """
+
+    def __init__(self, max_entries: int, max_bytes: int, ttl: float = 0):
+        self.max_entries = max_entries
+        self.max_bytes = max_bytes
+        self.ttl = ttl
+        self._entries = OrderedDict()
+        self._bodies = {}  # ETag -> [запись, чьи байты общие, сколько записей на них ссылается]
+        self._bytes = 0
+        self._lock = threading.Lock()
+        # Счётчик инвалидаций: загрузка, начатая до инвалидации, не должна
+        # положить в кэш уже устаревшие данные
+        self._generation = 0
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+        self.invalidations = 0
+        self.revalidations = 0
+
+    def get(self, key: str) -> Optional[CachedPlaylist]:
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is None:
+                self.misses += 1
+                return None
+            self._entries.move_to_end(key)
+            self.hits += 1
+            return entry
+
+    def expired(self, entry: CachedPlaylist) -> bool:
+        return self.ttl > 0 and time.monotonic() - entry.checked_at >= self.ttl
+
+    def revalidated(self, entry: CachedPlaylist):
+        """Запись сверена с базой и всё ещё актуальна"""
+        entry.checked_at = time.monotonic()
+        with self._lock:
+            self.revalidations += 1
+
+    def find_body(self, etag: str) -> Optional[CachedPlaylist]:
+        """Запись с таким же текстом, если он уже в кэше — её байты можно не читать из базы"""
+        with self._lock:
+            shared = self._bodies.get(etag)
+            return shared[0] if shared else None
+
+    @property
+    def generation(self) -> int:
+        return self._generation
+
+    def put(self, key: str, entry: CachedPlaylist, generation: int = None):
+        """Кладёт запись; generation — значение self.generation до начала загрузки"""
+        size = entry.size
+        if size > self.max_bytes:
+            return
+        with self._lock:
+            if generation is not None and generation != self._generation:
+                return
+            old = self._entries.pop(key, None)
+            if old is not None:
+                self._release(old)
+            shared = self._bodies.get(entry.etag)
+            if shared is None:
+                self._bodies[entry.etag] = [entry, 1]
+                self._bytes += size
+            else:
+                owner = shared[0]
+                entry.body, entry.body_gz, entry.body_br, entry.files = owner.body, owner.body_gz, owner.body_br, owner.files
+                shared[1] += 1
+            self._entries[key] = entry
+            while len(self._entries) > self.max_entries or self._bytes > self.max_bytes:
+                _, evicted = self._entries.popitem(last=False)
+                self._release(evicted)
+                self.evictions += 1
+
+    def _release(self, entry: CachedPlaylist):
+        """Запись убрана из кэша; байты освобождаются вместе с последней записью с этим ETag"""
+        shared = self._bodies[entry.etag]
+        shared[1] -= 1
+        if not shared[1]:
+            del self._bodies[entry.etag]
+            self._bytes -= entry.size
+
+    def invalidate(self, key: str):
+        with self._lock:
+            self._generation += 1
+            self.invalidations += 1
+            entry = self._entries.pop(key, None)
+            if entry is not None:
+                self._release(entry)
+
+    def clear(self):
+        with self._lock:
+            self._generation += 1
+            self._entries.clear()
+            self._bodies.clear()
+            self._bytes = 0
+
+    def stats(self) -> dict:
+        with self._lock:
+            lookups = self.hits + self.misses
+            return {
+                "entries": len(self._entries),
+                "bodies": len(self._bodies),
+                "bytes": self._bytes,
+                "max_entries": self.max_entries,
+                "max_bytes": self.max_bytes,
+                "hits": self.hits,
+                "misses": self.misses,
+                "hit_rate": round(self.hits / lookups, 4) if lookups else 0.0,
+                "evictions": self.evictions,
+                "invalidations": self.invalidations,
+                "revalidations": self.revalidations,
+            }
@@ -0,0 +1,287 @@
+"""
+Компактный список каналов: ChannelTable хранит каналы по столбцам, а не
+словарём на каждый канал, и не тратит по объекту на каждое значение.
+
+- имя, tvg-id, tvg-name и URL — склеенными строками по _CHUNK значений и
+  массивом смещений их концов;
+- группы, логотипы и прочие атрибуты (JSON) повторяются — каждое значение
+  хранится один раз, у канала только его номер;
+- tvg_url один на всю таблицу.
+
+Канал читается через ChannelRow: представление строки таблицы, которое
+отвечает на get() и [] как словарь канала, поэтому его принимают функции,
+работающие со словарями. pydantic-модели из models.py нужны только на
+границе API.
+"""
+import json
+from array import array
+from itertools import repeat
+from json.encoder import encode_basestring
+
+# Поля канала в порядке, в котором они идут в словаре и в JSON
+FIELDS = ("name", "tvg_id", "tvg_name", "tvg_logo", "group_title", "url")
+
+# Сколько значений текстового столбца склеивается в одну строку
+_CHUNK = 1024
+
+# Сколько разных наборов атрибутов запоминать при разборе, чтобы не кодировать их в JSON заново
+_ATTRS_MEMO_SIZE = 1024
+
+
+class _TextColumn:
+    """
+    Значения столбца, склеенные по _CHUNK штук в одну строку, и массив
+    смещений их концов внутри своей строки; None отмечается отдельным байтом
+    """
+    __slots__ = ("chunks", "ends", "nulls", "_parts", "_size")
+
+    def __init__(self):
+        self.chunks = []
+        self.ends = array("I")
+        self.nulls = bytearray()
+        self._parts = []  # Значения недособранного последнего куска
+        self._size = 0
+
+    def append(self, value):
+        if value is None:
+            self.nulls.append(1)
+        else:
+            self.nulls.append(0)
+            self._parts.append(value)
+            self._size += len(value)
+        self.ends.append(self._size)
+        if len(self.ends) % _CHUNK == 0:
+            self.chunks.append("".join(self._parts))
+            self._parts = []
+            self._size = 0
+
+    def _chunk(self, number: int) -> str:
+        return self.chunks[number] if number < len(self.chunks) else "".join(self._parts)
+
+    def __getitem__(self, index: int):
+        if self.nulls[index]:
+            return None
+        start = self.ends[index - 1] if index % _CHUNK else 0
+        return self._chunk(index // _CHUNK)[start:self.ends[index]]
+
+    def __iter__(self):
+        ends, nulls = self.ends, self.nulls
+        for first in range(0, len(ends), _CHUNK):
+            chunk = self._chunk(first // _CHUNK)
+            start = 0
+            for end, null in zip(ends[first:first + _CHUNK], nulls[first:first + _CHUNK]):
+                yield None if null else chunk[start:end]
+                start = end
+
+
+class _InternColumn:
+    """Повторяющиеся значения: каждое хранится один раз, у строки — его номер"""
+    __slots__ = ("values", "codes", "_index")
+
+    def __init__(self):
+        self.values = [None]
+        self.codes = array("I")
+        self._index = {None: 0}
+
+    def append(self, value):
+        code = self._index.get(value)
+        if code is None:
+            code = self._index[value] = len(self.values)
+            self.values.append(value)
+        self.codes.append(code)
+
+    def __getitem__(self, index: int):
+        return self.values[self.codes[index]]
+
+    def __iter__(self):
+        return map(self.values.__getitem__, self.codes)
+
+
+class ChannelTable:
+    """
+    Каналы плейлиста по столбцам. ids — id строк таблицы channels, если
+    каналы загружены из базы. Итерация отдаёт ChannelRow, tuples() — кортежи
+    значений полей FIELDS и словаря атрибутов
+    """
+    __slots__ = ("tvg_url", "ids", "_name", "_tvg_id", "_tvg_name", "_tvg_logo", "_group_title", "_url",
+                 "_attrs", "_attrs_memo")
+
+    def __init__(self, tvg_url: str = None, with_ids: bool = False):
+        self.tvg_url = tvg_url
+        self.ids = array("q") if with_ids else None
+        self._name = _TextColumn()
+        self._tvg_id = _TextColumn()
+        self._tvg_name = _TextColumn()
+        self._tvg_logo = _InternColumn()
+        self._group_title = _InternColumn()
+        self._url = _TextColumn()
+        self._attrs = _InternColumn()  # JSON прочих атрибутов; None — их нет
+        self._attrs_memo = {}
+
+    def append(self, name: str, tvg_id, tvg_name, tvg_logo, group_title, url: str, attrs: dict = None):
+        self._name.append(name)
+        self._tvg_id.append(tvg_id)
+        self._tvg_name.append(tvg_name)
+        self._tvg_logo.append(tvg_logo)
+        self._group_title.append(group_title)
+        self._url.append(url)
+        self._attrs.append(self._attrs_json(attrs) if attrs else None)
+
+    def append_row(self, row):
+        """Строка из базы: (id, поля FIELDS, attrs в JSON)"""
+        channel_id, name, tvg_id, tvg_name, tvg_logo, group_title, url, attrs = row
+        self.ids.append(channel_id)
+        self._name.append(name)
+        self._tvg_id.append(tvg_id)
+        self._tvg_name.append(tvg_name)
+        self._tvg_logo.append(tvg_logo)
+        self._group_title.append(group_title)
+        self._url.append(url)
+        self._attrs.append(attrs or None)
+
+    def _attrs_json(self, attrs: dict) -> str:
+        # Наборы вроде catchup="default" повторяются у тысяч каналов — кодируем их один раз
+        key = tuple(attrs.items())
+        text = self._attrs_memo.get(key)
+        if text is None:
+            text = json.dumps(attrs, ensure_ascii=False, separators=(",", ":"))
+            if len(self._attrs_memo) < _ATTRS_MEMO_SIZE:
+                self._attrs_memo[key] = text
+        return text
+
+    def __len__(self) -> int:
+        return len(self._name.ends)
+
+    def __getitem__(self, index: int) -> "ChannelRow":
+        if index < 0:
+            index += len(self)
+        if not 0 <= index < len(self):
+            raise IndexError(index)
+        return ChannelRow(self, index)
+
+    def __iter__(self):
+        return (ChannelRow(self, index) for index in range(len(self)))
+
+    def tuples(self):
+        """
+        (name, tvg_id, tvg_name, tvg_logo, group_title, url, attrs) по порядку.
+        attrs — словарь или None; одинаковые наборы атрибутов разбираются один
+        раз и отдаются одним и тем же словарём, менять его нельзя
+        """
+        decoded = [json.loads(text) if text else None for text in self._attrs.values]
+        attrs = map(decoded.__getitem__, self._attrs.codes)
+        return zip(self._name, self._tvg_id, self._tvg_name, self._tvg_logo, self._group_title, self._url, attrs)
+
+    def group_titles(self):
+        return iter(self._group_title)
+
+    def json_items(self):
+        """
+        Каждый канал в JSON, как его закодировал бы JSONResponse: словарь из
+        to_dicts() без пробелов. Повторяющиеся значения кодируются по разу,
+        attrs уже хранятся в JSON
+        """
+        tvg_url = _json_string(self.tvg_url)
+        prefixes = (f'{{"id":{channel_id},' for channel_id in self.ids) if self.ids is not None else repeat("{")
+        rows = zip(
+            prefixes, map(_json_string, self._name), map(_json_string, self._tvg_id),
+            map(_json_string, self._tvg_name), _json_interned(self._tvg_logo), _json_interned(self._group_title),
+            map(_json_string, self._url), self._attrs
+        )
+        for prefix, name, tvg_id, tvg_name, tvg_logo, group_title, url, attrs in rows:
+            yield (f'{prefix}"name":{name},"tvg_id":{tvg_id},"tvg_name":{tvg_name},"tvg_logo":{tvg_logo},'
+                   f'"group_title":{group_title},"url":{url},"tvg_url":{tvg_url},"attrs":{attrs or "{}"}}}')
+
+    def iter_json_array(self, batch: int = 1000):
+        """JSON-массив каналов кусками по batch каналов — для StreamingResponse"""
+        yield "["
+        items = []
+        first = True
+        for item in self.json_items():
+            items.append(item)
+            if len(items) >= batch:
+                yield ("" if first else ",") + ",".join(items)
+                first = False
+                items = []
+        if items:
+            yield ("" if first else ",") + ",".join(items)
+        yield "]"
+
+    def to_dicts(self) -> list:
+        """Список словарей каналов — для кода, который их меняет"""
+        return [row.to_dict() for row in self]
+
+
+def iter_json_response(fields: dict, channels: ChannelTable):
+    """
+    JSON-ответ из полей fields и списка "channels", кусками прямо из таблицы:
+    без jsonable_encoder и словаря на каждый канал
+    """
+    head = json.dumps(fields, ensure_ascii=False, separators=(",", ":"))
+    yield head[:-1] + ',"channels":'
+    yield from channels.iter_json_array()
+    yield "}"
+
+
+def _json_string(value) -> str:
+    # Та же функция, которой строки кодирует json.dumps(..., ensure_ascii=False)
+    return "null" if value is None else encode_basestring(value)
+
+
+def _json_interned(column: _InternColumn):
+    encoded = [_json_string(value) for value in column.values]
+    return map(encoded.__getitem__, column.codes)
+
+
+def _attrs(table: ChannelTable, index: int) -> dict:
+    text = table._attrs[index]
+    return json.loads(text) if text else {}
+
+
+_GETTERS = {
+    "name": lambda table, index: table._name[index],
+    "tvg_id": lambda table, index: table._tvg_id[index],
+    "tvg_name": lambda table, index: table._tvg_name[index],
+    "tvg_logo": lambda table, index: table._tvg_logo[index],
+    "group_title": lambda table, index: table._group_title[index],
+    "url": lambda table, index: table._url[index],
+    "tvg_url": lambda table, index: table.tvg_url,
+    "attrs": _attrs,
+}
+
+
+class ChannelRow:
+    """Канал таблицы, читается как словарь канала, но ничего не копирует"""
+    __slots__ = ("_table", "_index")
+
+    def __init__(self, table: ChannelTable, index: int):
+        self._table = table
+        self._index = index
+
+    def keys(self):
+        if self._table.ids is not None:
+            return ("id", *_GETTERS)
+        return tuple(_GETTERS)
+
+    def __contains__(self, key) -> bool:
+        return key in self.keys()
+
+    def __getitem__(self, key: str):
+        if key == "id" and self._table.ids is not None:
+            return self._table.ids[self._index]
+        getter = _GETTERS.get(key)
+        if getter is None:
+            raise KeyError(key)
+        return getter(self._table, self._index)
+
+    def get(self, key: str, default=None):
+        try:
+            return self[key]
+        except KeyError:
+            return default
+
+    def to_dict(self) -> dict:
+        return {key: self[key] for key in self.keys()}
+
+    def __repr__(self) -> str:
+        return f"ChannelRow({self.to_dict()!r})"
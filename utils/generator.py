@@ -1,18 +1,145 @@
-def generate_m3u(channels, tvg_url: str = None) -> str:
-    lines = ["#EXTM3U"]
-    if tvg_url:
-        lines[0] += f' url-tvg="{tvg_url}"'
+import re
+
+from utils.channels import FIELDS, ChannelTable
+
+# Поля канала, которые пишутся в #EXTINF под своими именами атрибутов
+_KNOWN_ATTRS = (
+    ("tvg-id", "tvg_id"),
+    ("tvg-name", "tvg_name"),
+    ("tvg-logo", "tvg_logo"),
+    ("group-title", "group_title"),
+)
+_KNOWN_KEYS = {key for key, _ in _KNOWN_ATTRS}
+
+# Порядок значений в кортежах, из которых собирается текст
+_ROW_KEYS = (*FIELDS, "attrs")
+
+# Имя атрибута, которое парсер сможет прочитать обратно
+_ATTR_KEY_RE = re.compile(r"[\w-]+")
+
+# Экранирования в M3U нет: значение атрибута заканчивается на первой кавычке,
+# а перевод строки рвёт запись, поэтому такие символы заменяем. Переводы строки —
+# все, на которых текст делит парсер (str.splitlines), а не только \r и \n
+_LINE_BREAKS = "\n\r\x0b\x0c\x1c\x1d\x1e\x85\u2028\u2029"
+_BREAK_RE = re.compile(f"[{_LINE_BREAKS}]")
+# Все, кроме \n: их в готовом куске не должно быть вовсе. Кусок проверяется
+# поиском каждого символа по отдельности — это быстрее поиска по классу символов
+_STRAY_BREAKS = _LINE_BREAKS[1:]
+_VALUE_TABLE = str.maketrans({'"': "'", **dict.fromkeys(_LINE_BREAKS, " ")})
+_LINE_TABLE = str.maketrans(dict.fromkeys(_LINE_BREAKS, " "))
+
+
+def _attr(key: str, value) -> str:
+    value = str(value)
+    if '"' in value or _BREAK_RE.search(value):
+        value = value.translate(_VALUE_TABLE)
+    return f' {key}="{value}"'
+
+
+def _line(value) -> str:
+    value = str(value)
+    if _BREAK_RE.search(value):
+        value = value.translate(_LINE_TABLE)
+    return value
+
+
+def _extra_attrs(attrs: dict) -> str:
+    """Нераспознанные парсером атрибуты канала в виде key="value" """
+    return "".join(
+        _attr(key, value)
+        for key, value in attrs.items()
+        if value is not None and key not in _KNOWN_KEYS and _ATTR_KEY_RE.fullmatch(key)
+    )
+
+
+def extinf_line(ch) -> str:
+    """Строка #EXTINF канала со всеми его атрибутами"""
+    extinf = "#EXTINF:-1"
+    for key, field in _KNOWN_ATTRS:
+        value = ch.get(field)
+        if value:
+            extinf += _attr(key, value)
+    attrs = ch.get("attrs")
+    if attrs:
+        extinf += _extra_attrs(attrs)
+    return f'{extinf}, {_line(ch["name"])}'
+
+
+def _entry(ch) -> str:
+    """Запись канала (#EXTINF и URL) с заменой недопустимых символов"""
+    return f'\n{extinf_line(ch)}\n{_line(ch["url"])}'
+
+
+def _dict_rows(channels):
     for ch in channels:
-        extinf = f'#EXTINF:-1'
-        if ch.get("tvg_id"):
-            extinf += f' tvg-id="{ch["tvg_id"]}"'
-        if ch.get("tvg_name"):
-            extinf += f' tvg-name="{ch["tvg_name"]}"'
-        if ch.get("tvg_logo"):
-            extinf += f' tvg-logo="{ch["tvg_logo"]}"'
-        if ch.get("group_title"):
-            extinf += f' group-title="{ch["group_title"]}"'
-        extinf += f', {ch["name"]}'
-        lines.append(extinf)
-        lines.append(ch["url"])
-    return "\n".join(lines)
\ No newline at end of file
+        get = ch.get
+        yield (ch["name"], get("tvg_id"), get("tvg_name"), get("tvg_logo"), get("group_title"), ch["url"],
+               get("attrs"))
+
+
+def iter_m3u_text(channels, tvg_url: str = None, batch: int = 500):
+    """
+    Отдаёт текст плейлиста кусками по batch каналов.
+    channels может быть любым итерируемым, в том числе потоком строк из базы,
+    или ChannelTable — тогда значения берутся прямо из её столбцов.
+    """
+    header = "#EXTM3U"
+    if tvg_url:
+        header += _attr("url-tvg", tvg_url)
+    yield header
+
+    rows = channels.tuples() if isinstance(channels, ChannelTable) else _dict_rows(channels)
+
+    # Куски собираются без проверки каждого значения; готовый кусок проверяется
+    # целиком: лишние кавычки или переводы строк — значит, в каком-то значении
+    # есть что заменять, и тогда кусок пересобирается через extinf_line
+    pending = []
+    parts = []
+    append = parts.append
+    quotes = 0
+    for row in rows:
+        pending.append(row)
+        name, tvg_id, tvg_name, tvg_logo, group_title, url, attrs = row
+        append("\n#EXTINF:-1")
+        if tvg_id:
+            append(f' tvg-id="{tvg_id}"')
+            quotes += 2
+        if tvg_name:
+            append(f' tvg-name="{tvg_name}"')
+            quotes += 2
+        if tvg_logo:
+            append(f' tvg-logo="{tvg_logo}"')
+            quotes += 2
+        if group_title:
+            append(f' group-title="{group_title}"')
+            quotes += 2
+        if attrs:
+            # Прочие атрибуты проверяются сразу: у них бывают и недопустимые имена
+            extra = _extra_attrs(attrs)
+            append(extra)
+            quotes += extra.count('"')
+        append(f', {name}\n{url}')
+        if len(pending) >= batch:
+            yield _checked("".join(parts), pending, quotes)
+            pending = []
+            parts = []
+            append = parts.append
+            quotes = 0
+    if pending:
+        yield _checked("".join(parts), pending, quotes)
+
+
+def _checked(text: str, rows: list, quotes: int) -> str:
+    if text.count("\n") != 2 * len(rows) or text.count('"') != quotes or any(char in text for char in _STRAY_BREAKS):
+        return "".join(_entry(dict(zip(_ROW_KEYS, row))) for row in rows)
+    return text
+
+
+def iter_m3u(channels, tvg_url: str = None, batch: int = 500):
+    """Тот же текст, что у generate_m3u, кусками в UTF-8 — для StreamingResponse и записи в файл"""
+    for text in iter_m3u_text(channels, tvg_url, batch):
+        yield text.encode("utf-8")
+
+
+def generate_m3u(channels, tvg_url: str = None) -> str:
+    return "".join(iter_m3u_text(channels, tvg_url))
@@ -0,0 +1,79 @@
+from datetime import datetime, timezone
+from email.utils import format_datetime, parsedate_to_datetime
+
+
+# Приставки ETag сжатых версий
+_ENCODING_TAGS = {"gzip": "gz", "br": "br"}
+
+
+def make_etag(content_hash: str) -> str:
+    return f'"{content_hash[:32]}"'
+
+
+def encoded_etag(etag: str, encoding: str) -> str:
+    """
+    ETag версии в сжатии encoding (None — без сжатия). Байты у версий разные,
+    поэтому и сильные ETag должны различаться (RFC 9110, 8.8.3): иначе кэши
+    и запросы Range смешают куски разных версий
+    """
+    if not encoding:
+        return etag
+    return f'{etag[:-1]}-{_ENCODING_TAGS.get(encoding, encoding)}"'
+
+
+def _identity_etag(tag: str) -> str:
+    """ETag версии без сжатия для ETag любой версии"""
+    tag = tag.removeprefix("W/")
+    for suffix in _ENCODING_TAGS.values():
+        if tag.endswith(f'-{suffix}"'):
+            return tag[:-len(suffix) - 2] + '"'
+    return tag
+
+
+def http_date(value: datetime) -> str:
+    """Дата для Last-Modified; в базе время хранится в UTC без таймзоны"""
+    return format_datetime(value.replace(tzinfo=timezone.utc, microsecond=0), usegmt=True)
+
+
+def is_not_modified(if_none_match: str, if_modified_since: str, etag: str, last_modified: datetime) -> bool:
+    """
+    Проверка условного запроса: True — клиенту можно ответить 304. etag —
+    ETag версии без сжатия; If-None-Match совпадает с ETag любой версии того же текста
+    """
+    # If-None-Match приоритетнее If-Modified-Since (RFC 9110, 13.2.2)
+    if if_none_match:
+        tags = [tag.strip() for tag in if_none_match.split(",")]
+        return "*" in tags or any(_identity_etag(tag) == etag for tag in tags)
+    if if_modified_since and last_modified:
+        try:
+            since = parsedate_to_datetime(if_modified_since)
+        except (TypeError, ValueError):
+            return False
+        if since.tzinfo is None:
+            since = since.replace(tzinfo=timezone.utc)
+        return last_modified.replace(tzinfo=timezone.utc, microsecond=0) <= since
+    return False
+
+
+def choose_encoding(accept_encoding: str, available) -> str:
+    """
+    Выбирает сжатие из доступных (в порядке предпочтения сервера) по заголовку
+    Accept-Encoding с учётом q-значений. None — отдавать без сжатия.
+    """
+    if not accept_encoding:
+        return None
+    weights = {}
+    for part in accept_encoding.split(","):
+        coding, _, params = part.strip().partition(";")
+        quality = 1.0
+        params = params.strip()
+        if params.startswith("q="):
+            try:
+                quality = float(params[2:])
+            except ValueError:
+                quality = 0.0
+        weights[coding.strip().lower()] = quality
+    for coding in available:
+        if weights.get(coding, weights.get("*", 0.0)) > 0:
+            return coding
+    return None
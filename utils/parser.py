@@ -1,63 +1,205 @@
+import os
 import re
-from models import Channel
+
+from utils.channels import ChannelTable
+
+# Атрибут вида key="value", key='value' или key=value. Ключ ищется только с
+# начала слова: иначе длинное слово без "=" проверялось бы с каждой буквы
+_ATTR_RE = re.compile(r'(?<![\w-])([\w-]++)=(?:"([^"]*+)"|\'([^\']*+)\'|([^\s,"\']*+))')
+
+# Вся строка #EXTINF за один проход: длительность, блок атрибутов и имя после запятой.
+# Квантификаторы захватывающие (*+, Python 3.11+): пробелы и значения не отдаются
+# назад, и строку вроде a=a=a=... без запятой поиск не делит перебором вариантов
+_EXTINF_RE = re.compile(
+    r'#EXTINF:\s*+-?[\d.]*+'
+    r'((?:\s*+[\w-]++=(?:"[^"]*+"|\'[^\']*+\'|[^\s,"\']*+))*+)'
+    r'\s*+,(.*)'
+)
+
+
+def parse_attributes(text: str) -> dict:
+    """Возвращает все атрибуты key=value из строки"""
+    return {key: dq or sq or bare for key, dq, sq, bare in _ATTR_RE.findall(text)}
+
+
+def parse_extinf(line: str):
+    """Разбирает строку #EXTINF, возвращает (атрибуты, имя)"""
+    match = _EXTINF_RE.match(line)
+    if match:
+        attrs_text, name = match.groups()
+    else:
+        # Нестандартная строка: берём атрибуты откуда угодно, имя — после первой запятой
+        attrs_text = line
+        comma = line.find(",")
+        name = line[comma + 1:] if comma != -1 else ""
+    name = name.strip() or "Unknown"
+    return parse_attributes(attrs_text) if attrs_text else {}, name
+
+
+def _add_channel(channels: ChannelTable, attrs: dict, name: str, url: str):
+    """Добавляет канал в таблицу; нераспознанные атрибуты уходят в attrs"""
+    pop = attrs.pop
+    channels.append(name, pop("tvg-id", None), pop("tvg-name", None), pop("tvg-logo", None),
+                    pop("group-title", None), url, attrs)
+
+
+class M3UParser:
+    """
+    Incremental M3U parser: accepts text in arbitrary chunks and appends
+    channels to self.channels as soon as their URL line is complete.
+
+    A line (or an #EXTINF/URL pair) split between chunks is buffered until
+    the rest of it arrives, so apart from the channels themselves memory use
+    does not depend on input size.
+    """
+
+    def __init__(self, tvg_url: str = None, expect_header: bool = True):
+        self.channels = ChannelTable(tvg_url)
+        # Для куска из середины файла заголовок уже разобран, и первая строка — обычная
+        self._header_checked = not expect_header
+        self._pending = None  # (атрибуты, имя) последнего #EXTINF, ожидающего URL
+        self._tail = ""  # Незавершённая последняя строка предыдущего куска
+
+    @property
+    def tvg_url(self):
+        return self.channels.tvg_url
+
+    def feed(self, text: str) -> int:
+        """Добавляет очередной кусок текста, возвращает число завершённых каналов"""
+        if self._tail:
+            text = self._tail + text
+        cut = max(text.rfind("\n"), text.rfind("\r")) + 1
+        self._tail = text[cut:]
+        return self.feed_lines(text[:cut].splitlines()) if cut else 0
+
+    def close(self) -> ChannelTable:
+        """Завершает разбор: дочитывает хвост и добавляет последний канал без URL"""
+        if self._tail:
+            self.feed_lines([self._tail])
+        self._tail = ""
+        if self._pending is not None:
+            _add_channel(self.channels, *self._pending, "")
+            self._pending = None
+        return self.channels
+
+    def feed_lines(self, lines) -> int:
+        """Разбирает целые строки, возвращает число завершённых каналов"""
+        channels = self.channels
+        before = len(channels)
+        pending = self._pending
+
+        for line in lines:
+            line = line.strip()
+            if not line:
+                continue
+
+            # Ищем url-tvg в первой непустой строке
+            if not self._header_checked:
+                self._header_checked = True
+                if line.startswith("#EXTM3U"):
+                    header = parse_attributes(line)
+                    channels.tvg_url = header.get("url-tvg") or header.get("x-tvg-url") or None
+                    continue
+
+            if line[0] == "#":
+                if line.startswith("#EXTINF:"):
+                    if pending is not None:
+                        # Предыдущий канал остался без URL
+                        _add_channel(channels, *pending, "")
+                    pending = parse_extinf(line)
+                # Прочие директивы (#EXTVLCOPT, #EXTGRP и т.п.) между #EXTINF и URL пропускаем
+                continue
+
+            # Строка без # — URL для последнего #EXTINF
+            if pending is not None:
+                _add_channel(channels, *pending, line)
+                pending = None
+
+        self._pending = pending
+        return len(channels) - before
 
 
 def parse_m3u(content: str) -> dict:
     """
-    Parse M3U content and return dictionary with channels and tvg_url
-    """
-    channels = []
-    tvg_url = None
-    # Ищем url-tvg в первой строке
-    lines = [line.strip() for line in content.splitlines() if line.strip()]
-    if lines and lines[0].startswith('#EXTM3U'):
-        match = re.search(r'url-tvg="([^"]+)"', lines[0])
-        if match:
-            tvg_url = match.group(1)
-
-    i = 0
-    while i < len(lines):
-        line = lines[i]
-        if line.startswith("#EXTINF:"):
-            extinf = line
-            # Извлекаем атрибуты
-            match = re.search(r'tvg-id=["\']?([^"\']*)["\']?', extinf)
-            tvg_id = match.group(1) if match else None
-
-            match = re.search(r'tvg-name=["\']?([^"\']*)["\']?', extinf)
-            tvg_name = match.group(1) if match else None
-
-            match = re.search(r'tvg-logo=["\']?([^"\']*)["\']?', extinf)
-            tvg_logo = match.group(1) if match else None
-
-            match = re.search(r'group-title=["\']?([^"\']*)["\']?', extinf)
-            group_title = match.group(1) if match else None
-
-            # Ищем имя канала
-            name_match = re.search(r",(.*)$", extinf)
-            name = name_match.group(1).strip() if name_match else "Unknown"
-
-            # Следующая строка — URL
-            i += 1
-            if i < len(lines) and not lines[i].startswith("#"):
-                url = lines[i]
-            else:
-                url = ""
-
-            channels.append(
-                Channel(
-                    name=name,
-                    tvg_id=tvg_id,
-                    tvg_name=tvg_name,
-                    tvg_logo=tvg_logo,
-                    group_title=group_title,
-                    url=url,
-                    tvg_url=tvg_url
-                )
-            )
-        i += 1
+    Parse M3U content and return dictionary with channels and tvg_url.
+
+    Channels are a ChannelTable: rows read like dicts with the fields of
+    models.Channel and the table can be passed straight to generate_m3u.
+    """
+    parser = M3UParser()
+    parser.feed_lines(content.splitlines())
+    channels = parser.close()
 
     return {
         "channels": channels,
-        "tvg_url": tvg_url
-    }
\ No newline at end of file
+        "tvg_url": channels.tvg_url
+    }
+
+
+def read_m3u_tvg_url(path: str):
+    """url-tvg из заголовка #EXTM3U файла, без чтения всего файла"""
+    with open(path, "rb") as f:
+        head = f.read(64 * 1024).decode("utf-8-sig", errors="ignore")
+    for line in head.splitlines():
+        line = line.strip()
+        if line:
+            if line.startswith("#EXTM3U"):
+                header = parse_attributes(line)
+                return header.get("url-tvg") or header.get("x-tvg-url") or None
+            return None
+    return None
+
+
+def split_m3u_file(path: str, shard_size: int) -> list:
+    """
+    Делит файл на куски примерно по shard_size байт для параллельного разбора.
+    Каждый кусок, кроме первого, начинается со строки #EXTINF, поэтому ни одна
+    запись не разрезается. Возвращает [(start, end), ...] в порядке файла.
+    """
+    needle = b"\n#EXTINF"
+    size = os.path.getsize(path)
+    bounds = [0]
+    with open(path, "rb") as f:
+        pos = shard_size
+        while pos < size:
+            f.seek(pos)
+            found = -1
+            while found == -1:
+                window = f.read(1024 * 1024)
+                if len(window) < len(needle):
+                    break
+                found = window.find(needle)
+                if found == -1:
+                    # Следующее окно перекрывает хвост текущего на длину needle
+                    pos += len(window) - len(needle) + 1
+                    f.seek(pos)
+                else:
+                    found += pos
+            if found == -1:
+                break
+            bounds.append(found + 1)
+            pos = found + 1 + shard_size
+    bounds.append(size)
+    return list(zip(bounds, bounds[1:]))
+
+
+def parse_m3u_range(path: str, start: int, end: int, tvg_url: str = None) -> ChannelTable:
+    """Каналы из куска файла [start, end), полученного от split_m3u_file"""
+    with open(path, "rb") as f:
+        f.seek(start)
+        data = f.read(end - start)
+    text = data.decode("utf-8-sig" if start == 0 else "utf-8", errors="ignore")
+    parser = M3UParser(tvg_url=tvg_url, expect_header=start == 0)
+    parser.feed_lines(text.splitlines())
+    return parser.close()
+
+
+def parse_m3u_shard(path: str, start: int, end: int, tvg_url: str = None) -> tuple:
+    """
+    Разбирает кусок файла в процессе пула и сразу кодирует каналы в JSON,
+    чтобы обратно передавалась одна строка, а не тысячи каналов.
+    Возвращает (число каналов, элементы JSON-массива через запятую).
+    """
+    channels = parse_m3u_range(path, start, end, tvg_url)
+    return len(channels), ",".join(channels.json_items())
+
@@ -0,0 +1,63 @@
+"""
+Запросы к URL, которые задают пользователи (источники подписок, потоки
+каналов): только http(s) и только на публичные адреса. Иначе сервер можно
+заставить ходить на localhost, во внутреннюю сеть и к метаданным облака и
+читать ответы или хотя бы их коды.
+
+check_request и check_request_async — хуки httpx на событие request: клиент
+вызывает их перед каждым запросом, в том числе после каждого редиректа.
+allow_private снимает проверку адресов (источники и потоки в своей сети).
+"""
+import asyncio
+import ipaddress
+import socket
+
+import httpx
+
+
+class BlockedURL(ValueError):
+    """Запрос к этому URL запрещён"""
+
+
+def is_public(address: str) -> bool:
+    ip = ipaddress.ip_address(address.split("%", 1)[0])
+    if ip.version == 6 and ip.ipv4_mapped:
+        ip = ip.ipv4_mapped
+    return ip.is_global and not ip.is_multicast
+
+
+def _check_scheme(request: httpx.Request):
+    if request.url.scheme not in ("http", "https"):
+        raise BlockedURL("Нужна ссылка http:// или https://")
+
+
+def _check_addresses(host: str, infos):
+    # Проверяются все адреса: соединиться httpx может с любым из них
+    if not all(is_public(info[4][0]) for info in infos):
+        raise BlockedURL(f"Адрес {host} во внутренней сети — такие запросы запрещены")
+
+
+def check_request(request: httpx.Request, allow_private: bool = False):
+    """Хук для httpx.Client"""
+    _check_scheme(request)
+    if allow_private:
+        return
+    host = request.url.host
+    try:
+        infos = socket.getaddrinfo(host, request.url.port, type=socket.SOCK_STREAM)
+    except (socket.gaierror, UnicodeError):
+        raise BlockedURL(f"Не удалось найти адрес {host}")
+    _check_addresses(host, infos)
+
+
+async def check_request_async(request: httpx.Request, allow_private: bool = False):
+    """Хук для httpx.AsyncClient: имя разрешается, не останавливая event loop"""
+    _check_scheme(request)
+    if allow_private:
+        return
+    host = request.url.host
+    try:
+        infos = await asyncio.get_running_loop().getaddrinfo(host, request.url.port, type=socket.SOCK_STREAM)
+    except (socket.gaierror, UnicodeError):
+        raise BlockedURL(f"Не удалось найти адрес {host}")
+    _check_addresses(host, infos)